@@ -6,8 +6,8 @@ This module acts as the main interface while delegating specific tasks to specia
 import warnings
 warnings.filterwarnings("ignore", category=FutureWarning)
 import os
-import base64
-from datetime import datetime
+import hashlib
+import threading
 from PIL import Image
 
 # Import modular components
@@ -19,99 +19,129 @@ from image_analyzer import analyze_medical_image, format_analysis_for_prompt
 
 # Import database operations
 from user_db_operations import (
-    save_post, save_assistant_post, 
-    get_history_by_user_id, create_new_chat_thread, update_thread_title,
-    save_structured_response
+    get_history_by_user_id, create_new_chat_thread, build_turn, encode_cursor, HistoryRecord,
+    get_thread_summary
+)
+from config import Config
+from write_behind import save_turn, flush_pending_turns
+from session_store import SessionStore, UserSession
+from image_parts import ImagePartCache
+from image_ingest import THUMB_SUFFIX, ImageContext, ingest_upload, has_derivatives
+from upload_store import is_blob_key
+from session_state import create_session_state
+from turn_guard import UserTurnGuard
+from outbound_metrics import OutboundBytes
+from context_window import (
+    build_transcript, compact_transcript, split_summary, summary_contents, get_summarizer
 )
-
-# --- Global In-Memory Stores for Thread Management ---
-current_threads = {} 
-gemini_chat_sessions = {}
-chat_histories = {} 
 
 # Define the UPLOAD_FOLDER path (must match app.py)
 UPLOAD_FOLDER = 'uploads' 
 
+# Downscaled, pre-encoded image parts shared by every session that replays the same upload
+image_parts = ImagePartCache(
+    UPLOAD_FOLDER,
+    max_entries=Config.IMAGE_PART_CACHE_ENTRIES,
+    max_bytes=Config.IMAGE_PART_CACHE_BYTES,
+    max_side=Config.IMAGE_PART_MAX_SIDE,
+    quality=Config.IMAGE_PART_QUALITY,
+    part_max_bytes=Config.IMAGE_PART_MAX_BYTES,
+)
+IMAGE_PART_REF_BYTES = 64
+
+# Derivative creation is single-flight per blob key: concurrent uploads of the same bytes share
+# one blob, and only the first of them decodes it (the others wait and reuse its derivatives)
+INGEST_LOCK_STRIPES = 64
+_ingest_locks = [threading.Lock() for _ in range(INGEST_LOCK_STRIPES)]
+
+# Bytes sent to Gemini per turn (history + new message) and the outbound image policy's decisions
+outbound = OutboundBytes()
+
 # --- Utility Functions ---
 
-def _load_image_base64_from_filename(image_filename):
+# History references uploads by URL (served with HTTP caching by app.uploaded_file) instead of inlining them
+UPLOAD_URL_PREFIX = '/static/uploads/'
+IMAGE_MIME_TYPES = {'.png': 'image/png', '.gif': 'image/gif', '.webp': 'image/webp', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg'}
+
+def _image_ref(image_filename):
     """
-    Reads a saved image file and returns its content as a Base64 string 
-    with MIME type prefix for direct display in HTML (for history).
+    Returns the reference the UI needs to display a saved upload: its URL, the URL of its
+    chat bubble thumbnail, MIME type and filename. Nothing is read from disk.
     """
     if not image_filename:
         return None
+    mime_type = IMAGE_MIME_TYPES.get(os.path.splitext(image_filename)[1].lower(), 'image/jpeg')
+    return {
+        "url": UPLOAD_URL_PREFIX + image_filename,
+        "thumb_url": UPLOAD_URL_PREFIX + image_filename + THUMB_SUFFIX,
+        "mime_type": mime_type,
+        "filename": image_filename
+    }
 
-    try:
-        file_path = os.path.join(UPLOAD_FOLDER, image_filename)
-        
-        if not os.path.exists(file_path):
-            print(f"Warning: Image file not found at {file_path}")
+def prepare_uploaded_image(file_path, image_filename):
+    """
+    Runs the upload-time derivative pipeline (see image_ingest) on a freshly saved upload
+    and keeps its Gemini part in the part cache for the turn that follows.
+
+    Returns:
+        ImageContext or None: the request's decoded views of the image; None if the file
+        is not a readable image
+    """
+    with _ingest_locks[hash(image_filename) % INGEST_LOCK_STRIPES]:
+        # Content already stored (deduplicated upload): its derivatives exist, nothing to decode
+        if has_derivatives(file_path):
+            return ImageContext(file_path, fast=Config.IMAGE_PREPROCESS_FAST, decode_side=Config.IMAGE_PART_MAX_SIDE)
+        try:
+            derivatives = ingest_upload(file_path, thumb_side=Config.IMAGE_THUMB_SIDE,
+                                        max_side=Config.IMAGE_PART_MAX_SIDE, quality=Config.IMAGE_PART_QUALITY,
+                                        thumb_quality=Config.IMAGE_THUMB_QUALITY, fast=Config.IMAGE_PREPROCESS_FAST,
+                                        max_bytes=Config.IMAGE_PART_MAX_BYTES)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            print(f"Rejected upload {image_filename}: {e}")
             return None
-            
-        # Determine MIME type from the file extension
-        mime_type = 'image/jpeg' # Default fallback
-        if image_filename.lower().endswith('.png'):
-            mime_type = 'image/png'
-        elif image_filename.lower().endswith('.gif'):
-            mime_type = 'image/gif'
-        elif image_filename.lower().endswith('.jpg') or image_filename.lower().endswith('.jpeg'):
-            mime_type = 'image/jpeg'
-
-        with open(file_path, 'rb') as f:
-            base64_data = base64.b64encode(f.read()).decode('utf-8')
-            return {
-                "base64_data": base64_data,
-                "mime_type": mime_type,
-                "filename": image_filename
-            }
-            
-    except Exception as e:
-        print(f"Error loading image {image_filename} for history: {e}")
-        return None
+    image_parts.prime(image_filename, derivatives["part"])
+    return derivatives["context"]
 
 def format_db_record_for_session(record):
-    """Converts a database record into a format suitable for Flask session/UI display."""
-    
-    role_val = record.get('role', 'user') 
+    """Converts a HistoryRecord into a format suitable for Flask session/UI display."""
     
-    # Load image data if filename exists in the record
-    image_data = _load_image_base64_from_filename(record.get("image_filename"))
+    # Reference the image by URL if the record has one
+    image_data = _image_ref(record.image_filename)
 
     return {
-        "role": role_val,
-        "content": record.get("text_content"),
+        "role": record.role or 'user',
+        "content": record.text_content,
         "image": image_data, 
-        "created_at": record["created_at"].strftime("%Y-%m-%d %H:%M:%S") if isinstance(record.get("created_at"), datetime) else str(record.get("created_at")),
-        "db_id": record["id"],
-        "thread_id": record.get("thread_id") 
+        # str() of a whole-second datetime is "YYYY-MM-DD HH:MM:SS", without strftime's parsing cost
+        "created_at": str(record.created_at),
+        "db_id": record.id,
+        "thread_id": record.thread_id
     }
 
 def format_history_for_gemini(db_history):
     """
-    Formats DB records into Gemini API content objects for chat context. 
+    Formats HistoryRecords into Gemini API content objects for chat context. 
     Includes the image part for previous user turns.
     """
     formatted_history = []
     for record in db_history:
         # The model role is 'model' in the API, user role is 'user'
-        role = "model" if record['role'] == 'assistant' else "user"
+        role = "model" if record.role == 'assistant' else "user"
         
         # Construct the parts list for the message
         parts = []
         
         # 1. Add text content (if present)
-        if record.get('text_content'):
-            parts.append(record['text_content'])
+        if record.text_content:
+            parts.append(record.text_content)
             
-        # 2. Add image content for user messages (if present)
-        if record.get('image_filename') and role == 'user':
-            try:
-                file_path = os.path.join(UPLOAD_FOLDER, record['image_filename'])
-                pil_image = Image.open(file_path)
-                parts.append(pil_image)
-            except Exception as e:
-                print(f"Warning: Failed to load image {record['image_filename']} for API history: {e}")
+        # 2. Add image content for user messages (if present), pre-encoded and shared via the part cache
+        if record.image_filename and role == 'user':
+            image_part = image_parts.get_part(record.image_filename)
+            if image_part:
+                parts.append(image_part)
+            else:
+                print(f"Warning: Failed to load image {record.image_filename} for API history")
 
         if parts:
             formatted_history.append({
@@ -121,75 +151,242 @@ def format_history_for_gemini(db_history):
         
     return formatted_history
 
+def _estimate_parts_bytes(parts):
+    """Estimated memory held by Gemini message parts (text length, decoded image size)."""
+    size = 0
+    for part in parts:
+        if isinstance(part, str):
+            size += len(part)
+        elif isinstance(part, Image.Image):
+            size += part.width * part.height * len(part.getbands())
+        elif isinstance(part, dict):
+            # Encoded image parts are owned (and budgeted) by image_parts; sessions only hold a reference
+            size += IMAGE_PART_REF_BYTES
+    return size
+
+# --- Per-User Session Store ---
+
+def _build_session(user_id, thread_id):
+    """
+    Builds a UserSession for a thread from the database: the most recent page of UI history,
+    the cursor for older messages, and a Gemini chat session primed with the thread's stored
+    summary plus its most recent messages (see context_window).
+    """
+    if not thread_id:
+        return UserSession(None, chat_session=create_chat_session())
+
+    # Make sure turns still queued for write-behind are visible to the read below
+    flush_pending_turns()
+    # One bounded read however long the thread is: enough for the UI page and the context window
+    window = max(Config.HISTORY_PAGE_SIZE, Config.CONTEXT_MAX_MESSAGES)
+    db_history = get_history_by_user_id(user_id, thread_id=thread_id, limit=window + 1)
+    has_older = len(db_history) > window
+    db_history = db_history[-window:]
+
+    # The UI renders only the most recent page; older messages are fetched on scroll through the cursor kept here
+    page = db_history[-Config.HISTORY_PAGE_SIZE:]
+    history = [format_db_record_for_session(record) for record in page]
+    history_cursor = encode_cursor(page[0].created_at, page[0].id) if has_older or len(db_history) > len(page) else None
+
+    summary_row = get_thread_summary(user_id, thread_id)
+    transcript = build_transcript(summary_row, db_history)
+    if has_older and (summary_row is None or summary_row["last_post_id"] < db_history[0].id):
+        # Messages before the loaded window aren't in the summary yet: fold them in the background
+        get_summarizer().request(user_id, thread_id)
+
+    chat_session, context_bytes = _prime_chat_session(transcript)
+    return UserSession(thread_id, chat_session=chat_session, history=history, history_cursor=history_cursor,
+                       transcript=transcript, context_bytes=context_bytes)
+
+def _restore_session(state):
+    """Rebuilds a UserSession from a shared snapshot (see session_store.session_to_state) without a DB query."""
+    chat_session, context_bytes = _prime_chat_session(state["transcript"])
+    history = state["history"]
+    for message in history:
+        # Rebuild image references from the filename (older snapshots carried other fields)
+        if message.get("image"):
+            message["image"] = _image_ref(message["image"].get("filename"))
+    return UserSession(state["thread_id"], chat_session=chat_session, history=history,
+                       history_cursor=state["history_cursor"], transcript=state["transcript"],
+                       context_bytes=context_bytes, page_stale=state.get("page_stale", False))
+
+def _refresh_history_page(user_id, user_session):
+    """
+    Re-reads the newest page of a live session's thread (and the cursor for the messages before
+    it) after turns pushed older messages out of the in-memory page. Left stale if the read fails.
+    """
+    flush_pending_turns()
+    records = get_history_by_user_id(user_id, thread_id=user_session.thread_id, limit=Config.HISTORY_PAGE_SIZE + 1)
+    if not records:
+        return
+    page = records[-Config.HISTORY_PAGE_SIZE:]
+    user_session.history = [format_db_record_for_session(record) for record in page]
+    user_session.history_cursor = encode_cursor(page[0].created_at, page[0].id) if len(records) > len(page) else None
+    user_session.page_stale = False
+    sessions.put(user_id, user_session)
+
+def _prime_chat_session(transcript):
+    """Creates a Gemini chat session holding `transcript` as context. Returns (chat_session, estimated bytes)."""
+    summary, entries = split_summary(transcript)
+    gemini_history = summary_contents(summary) if summary else []
+    if entries:
+        records = [HistoryRecord(None, None, role, text, image_filename, None) for role, text, image_filename in entries]
+        gemini_history += format_history_for_gemini(records)
+    context_bytes = sum(_estimate_parts_bytes(content["parts"]) for content in gemini_history)
+    return create_chat_session(history=gemini_history), context_bytes
+
+def _compact_session(user_id, user_session):
+    """Re-primes a live session whose context outgrew the budget with a shorter transcript."""
+    transcript = compact_transcript(user_session.transcript)
+    if transcript is None:
+        return
+    user_session.transcript = transcript
+    user_session.chat_session, user_session.context_bytes = _prime_chat_session(transcript)
+    # The in-memory fold is a quick digest; the summarizer replaces it with a proper summary in the DB
+    get_summarizer().request(user_id, user_session.thread_id)
+
+# Bounded replacement for the old module-level dicts; evicted sessions are rebuilt on demand.
+# With SESSION_STATE_BACKEND=sqlite|redis every worker reads and writes the same session state.
+sessions = SessionStore(
+    loader=_build_session,
+    max_entries=Config.SESSION_MAX_ENTRIES,
+    max_bytes=Config.SESSION_MAX_BYTES,
+    idle_ttl=Config.SESSION_IDLE_TTL,
+    thread_ttl=Config.SESSION_STATE_TTL,
+    shared=create_session_state(Config),
+    restore=_restore_session,
+)
+
+# Serializes each user's turns and session changes; different users never wait on each other
+turn_guard = UserTurnGuard(
+    stripes=Config.CHAT_LOCK_STRIPES,
+    policy=Config.CHAT_CONCURRENCY_POLICY,
+    wait_timeout=Config.CHAT_TURN_WAIT_TIMEOUT,
+)
+
+def get_active_thread(user_id):
+    """Returns the thread the user last worked in, or None."""
+    return sessions.last_thread(user_id)
+
+def clear_active_thread(user_id, thread_id=None):
+    """Forgets the user's active thread (only if it is `thread_id`, when given); never waits past the turn timeout."""
+    with turn_guard.hold(user_id, force=True):
+        if thread_id is None or sessions.last_thread(user_id) == thread_id:
+            sessions.remove(user_id)
+
+def end_user_session(user_id):
+    """Releases everything held in memory for a user (called on logout); never waits past the turn timeout."""
+    with turn_guard.hold(user_id, force=True):
+        sessions.remove(user_id)
+
+def get_session_stats():
+    """Returns session store gauges: entries, estimated_bytes, evictions, hits/misses, rebuilds and rebuilds avoided."""
+    return sessions.stats()
+
+def get_image_part_stats():
+    """Returns image part cache counters (hits, misses, evictions, bytes, encodes)."""
+    return image_parts.stats()
+
+def get_turn_stats():
+    """Returns per-user turn serialization counters (queued, coalesced, rejected, timeouts)."""
+    return turn_guard.stats()
+
+def get_outbound_stats():
+    """Returns bytes sent to Gemini per turn (total, history, images, average, max) and image policy counts."""
+    return outbound.stats()
+
 # --- Main API Functions ---
 
 def initialize_chat_history(user_id, username, thread_id_to_load=None):
-    """Initializes history and Gemini session on login/thread switch."""
-    global current_threads, gemini_chat_sessions, chat_histories
-
+    """
+    Initializes history and Gemini session on login/thread switch. The session is only rebuilt
+    from the database when the active thread changes or it is missing; a refresh of the same
+    thread reuses the live one.
+    """
     active_thread_id = thread_id_to_load
     
-    if active_thread_id is None:
-        active_thread_id = current_threads.get(user_id)
-        
-    current_threads[user_id] = active_thread_id
+    with turn_guard.hold(user_id):
+        if active_thread_id is None:
+            active_thread_id = sessions.last_thread(user_id)
 
-    if active_thread_id:
-        db_history = get_history_by_user_id(user_id, thread_id=active_thread_id)
-        chat_histories[user_id] = [format_db_record_for_session(record) for record in db_history]
-    else:
-        db_history = []
-        chat_histories[user_id] = []
-
-    if user_id in gemini_chat_sessions:
-        del gemini_chat_sessions[user_id]
-        
-    gemini_history = format_history_for_gemini(db_history) if db_history else []
-    gemini_chat_sessions[user_id] = create_chat_session(history=gemini_history)
+        user_session = sessions.activate(user_id, active_thread_id, _build_session)
+        if user_session.page_stale:
+            # A refresh after many turns: render only the newest page, as a fresh build would
+            _refresh_history_page(user_id, user_session)
 
     return active_thread_id
 
 def get_history(user_id):
     """Returns the in-memory chat history for the current UI session."""
-    return chat_histories.get(user_id, [])
+    user_session = sessions.get(user_id)
+    return user_session.history if user_session else []
+
+def get_history_cursor(user_id):
+    """Returns the cursor for messages older than the rendered page, or None if there are none."""
+    user_session = sessions.get(user_id)
+    return user_session.history_cursor if user_session else None
 
 def reset_chat_history(user_id):
     """Creates a new thread, resets in-memory history, and initializes a new Gemini session."""
-    global current_threads, gemini_chat_sessions
-    
     new_thread_id = create_new_chat_thread(user_id)
     if new_thread_id is None:
         raise Exception("Database error: Failed to create new chat thread.")
 
-    current_threads[user_id] = new_thread_id
-    chat_histories[user_id] = []
-    
-    if user_id in gemini_chat_sessions:
-        del gemini_chat_sessions[user_id]
-    
-    gemini_chat_sessions[user_id] = create_chat_session()
+    with turn_guard.hold(user_id):
+        sessions.put(user_id, UserSession(new_thread_id, chat_session=create_chat_session()))
 
 # --- Main AI Function ---
 
-def get_gemini_response(user_id, user_text, pil_image=None, image_filename=None):
+def _session_history(chat_session):
+    """The history the SDK will re-send with the next message (None if it can't be read)."""
+    try:
+        return getattr(chat_session, "history", None)
+    except Exception:
+        return None
+
+def _turn_fingerprint(user_text, image_filename):
+    """Identifies a repeated submission of the same message (used by the "coalesce" policy)."""
+    digest = None
+    if is_blob_key(image_filename):
+        # Content-addressed: the name already is the digest
+        digest = image_filename
+    elif image_filename:
+        try:
+            with open(os.path.join(UPLOAD_FOLDER, image_filename), 'rb') as f:
+                digest = hashlib.sha1(f.read()).hexdigest()
+        except OSError:
+            digest = image_filename
+    return (user_text, digest)
+
+def get_gemini_response(user_id, user_text, pil_image=None, image_filename=None, image_context=None):
     """
     Sends a query and an optional image to the Gemini API and returns the response.
     This is the main entry point for chat interactions.
+
+    Turns for the same user run one at a time (CHAT_CONCURRENCY_POLICY decides whether a
+    concurrent one waits, shares the in-flight result, or raises TurnRejectedError).
     """
-    global gemini_chat_sessions, chat_histories, current_threads
-    
-    # 1. Pre-checks and Initialization 
-    thread_id = current_threads.get(user_id)
-    if not thread_id:
+    fingerprint = _turn_fingerprint(user_text, image_filename) if turn_guard.policy == "coalesce" else None
+    return turn_guard.run(user_id, lambda: _run_chat_turn(user_id, user_text, pil_image, image_filename, image_context),
+                          fingerprint=fingerprint)
+
+def _run_chat_turn(user_id, user_text, pil_image, image_filename, image_context=None):
+    # 1. Pre-checks and Initialization (rebuilds the session from the DB if it was evicted)
+    user_session = sessions.get_or_load(user_id)
+    if user_session is None or not user_session.thread_id:
         # Lazily create thread on first message
         thread_id = create_new_chat_thread(user_id)
         if not thread_id:
             return {"content": "Failed to create chat session.", "metadata": {"status": "error"}}
-        current_threads[user_id] = thread_id
         # Start a fresh Gemini chat session for this user
-        gemini_chat_sessions[user_id] = create_chat_session()
+        user_session = UserSession(thread_id, chat_session=create_chat_session())
+        sessions.put(user_id, user_session)
+
+    # Long conversations: keep the Gemini context within the token budget
+    _compact_session(user_id, user_session)
 
-    chat_session = gemini_chat_sessions.get(user_id)
+    thread_id = user_session.thread_id
+    chat_session = user_session.chat_session
     response_text = "I'm sorry, my AI model is currently unavailable."
     status = "error"
     
@@ -197,7 +394,8 @@ def get_gemini_response(user_id, user_text, pil_image=None, image_filename=None)
     image_analysis_result = None
     if image_filename:
         image_path = os.path.join(UPLOAD_FOLDER, image_filename)
-        image_analysis_result = analyze_medical_image(image_path)
+        # The request's ImageContext (from the upload) serves detection and preprocessing without re-decoding
+        image_analysis_result = analyze_medical_image(image_path, image_context)
         print(f"Image analysis result: {image_analysis_result}")
 
     # 3. Check if query is symptom-based
@@ -237,57 +435,69 @@ def get_gemini_response(user_id, user_text, pil_image=None, image_filename=None)
             
             user_parts.append(structured_prompt)
 
-        if pil_image:
-            user_parts.append(pil_image)
+        if image_filename or pil_image:
+            # Send the part stored at upload time (reused when the thread is replayed) rather than a raw PIL image
+            if image_context is not None:
+                image_part = image_context.gemini_part(Config.IMAGE_PART_MAX_SIDE, Config.IMAGE_PART_QUALITY,
+                                                       Config.IMAGE_PART_MAX_BYTES)
+            else:
+                image_part = image_parts.get_part(image_filename) or pil_image
+            if image_part:
+                user_parts.append(image_part)
+                # Whichever path produced the part (fresh ingest, deduplicated upload, fallback encode),
+                # the policy decision was stored with it: nothing is re-read to count it
+                if image_context is None and image_filename:
+                    image_context = ImageContext(os.path.join(UPLOAD_FOLDER, image_filename))
+                outbound.record_image(image_context is not None and image_context.passthrough)
 
         if not user_parts:
             return {"content": "No query or image provided.", "metadata": {"status": "mocked"}}
 
         # 6. Call the Gemini API for symptom queries
+        # The SDK appends to its history on success: measure what is sent now, count it once the outcome is known
+        sent_history = list(_session_history(chat_session) or ())
         api_response = send_message(chat_session, user_parts)
+        outbound.record_turn(sent_history, user_parts, delivered=api_response.get("delivered", True))
         response_text = api_response["content"]
         status = api_response["status"]
     
-    # 6. Update DB and In-Memory History
-    
-    # User Message Save
-    try:
-        if not save_post(user_id, thread_id, user_text, image_filename, role='user'): 
-            print("Warning: Failed to save user post to database.")
-    except Exception as db_e:
-        print(f"CRITICAL DB SAVE ERROR (User Message): {db_e}")
+    # 6. Persist the whole turn (user post, AI post, structured response, title) in one transaction
+    assistant_text = None
+    structured = None
+    if status == "complete":
+        assistant_text = response_text
 
-    # AI Message Save
-    if status == "complete": 
-        try:
-            if not save_assistant_post(user_id, thread_id, response_text, role='assistant'):
-                print("Warning: Failed to save AI post to database.")
-        except Exception as db_e:
-            print(f"CRITICAL DB SAVE ERROR (AI Message): {db_e}")
-        
-        # Save structured response if it's a symptom-based query
+        # Structured response only for symptom-based queries
         if is_symptom and user_text:
             try:
                 case_description, disease, probability, severity, medication, other_diagnoses, disclaimer = parse_structured_response(response_text)
-                if not save_structured_response(user_id, thread_id, user_text, case_description, disease, probability, severity, medication, other_diagnoses, disclaimer):
-                    print("Warning: Failed to save structured response to database.")
+                structured = {
+                    "disease": disease,
+                    "probability": probability,
+                    "severity": severity,
+                    "medication": medication,
+                    "other_diagnoses": other_diagnoses,
+                    "conclusion": disclaimer,
+                }
             except Exception as struct_e:
-                print(f"Warning: Failed to parse or save structured response: {struct_e}")
+                print(f"Warning: Failed to parse structured response: {struct_e}")
+
+    # 7. Thread title comes from the first user message
+    title = None
+    if user_text and len(user_session.history) == 0:
+        title = user_text.strip()[:60] or None
 
-    # 7. Update thread title on first user message
     try:
-        if user_text and len(chat_histories.get(user_id, [])) == 0:
-            title = user_text.strip()[:60]
-            if title:
-                update_thread_title(thread_id, user_id, title)
-    except Exception as title_err:
-        print(f"Thread title update warning: {title_err}")
+        turn = build_turn(user_id, thread_id, user_text, image_filename,
+                          assistant_text=assistant_text, structured=structured, title=title)
+        # Queued for the background writer when write-behind is enabled
+        if not save_turn(turn):
+            print("Warning: Failed to save chat turn to database.")
+    except Exception as db_e:
+        print(f"CRITICAL DB SAVE ERROR (Chat Turn): {db_e}")
 
     # 8. Update In-Memory History
-    if user_id not in chat_histories:
-        chat_histories[user_id] = []
-        
-    user_image_data_for_history = _load_image_base64_from_filename(image_filename)
+    user_image_data_for_history = _image_ref(image_filename)
 
     user_message_for_history = {
         "role": "user",
@@ -295,7 +505,8 @@ def get_gemini_response(user_id, user_text, pil_image=None, image_filename=None)
         "image": user_image_data_for_history, 
         "thread_id": thread_id
     }
-    chat_histories[user_id].append(user_message_for_history) 
+    user_session.history.append(user_message_for_history)
+    user_session.transcript.append(["user", user_text, image_filename])
     
     ai_message_for_history = {
         "role": "assistant",
@@ -304,7 +515,21 @@ def get_gemini_response(user_id, user_text, pil_image=None, image_filename=None)
         "thread_id": thread_id
     }
     if status == "complete" or status == "mocked":
-        chat_histories[user_id].append(ai_message_for_history)
+        user_session.history.append(ai_message_for_history)
+        user_session.transcript.append(["assistant", response_text, None])
+
+    # The Gemini chat object now also holds this turn
+    user_session.context_bytes += _estimate_parts_bytes([user_text or "", response_text or ""])
+    if image_filename:
+        user_session.context_bytes += IMAGE_PART_REF_BYTES
+    # Keep the rendered page at HISTORY_PAGE_SIZE messages; the cursor for the ones dropped here
+    # (whose ids write-behind may not know yet) is read from the DB on the next render
+    if len(user_session.history) > Config.HISTORY_PAGE_SIZE:
+        del user_session.history[:-Config.HISTORY_PAGE_SIZE]
+        user_session.page_stale = True
+    # Re-store so the size estimate and LRU position reflect the new turn (not if the user logged
+    # out or deleted the thread while it ran: the turn is saved, the session stays gone)
+    sessions.update(user_id, user_session)
 
     # 9. Return the result
     return {
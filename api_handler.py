@@ -69,12 +69,14 @@ def send_message(chat_session, user_parts):
         user_parts (list): List of content parts (text and/or images) to send
         
     Returns:
-        dict: Dictionary with 'content' (response text) and 'status' ('complete', 'error', etc.)
+        dict: Dictionary with 'content' (response text) and 'status' ('complete', 'error', etc.);
+            'delivered' is False when Gemini did not answer the request
     """
     if not chat_session or chat_session == "MOCK_SESSION":
         return {
             "content": "I'm sorry, my AI model is currently unavailable.",
-            "status": "error"
+            "status": "error",
+            "delivered": False
         }
     
     try:
@@ -87,14 +89,35 @@ def send_message(chat_session, user_parts):
         print(f"Gemini API Resource Exhausted Error: {e}")
         return {
             "content": "I've hit my usage limit for this conversation. Please start a new chat.",
-            "status": "complete"
+            "status": "complete",
+            "delivered": False
         }
     except Exception as e:
         print(f"Gemini API Error: {e}")
         return {
             "content": "An internal API error occurred.",
-            "status": "error"
+            "status": "error",
+            "delivered": False
         }
 
+def generate_text(prompt):
+    """
+    Sends a single, stateless prompt to the Gemini API (used for background tasks such as summaries).
+    
+    Args:
+        prompt (str): The prompt text
+        
+    Returns:
+        str or None: The response text, or None if the client is unavailable or the call failed
+    """
+    gemini_client = get_gemini_client()
+    if not gemini_client:
+        return None
+    try:
+        return gemini_client.generate_content(prompt).text
+    except Exception as e:
+        print(f"Gemini API Error (generate_text): {e}")
+        return None
+
 # Initialize client on module import
 initialize_gemini_client()
\ No newline at end of file
@@ -6,20 +6,27 @@ from flask import Flask, render_template, request, redirect, url_for, session, f
 # Assuming your user/DB management functions are here
 from user_db_operations import (
     register_user, get_user_by_email, get_user_by_id, get_user_threads,
-    delete_thread, get_thread_by_id
+    delete_thread, get_thread_by_id, get_history_by_user_id, next_page_cursor, decode_cursor
 )
 from db_manager import setup_database 
+from write_behind import get_writer
 # Chat/AI interaction functions
 from api_connection import (
     get_gemini_response, initialize_chat_history, get_history, reset_chat_history,
-    current_threads
+    get_active_thread, clear_active_thread, end_user_session, get_history_cursor,
+    format_db_record_for_session, prepare_uploaded_image
 )
+from image_ingest import original_for_thumbnail, ensure_thumbnail
+from upload_store import UploadStore, is_content_addressed
+from image_analyzer import model_registry
+from turn_guard import TurnRejectedError
+from config import Config
 from werkzeug.security import generate_password_hash, check_password_hash
 from markupsafe import Markup
-from PIL import Image
 from datetime import datetime
 import os
 import markdown 
+import threading
 import traceback # For better error logging
 
 app = Flask(__name__, static_folder='static')
@@ -32,6 +39,35 @@ app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024  # 5 MB upload cap
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
     os.makedirs(app.config['UPLOAD_FOLDER'])
 
+# Uploads are stored once per distinct content, under sharded SHA-256 paths
+upload_store = UploadStore(app.config['UPLOAD_FOLDER'])
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# The image models are loaded and warmed up in the background by the serving process itself (first
+# request, or the __main__ entry point), never on import: importing app must stay cheap (tests, the
+# debug reloader's parent process)
+_warmup_lock = threading.Lock()
+_warmup_started = False
+
+
+def start_model_warmup():
+    """Starts the background model warm-up once per process, if MODEL_WARMUP is set."""
+    global _warmup_started
+    if not Config.MODEL_WARMUP:
+        return
+    with _warmup_lock:
+        if _warmup_started:
+            return
+        _warmup_started = True
+    model_registry.warm_up(background=True)
+
+
+@app.before_request
+def warm_up_models():
+    # Under gunicorn the first request (usually the readiness probe) starts the warm-up;
+    # /healthz/ready then holds traffic with 503 until the models are ready
+    start_model_warmup()
+
 # Allowed image extensions
 ALLOWED_EXTENSIONS = {
     'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff', 'tif', 
@@ -97,8 +133,11 @@ def login():
             # Login Success
             session['user_id'] = user['id']
             session['username'] = user['username']
-            # Initialize or load history
-            initialize_chat_history(user['id'], user['username'])
+            # Initialize or load history (if a turn from another tab is stuck, main_activity loads it later)
+            try:
+                initialize_chat_history(user['id'], user['username'])
+            except TurnRejectedError as e:
+                print(f"Chat history not loaded at login for user {user['id']}: {e}")
             flash('Login successful.', 'success')
             return redirect(url_for('main_activity'))
         else:
@@ -119,22 +158,30 @@ def main_activity():
     # Optional thread switch via query param
     requested_thread_id = request.args.get('thread_id', type=int)
 
-    # Load user's threads for sidebar
-    threads = get_user_threads(user_id)
+    # Load the first page of the user's threads for the sidebar (more load on scroll)
+    threads = get_user_threads(user_id, limit=Config.THREAD_PAGE_SIZE)
+    threads_cursor = next_page_cursor(threads, Config.THREAD_PAGE_SIZE)
 
-    active_thread_id = requested_thread_id or current_threads.get(user_id)
+    active_thread_id = requested_thread_id or get_active_thread(user_id)
 
     # If none selected, default to most recent existing thread (no auto-create)
     if active_thread_id is None and threads:
         active_thread_id = threads[0]['id']
 
     # Initialize or switch to requested thread; returns active thread id
-    active_thread_id = initialize_chat_history(user_id, username, thread_id_to_load=active_thread_id)
+    try:
+        active_thread_id = initialize_chat_history(user_id, username, thread_id_to_load=active_thread_id)
+    except TurnRejectedError:
+        # A turn is still running: show the thread it is running in instead of switching under it
+        flash('Your previous message is still being answered. Please try again in a moment.', 'warning')
+        active_thread_id = get_active_thread(user_id)
 
     # Refresh history for active thread
     history = get_history(user_id)
+    history_cursor = get_history_cursor(user_id)
     
-    return render_template('main.html', username=username, history=history, threads=threads, active_thread_id=active_thread_id)
+    return render_template('main.html', username=username, history=history, threads=threads, active_thread_id=active_thread_id,
+                           threads_cursor=threads_cursor, history_cursor=history_cursor)
 
 @app.route('/new_chat', methods=['POST'])
 def new_chat():
@@ -145,12 +192,19 @@ def new_chat():
     try:
         reset_chat_history(user_id) 
         return jsonify({"message": "New chat started successfully."}), 200
+    except TurnRejectedError as e:
+        return jsonify({"message": "Please wait for the previous answer before starting a new chat.",
+                        "detail": str(e)}), 409
     except Exception as e:
         print(f"Error resetting chat history: {e}")
         return jsonify({"message": "Failed to start a new chat due to a server error."}), 500
 
 @app.route('/logout')
 def logout():
+    user_id = session.get('user_id')
+    if user_id is not None:
+        # Free the user's in-memory chat session right away instead of waiting for the idle TTL
+        end_user_session(user_id)
     session.pop('user_id', None)
     session.pop('username', None)
     flash('You have been logged out.', 'success')
@@ -172,23 +226,108 @@ def delete_thread_route(thread_id):
         return jsonify({"message": "Failed to delete thread."}), 500
 
     # Clear current thread selection if it was deleted
-    if current_threads.get(user_id) == thread_id:
-        current_threads[user_id] = None
+    clear_active_thread(user_id, thread_id)
 
     # Pick next available thread, if any
-    threads = get_user_threads(user_id)
+    threads = get_user_threads(user_id, limit=1)
     next_thread_id = threads[0]['id'] if threads else None
 
     return jsonify({"message": "Thread deleted.", "next_thread_id": next_thread_id}), 200
 
+# --- Paginated JSON endpoints (infinite scroll in main.js) ---
+def _page_limit(default):
+    """Reads ?limit= from the request, clamped to a sane range."""
+    limit = request.args.get('limit', default=default, type=int)
+    return max(1, min(limit, 100))
+
+def _page_before():
+    """Reads ?before= from the request; raises ValueError if it is not a cursor we issued."""
+    before = request.args.get('before') or None
+    decode_cursor(before)
+    return before
+
+@app.route('/threads')
+def threads_page():
+    """Returns the next page of the user's threads (newest first) after ?before=<cursor>."""
+    if not is_logged_in():
+        return jsonify({"message": "Authentication required."}), 401
+    user_id = session['user_id']
+    limit = _page_limit(Config.THREAD_PAGE_SIZE)
+    try:
+        before = _page_before()
+    except ValueError:
+        # Answering with the first page instead would make the infinite scroll append duplicates
+        return jsonify({"message": "Invalid page cursor."}), 400
+
+    threads = get_user_threads(user_id, before=before, limit=limit)
+    return jsonify({
+        "threads": [
+            {
+                "id": thread['id'],
+                "title": thread['title'],
+                "created_at": thread['created_at'].isoformat() if isinstance(thread['created_at'], datetime) else str(thread['created_at']),
+                "date_label": thread['created_at'].strftime('%b %d') if isinstance(thread['created_at'], datetime) else '',
+            }
+            for thread in threads
+        ],
+        "next_cursor": next_page_cursor(threads, limit),
+    }), 200
+
+@app.route('/threads/<int:thread_id>/messages')
+def thread_messages_page(thread_id):
+    """Returns messages older than ?before=<cursor> in a thread, in chronological order."""
+    if not is_logged_in():
+        return jsonify({"message": "Authentication required."}), 401
+    user_id = session['user_id']
+    if not get_thread_by_id(user_id, thread_id):
+        return jsonify({"message": "Thread not found."}), 404
+    limit = _page_limit(Config.HISTORY_PAGE_SIZE)
+    try:
+        before = _page_before()
+    except ValueError:
+        # Answering with the first page instead would make the infinite scroll append duplicates
+        return jsonify({"message": "Invalid page cursor."}), 400
+
+    records = get_history_by_user_id(user_id, thread_id, before=before, limit=limit)
+    return jsonify({
+        "messages": [format_db_record_for_session(record) for record in records],
+        "next_cursor": next_page_cursor(records, limit, oldest_first=True),
+    }), 200
+
+# --- Health check for load balancers ---
+@app.route('/healthz/ready')
+def readiness():
+    """
+    503 until every image model has finished loading and warming up (or has failed, unless
+    MODEL_READY_REQUIRES_ALL is set), so a cold worker gets no traffic. No auth: probes are anonymous.
+    """
+    ready = model_registry.ready(require_all=Config.MODEL_READY_REQUIRES_ALL)
+    return jsonify({"ready": ready, "models": model_registry.state()}), 200 if ready else 503
+
+
 # --- NEW ROUTE: Serve uploaded images for the front-end to display ---
-@app.route('/static/uploads/<filename>')
+@app.route('/static/uploads/<path:filename>')
 def uploaded_file(filename):
-    """Serves uploaded files directly from the UPLOAD_FOLDER."""
+    """
+    Serves uploaded files directly from the UPLOAD_FOLDER.
+    Responses carry a strong ETag and Last-Modified, so revalidation answers 304, and Range
+    requests are answered with 206 partial content.
+    """
     # Require auth to avoid exposing user uploads publicly
     if not is_logged_in():
         return jsonify({"message": "Authentication required."}), 401
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    # Uploads from before the derivative pipeline get their thumbnail on first request
+    if original_for_thumbnail(filename):
+        ensure_thumbnail(app.config['UPLOAD_FOLDER'], filename, Config.IMAGE_THUMB_SIDE, Config.IMAGE_THUMB_QUALITY)
+    # Content-addressed blobs never change under the same name, so the browser can skip revalidation
+    immutable = is_content_addressed(filename)
+    response = send_from_directory(app.config['UPLOAD_FOLDER'], filename, conditional=True, etag=True,
+                                   max_age=IMMUTABLE_MAX_AGE if immutable else Config.UPLOAD_CACHE_MAX_AGE)
+    # Per-user content behind a login: the browser may cache it, shared proxies may not
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = immutable
+    return response
 
 
 @app.route('/chat', methods=['POST'])
@@ -197,15 +336,13 @@ def chat():
         return jsonify({"content": "Authentication required. Please log in again."}), 401
     user_id = session['user_id']
 
-    pil_image = None
-    file_path = None
-    
     try:
         query = request.form.get('query', '').strip()
         
         # --- IMAGE HANDLING LOGIC ---
         image_file = request.files.get('image')
         image_filename = None
+        image_context = None
         
         if image_file and image_file.filename:
             # Validate filename + extension
@@ -216,27 +353,24 @@ def chat():
             if request.content_length and request.content_length > app.config['MAX_CONTENT_LENGTH']:
                 return jsonify({"content": "Image too large. Max 5MB.", "role": "error_client"}), 400
 
-            # 1. Save to disk
-            ext = os.path.splitext(image_file.filename)[1]
-            timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-            image_filename = f"user_{user_id}_{timestamp}{ext}"
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], image_filename)
-            
-            # Save the file stream to disk
-            image_file.save(file_path)
+            # 1. Hash while streaming to disk; identical content is stored once (see upload_store)
+            image_filename, _ = upload_store.save_stream(image_file.stream, image_file.filename)
+            file_path = upload_store.path_for(image_filename)
             
-            # 2. Open the saved file into a PIL object for the API call
-            pil_image = Image.open(file_path)
+            # 2. Decode it once: thumbnail, Gemini part and model inputs are stored next to the original,
+            #    and the decoded views travel with the request (no further decodes downstream)
+            image_context = prepare_uploaded_image(file_path, image_filename)
+            if image_context is None:
+                # The blob is left in place: a concurrent upload of the same bytes may already reference it.
+                # Unreferenced blobs are for an offline cleanup, never the request path.
+                return jsonify({"content": "The uploaded file could not be read as an image.", "role": "error_client"}), 400
             
         # --- CRITICAL CHECK: ONLY BLOCK IF BOTH ARE MISSING ---
-        if not query and not pil_image:
-            # Clean up the file if no query was provided
-            if file_path and os.path.exists(file_path):
-                os.remove(file_path)
+        if not query and not image_filename:
             return jsonify({"content": "Please enter a query or upload an image.", "role": "error_client"}), 200
         
         # 3. Call the AI function
-        ai_message = get_gemini_response(user_id, query, pil_image, image_filename) 
+        ai_message = get_gemini_response(user_id, query, image_filename=image_filename, image_context=image_context)
 
         # 4. Prepare the final JSON response for the frontend
         response_data = {
@@ -251,6 +385,10 @@ def chat():
         
         return jsonify(response_data)
 
+    except TurnRejectedError as e:
+        # Another turn for this user is still running (double-submit or a second tab)
+        return jsonify({"content": "Please wait for the previous answer before sending another message.",
+                        "role": "error_client", "detail": str(e)}), 409
     except Exception as e:
         print(f"Server CRITICAL Error during AI interaction: {e}")
         traceback.print_exc() 
@@ -258,14 +396,15 @@ def chat():
         error_message = f"An internal server error occurred. (Error: {str(e)})"
         
         return jsonify({"content": error_message, "role": "error"}), 500
-    finally:
-        # Ensure the PIL image object is closed to release memory
-        if pil_image:
-            pil_image.close()
 
 
 # --- Flask Run ---
 if __name__ == '__main__':
     setup_database()
+    # Start the write-behind writer (if enabled) so spooled turns from a previous run are replayed
+    get_writer()
+    # With the debug reloader only the child that serves requests loads the models
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_model_warmup()
     print("Starting Flask application...")
     app.run(debug=True)
\ No newline at end of file
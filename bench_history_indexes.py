@@ -0,0 +1,200 @@
+# bench_history_indexes.py
+"""
+Benchmark for the history/thread-list indexes added by schema migration 1.
+
+Builds a synthetic dataset in a scratch MySQL database, times the thread history and
+thread list queries without the composite indexes, applies the migration, and times
+them again.
+
+Usage:
+    python bench_history_indexes.py --posts 2000000 --users 2000 --threads-per-user 25
+
+The scratch database (default `chatbot_bench`) is created if missing and its tables are
+reused across runs; pass --reload to wipe and regenerate the data.
+"""
+
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import mysql.connector
+
+from config import Config
+import db_manager
+
+HISTORY_QUERY = """
+    SELECT * FROM posts
+    WHERE user_id = %s AND thread_id = %s
+    ORDER BY created_at ASC
+"""
+THREADS_QUERY = "SELECT id, title, created_at FROM chat_threads WHERE user_id = %s ORDER BY created_at DESC"
+
+MIGRATION_INDEXES = [
+    ("posts", "idx_posts_user_thread_created"),
+    ("chat_threads", "idx_threads_user_created"),
+    ("structured_responses", "idx_structured_user_thread"),
+]
+
+
+def use_scratch_database(name):
+    conn = mysql.connector.connect(host=Config.MYSQL_HOST, user=Config.MYSQL_USER, password=Config.MYSQL_PASSWORD)
+    cursor = conn.cursor()
+    cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{name}`")
+    cursor.close()
+    conn.close()
+    # Point the app's pool at the scratch database
+    Config.DB_BACKEND = "mysql"
+    Config.MYSQL_DB = name
+    db_manager.close_pool()
+
+
+def reset_to_unindexed_schema(conn):
+    cursor = conn.cursor()
+    for table, index_name in MIGRATION_INDEXES:
+        cursor.execute(
+            "SELECT 1 FROM information_schema.statistics WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s LIMIT 1",
+            (table, index_name)
+        )
+        if cursor.fetchone():
+            cursor.execute(f"ALTER TABLE {table} DROP INDEX {index_name}")
+    # run_migrations() recreates the version table and re-applies migration 1
+    cursor.execute("DROP TABLE IF EXISTS schema_version")
+    conn.commit()
+    cursor.close()
+
+
+def populate(conn, users, threads_per_user, posts, batch_size=5000):
+    cursor = conn.cursor()
+    cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
+    for table in ("structured_responses", "posts", "chat_threads", "users"):
+        cursor.execute(f"TRUNCATE TABLE {table}")
+    cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
+
+    print(f"Inserting {users} users...")
+    cursor.executemany(
+        "INSERT INTO users (id, username, email, password_hash) VALUES (%s, %s, %s, %s)",
+        [(u, f"user{u}", f"user{u}@bench.local", "x") for u in range(1, users + 1)]
+    )
+
+    start = datetime(2025, 1, 1)
+    thread_rows = []
+    thread_id = 0
+    for user_id in range(1, users + 1):
+        for _ in range(threads_per_user):
+            thread_id += 1
+            created = start + timedelta(minutes=random.randint(0, 500000))
+            thread_rows.append((thread_id, user_id, f"Thread {thread_id}", created))
+    print(f"Inserting {len(thread_rows)} threads...")
+    for i in range(0, len(thread_rows), batch_size):
+        cursor.executemany(
+            "INSERT INTO chat_threads (id, user_id, title, created_at) VALUES (%s, %s, %s, %s)",
+            thread_rows[i:i + batch_size]
+        )
+    conn.commit()
+
+    print(f"Inserting {posts} posts...")
+    inserted = 0
+    text = "Patient reports a persistent dry cough and mild fever for three days. " * 3
+    while inserted < posts:
+        batch = []
+        for _ in range(min(batch_size, posts - inserted)):
+            tid, uid, _, created = thread_rows[random.randrange(len(thread_rows))]
+            role = "user" if random.random() < 0.5 else "assistant"
+            batch.append((uid, tid, role, text, None, created + timedelta(seconds=random.randint(0, 86400))))
+        cursor.executemany(
+            "INSERT INTO posts (user_id, thread_id, role, text_content, image_filename, created_at) VALUES (%s, %s, %s, %s, %s, %s)",
+            batch
+        )
+        conn.commit()
+        inserted += len(batch)
+        if inserted % (batch_size * 40) == 0:
+            print(f"  {inserted}/{posts}")
+    cursor.execute("ANALYZE TABLE posts, chat_threads")
+    cursor.fetchall()
+    cursor.close()
+    return thread_rows
+
+
+def time_query(conn, query, param_sets):
+    cursor = conn.cursor()
+    timings = []
+    for params in param_sets:
+        started = time.perf_counter()
+        cursor.execute(query, params)
+        cursor.fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    cursor.execute("EXPLAIN " + query, param_sets[0])
+    columns = [d[0] for d in cursor.description]
+    extra = dict(zip(columns, cursor.fetchone())).get("Extra")
+    cursor.close()
+    timings.sort()
+    return {
+        "p50": statistics.median(timings),
+        "p95": timings[int(len(timings) * 0.95) - 1],
+        "mean": statistics.mean(timings),
+        "extra": extra,
+    }
+
+
+def run_suite(conn, history_params, thread_params):
+    return {
+        "history": time_query(conn, HISTORY_QUERY, history_params),
+        "thread_list": time_query(conn, THREADS_QUERY, thread_params),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default="chatbot_bench")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--threads-per-user", type=int, default=25)
+    parser.add_argument("--posts", type=int, default=2000000)
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--reload", action="store_true", help="Wipe and regenerate the synthetic data")
+    args = parser.parse_args()
+
+    random.seed(42)
+    use_scratch_database(args.database)
+    db_manager.setup_database(migrate=False)
+
+    conn = db_manager.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM posts")
+    existing_posts = cursor.fetchone()[0]
+    cursor.execute("SELECT id, user_id FROM chat_threads")
+    threads = cursor.fetchall()
+    cursor.close()
+
+    if args.reload or existing_posts < args.posts:
+        reset_to_unindexed_schema(conn)
+        rows = populate(conn, args.users, args.threads_per_user, args.posts)
+        threads = [(r[0], r[1]) for r in rows]
+
+    sample = random.sample(threads, min(args.samples, len(threads)))
+    history_params = [(uid, tid) for tid, uid in sample]
+    thread_params = [(uid,) for _, uid in sample]
+
+    reset_to_unindexed_schema(conn)
+    print("\nTiming without composite indexes...")
+    before = run_suite(conn, history_params, thread_params)
+
+    conn.close()
+    print("Applying migrations...")
+    db_manager.run_migrations()
+    conn = db_manager.get_db_connection()
+
+    print("Timing with composite indexes...")
+    after = run_suite(conn, history_params, thread_params)
+    conn.close()
+
+    print(f"\n{'query':<12} {'phase':<7} {'p50 ms':>9} {'p95 ms':>9} {'mean ms':>9}  plan")
+    for name in ("history", "thread_list"):
+        for phase, result in (("before", before[name]), ("after", after[name])):
+            print(f"{name:<12} {phase:<7} {result['p50']:>9.2f} {result['p95']:>9.2f} {result['mean']:>9.2f}  {result['extra']}")
+        print(f"{'':<12} speedup p50: {before[name]['p50'] / max(after[name]['p50'], 1e-6):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
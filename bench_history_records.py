@@ -0,0 +1,108 @@
+# bench_history_records.py
+"""
+Micro-benchmark: loading a 10k-message thread as dict rows (SELECT *) versus
+projected HistoryRecord tuples, including the per-row session formatting step.
+
+Runs against a temporary SQLite database, so no server is needed:
+    python bench_history_records.py --messages 10000 --runs 20
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from config import Config
+import db_manager
+import user_db_operations as ops
+from api_connection import format_db_record_for_session
+
+
+def legacy_load(user_id, thread_id):
+    """The pre-HistoryRecord path: SELECT * into dictionaries."""
+    conn = db_manager.get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("SELECT * FROM posts WHERE user_id = %s AND thread_id = %s ORDER BY created_at ASC, id ASC",
+                   (user_id, thread_id))
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    return rows
+
+def legacy_format(record):
+    """The pre-HistoryRecord format_db_record_for_session (image loading excluded)."""
+    return {
+        "role": record.get('role', 'user'),
+        "content": record.get("text_content"),
+        "image": None,
+        "created_at": record["created_at"].strftime("%Y-%m-%d %H:%M:%S") if isinstance(record.get("created_at"), datetime) else str(record.get("created_at")),
+        "db_id": record["id"],
+        "thread_id": record.get("thread_id")
+    }
+
+def new_format(record):
+    # Same as format_db_record_for_session, minus the image lookup (no images in this dataset)
+    return format_db_record_for_session(record._replace(image_filename=None))
+
+
+def measure(load, fmt, user_id, thread_id, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        rows = load(user_id, thread_id)
+        [fmt(row) for row in rows]
+        timings.append((time.perf_counter() - started) * 1000)
+
+    tracemalloc.start()
+    rows = load(user_id, thread_id)
+    rows_bytes = tracemalloc.get_traced_memory()[0]
+    formatted = [fmt(row) for row in rows]
+    total_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del formatted
+    return {
+        "median_ms": statistics.median(timings),
+        "rows_per_s": len(rows) / (statistics.median(timings) / 1000),
+        "rows_kib": rows_bytes / 1024,
+        "peak_kib": peak_bytes / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    Config.DB_BACKEND = "sqlite"
+    Config.SQLITE_PATH = os.path.join(tempfile.mkdtemp(), "bench.db")
+    db_manager.close_pool()
+    db_manager.setup_database()
+
+    ops.register_user("bench", "bench@example.com", "x")
+    user_id = ops.get_user_by_email("bench@example.com")["id"]
+    thread_id = ops.create_new_chat_thread(user_id)
+    turns = [ops.build_turn(user_id, thread_id, f"Symptom report {i}: cough and mild fever.",
+                            assistant_text=f"Assessment {i}: likely viral infection, rest and fluids.")
+             for i in range(args.messages // 2)]
+    ops.persist_turns(turns)
+
+    ops.get_history_by_user_id(user_id, thread_id)  # warm page cache and statement cache
+    legacy = measure(legacy_load, legacy_format, user_id, thread_id, args.runs)
+    compact = measure(ops.get_history_by_user_id, new_format, user_id, thread_id, args.runs)
+
+    print(f"\nThread of {args.messages} messages, {args.runs} runs (SQLite)")
+    print(f"{'path':<22} {'median ms':>10} {'rows/s':>12} {'rows KiB':>10} {'peak KiB':>10}")
+    for name, result in (("SELECT * + dict", legacy), ("projection + tuple", compact)):
+        print(f"{name:<22} {result['median_ms']:>10.2f} {result['rows_per_s']:>12.0f} {result['rows_kib']:>10.0f} {result['peak_kib']:>10.0f}")
+    print(f"speedup: {legacy['median_ms'] / compact['median_ms']:.2f}x, "
+          f"row memory: {compact['rows_kib'] / legacy['rows_kib'] * 100:.0f}% of dict rows")
+
+    db_manager.close_pool()
+
+
+if __name__ == "__main__":
+    main()
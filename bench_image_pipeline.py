@@ -0,0 +1,146 @@
+# bench_image_pipeline.py
+"""
+Micro-benchmark: image decodes and wall time per /chat request with an upload, for the
+legacy pipeline (every stage re-opens the file) versus the single-decode pipeline
+(content-addressed save + ingest + one ImageContext shared by analysis and the Gemini part).
+
+Model inference is left out: it is identical on both paths. The legacy path runs the
+"unknown type" worst case (both preprocessors), as analyze_medical_image did.
+
+Runs on synthetic photos in a temporary folder, or on real uploads:
+    python bench_image_pipeline.py --runs 20 --size 2400x1800
+    python bench_image_pipeline.py --images uploads/
+"""
+
+import argparse
+import base64
+import io
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageFile
+
+import image_analyzer
+from api_connection import prepare_uploaded_image
+from upload_store import UploadStore
+
+decode_count = 0
+_original_load = ImageFile.ImageFile.load
+
+
+def _counting_load(self):
+    global decode_count
+    if self.tile:  # pixels not decoded yet: this call decodes the file
+        decode_count += 1
+    return _original_load(self)
+
+
+def legacy_request(data, folder, name):
+    """The pre-ImageContext request: save, open in app, detect, both preprocessors, base64 re-read, SDK encode."""
+    path = os.path.join(folder, name)
+    with open(path, "wb") as f:
+        f.write(data)
+    pil_image = Image.open(path)
+    image_analyzer.detect_image_type(path)
+    image_analyzer.preprocess_image_for_pneumonia(path)
+    image_analyzer.preprocess_image_for_skin_disease(path)
+    with open(path, "rb") as f:
+        base64.b64encode(f.read())
+    # google.generativeai serializes a PIL image part by re-encoding it
+    pil_image.convert("RGB").save(io.BytesIO(), format="JPEG")
+    pil_image.close()
+
+
+def single_decode_request(data, store, name):
+    """The current request: hashed save, one decode into derivatives, shared context downstream."""
+    key, _ = store.save_stream(io.BytesIO(data), name)
+    context = prepare_uploaded_image(store.path_for(key), key)
+    image_analyzer.detect_image_type(context.path, context)
+    image_analyzer.preprocess_image_for_pneumonia(context.path, context=context)
+    image_analyzer.preprocess_image_for_skin_disease(context.path, context=context)
+    context.gemini_part()
+
+
+def measure(request, images, runs):
+    global decode_count
+    timings = []
+    decodes = []
+    for i in range(runs):
+        for name, data in images:
+            decode_count = 0
+            started = time.perf_counter()
+            request(data, f"{i}-{name}")
+            timings.append((time.perf_counter() - started) * 1000)
+            decodes.append(decode_count)
+    return {"median_ms": statistics.median(timings), "decodes": statistics.mean(decodes)}
+
+
+def synthetic_images(size, count):
+    rng = np.random.default_rng(0)
+    width, height = size
+    images = []
+    for i in range(count):
+        base = np.linspace(0, 255, width, dtype=np.float32)[np.newaxis, :, np.newaxis]
+        pixels = np.clip(base + rng.normal(0, 25, (height, width, 3)), 0, 255).astype(np.uint8)
+        out = io.BytesIO()
+        Image.fromarray(pixels).save(out, format="JPEG", quality=90)
+        images.append((f"photo{i}.jpg", out.getvalue()))
+    return images
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--size", default="2400x1800", help="synthetic image size, WIDTHxHEIGHT")
+    parser.add_argument("--count", type=int, default=3, help="number of synthetic images")
+    parser.add_argument("--images", help="directory of real images to use instead")
+    args = parser.parse_args()
+
+    if args.images:
+        images = []
+        for name in sorted(os.listdir(args.images)):
+            path = os.path.join(args.images, name)
+            if os.path.isfile(path) and name.count(".") == 1:
+                with open(path, "rb") as f:
+                    images.append((name, f.read()))
+    else:
+        images = synthetic_images(tuple(int(v) for v in args.size.split("x")), args.count)
+
+    ImageFile.ImageFile.load = _counting_load
+    workdir = tempfile.mkdtemp()
+    try:
+        legacy_dir = os.path.join(workdir, "legacy")
+        os.makedirs(legacy_dir)
+        legacy = measure(lambda data, name: legacy_request(data, legacy_dir, name), images, args.runs)
+
+        # Fresh store per run, so every request is a first upload (no deduplication)
+        stores = {}
+        def first_upload(data, name):
+            run = name.split("-", 1)[0]
+            store = stores.setdefault(run, UploadStore(os.path.join(workdir, "store", run)))
+            single_decode_request(data, store, name)
+        current = measure(first_upload, images, args.runs)
+
+        # Content already stored: the derivatives are reused, nothing is decoded
+        repeat_store = UploadStore(os.path.join(workdir, "repeat"))
+        for name, data in images:
+            single_decode_request(data, repeat_store, name)
+        repeated = measure(lambda data, name: single_decode_request(data, repeat_store, name), images, args.runs)
+    finally:
+        ImageFile.ImageFile.load = _original_load
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\n{len(images)} images x {args.runs} runs")
+    print(f"{'path':<28} {'decodes/request':>16} {'median ms':>10}")
+    for name, result in (("legacy (re-open per stage)", legacy), ("single decode", current),
+                         ("single decode, repeat upload", repeated)):
+        print(f"{name:<28} {result['decodes']:>16.2f} {result['median_ms']:>10.2f}")
+    print(f"speedup (first upload): {legacy['median_ms'] / current['median_ms']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
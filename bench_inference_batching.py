@@ -0,0 +1,86 @@
+# bench_inference_batching.py
+"""
+Load test: concurrent image analyses calling the model directly (a batch of one per request,
+as before) versus through inference_batcher.MicroBatcher.
+
+A pool of client threads each sends --requests preprocessed 224x224 inputs. The model is the
+app's pneumonia / skin model when present, otherwise a generated MobileNetV2 of similar cost.
+Reports throughput, per-request latency and the batcher's batch-size histogram and queue wait.
+
+    python bench_inference_batching.py --clients 8 --requests 10
+    python bench_inference_batching.py --max-batch 32 --max-wait-ms 10
+"""
+
+import argparse
+import statistics
+import threading
+import time
+
+import numpy as np
+
+from inference_batcher import MicroBatcher
+
+
+def load_model():
+    import tensorflow as tf
+    import image_analyzer
+    model = image_analyzer.load_skin_disease_model()
+    if model is not None:
+        return model, "skin_disease"
+    return tf.keras.applications.MobileNetV2(weights=None, input_shape=(224, 224, 3), classes=7), "synthetic"
+
+
+def run_clients(infer, clients, requests, input_shape):
+    latencies = []
+    lock = threading.Lock()
+    batch = np.random.default_rng(0).random((1,) + input_shape, dtype=np.float32)
+
+    def client():
+        for _ in range(requests):
+            started = time.perf_counter()
+            infer(batch)
+            with lock:
+                latencies.append((time.perf_counter() - started) * 1000)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {"images_per_sec": len(latencies) / elapsed, "p50_ms": statistics.median(latencies),
+            "p95_ms": latencies[int(len(latencies) * 0.95) - 1]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=10, help="requests per client")
+    parser.add_argument("--max-batch", type=int, default=16)
+    parser.add_argument("--max-wait-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    model, name = load_model()
+    input_shape = tuple(model.input_shape[1:])
+    model.predict(np.zeros((1,) + input_shape, np.float32), verbose=0)  # warm-up
+
+    direct = run_clients(lambda batch: model.predict(batch, verbose=0), args.clients, args.requests, input_shape)
+    batcher = MicroBatcher(lambda batch: model.predict(batch, verbose=0), max_batch=args.max_batch,
+                           max_wait=args.max_wait_ms / 1000, name=name)
+    batcher.predict(np.zeros((1,) + input_shape, np.float32))  # the first batch of a new size retraces
+    batched = run_clients(batcher.predict, args.clients, args.requests, input_shape)
+
+    print(f"\nmodel {name}, {args.clients} clients x {args.requests} requests")
+    print(f"{'path':<10} {'images/s':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for label, result in (("direct", direct), ("batched", batched)):
+        print(f"{label:<10} {result['images_per_sec']:>9.1f} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f}")
+    stats = batcher.stats()
+    print(f"throughput {batched['images_per_sec'] / direct['images_per_sec']:.2f}x; "
+          f"batch sizes {stats['batch_sizes']} (avg {stats['avg_batch_size']}); "
+          f"queue wait avg {stats['wait_ms_avg']} ms, p95 {stats['wait_ms_p95']} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# bench_inference_latency.py
+"""
+Per-call CPU latency of a single 224x224 inference: model.predict(..., verbose=0), as the
+analysis functions used to call it, versus the traced fixed-signature callable from
+image_analyzer.inference_fn.
+
+Uses the app's models when their files are present, otherwise generated stand-ins: a small
+grayscale CNN (pneumonia-like) and a MobileNetV2 (skin-model-like). The first call of each
+path (tracing / predict setup) is reported separately from the steady-state latency.
+
+    python bench_inference_latency.py --calls 100
+"""
+
+import argparse
+import statistics
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import image_analyzer
+from config import Config
+
+
+def synthetic_models():
+    small = tf.keras.Sequential([
+        tf.keras.Input((224, 224, 1)),
+        tf.keras.layers.Conv2D(16, 3, strides=2, activation="relu"),
+        tf.keras.layers.Conv2D(32, 3, strides=2, activation="relu"),
+        tf.keras.layers.Conv2D(64, 3, strides=2, activation="relu"),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(1, activation="sigmoid"),
+    ])
+    mobilenet = tf.keras.applications.MobileNetV2(weights=None, input_shape=(224, 224, 3), classes=7)
+    return {"small cnn": small, "mobilenetv2": mobilenet}
+
+
+def latencies(call, batch, calls):
+    started = time.perf_counter()
+    call(batch)
+    first = (time.perf_counter() - started) * 1000
+    timings = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        call(batch)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {"first_ms": first, "p50_ms": statistics.median(timings), "p95_ms": timings[int(len(timings) * 0.95) - 1]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=50)
+    args = parser.parse_args()
+
+    Config.INFERENCE_COMPILED = True
+    models = {name: model for name, model in (("pneumonia", image_analyzer.load_pneumonia_model()),
+                                              ("skin_disease", image_analyzer.load_skin_disease_model()))
+              if model is not None} or synthetic_models()
+
+    print(f"\n{'model':<14} {'path':<9} {'first ms':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, model in models.items():
+        batch = np.random.default_rng(0).random((1,) + tuple(model.input_shape[1:]), dtype=np.float32)
+        predict = latencies(lambda b: model.predict(b, verbose=0), batch, args.calls)
+        traced = latencies(image_analyzer.inference_fn(model), batch, args.calls)
+        for label, result in (("predict", predict), ("traced", traced)):
+            print(f"{name:<14} {label:<9} {result['first_ms']:>9.1f} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f}")
+        print(f"{name:<14} speedup   {predict['p50_ms'] / traced['p50_ms']:>8.2f}x (p50)")
+
+
+if __name__ == "__main__":
+    main()
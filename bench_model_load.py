@@ -0,0 +1,108 @@
+# bench_model_load.py
+"""
+Startup benchmark: time to load each model from its raw .h5 file versus from the converted
+.keras artifact written by model_cache.py.
+
+Every load runs in a fresh Python process, as on a worker's cold start; the time reported is
+the load itself (TensorFlow's import is the same on all paths and is left out). Paths:
+
+    app chain   the app's raw loader for that model: every fallback it walks through, up to
+                the copy + config rewrite of _load_model_with_batch_shape_fix
+    h5          a single tf.keras.models.load_model on the .h5 (when it loads at all)
+    converted   the model_cache artifact (created first if missing)
+
+Most of a load is building the layers, whatever the file format, so a model that already
+loads on the first attempt gains little; the saving is the failed attempts and the copy.
+
+    python bench_model_load.py                        # the app's model files
+    python bench_model_load.py --synthetic --runs 5   # a generated MobileNetV2-sized .h5
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+CHILD = r"""
+import sys, time
+import tensorflow as tf
+import image_analyzer
+path, method = sys.argv[1], sys.argv[2]
+started = time.perf_counter()
+if method in image_analyzer.MODEL_SOURCES:
+    model = image_analyzer.MODEL_SOURCES[method][1]()
+else:
+    model = tf.keras.models.load_model(path, compile=False)
+elapsed = (time.perf_counter() - started) * 1000
+print("LOAD_MS", elapsed if model is not None else -1)
+"""
+
+
+def timed_load(path, method, runs):
+    """Median load time in ms over fresh processes, or None if the load fails."""
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-c", CHILD, path, method], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        lines = [line for line in result.stdout.splitlines() if line.startswith("LOAD_MS")]
+        if not lines or float(lines[-1].split()[1]) < 0:
+            return None
+        timings.append(float(lines[-1].split()[1]))
+    return statistics.median(timings)
+
+
+def synthetic_model(folder):
+    import tensorflow as tf
+    path = os.path.join(folder, "synthetic_model.h5")
+    tf.keras.applications.MobileNetV2(weights=None, input_shape=(224, 224, 3), classes=7).save(path)
+    return path
+
+
+def _ms(value):
+    return "-" if value is None else f"{value:.0f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--synthetic", action="store_true", help="benchmark a generated model instead")
+    parser.add_argument("--cache-dir", help="artifact directory (default: a temporary one)")
+    args = parser.parse_args()
+
+    import tensorflow as tf
+    import image_analyzer
+    from model_cache import cached_model_path, load_cached_model
+
+    workdir = tempfile.mkdtemp()
+    cache_dir = args.cache_dir or os.path.join(workdir, "cache")
+    try:
+        if args.synthetic:
+            raw = synthetic_model(workdir)
+            sources = {"synthetic": (raw, lambda: tf.keras.models.load_model(raw, compile=False))}
+        else:
+            sources = {name: source for name, source in image_analyzer.MODEL_SOURCES.items()
+                       if os.path.exists(source[0])}
+        if not sources:
+            parser.error("no model files found (use --synthetic)")
+
+        print(f"{'model':<14} {'MB':>6} {'app chain ms':>13} {'h5 ms':>9} {'converted ms':>13} {'speedup':>8}")
+        for name, (source_path, raw_loader) in sources.items():
+            if load_cached_model(source_path, raw_loader, cache_dir) is None:
+                print(f"{name:<14} could not be loaded")
+                continue
+            chain = timed_load(source_path, name, args.runs) if name in image_analyzer.MODEL_SOURCES else None
+            plain = timed_load(source_path, "plain", args.runs)
+            converted = timed_load(cached_model_path(source_path, cache_dir), "plain", args.runs)
+            baseline = chain if chain is not None else plain
+            speedup = f"{baseline / converted:.2f}x" if baseline and converted else "-"
+            print(f"{name:<14} {os.path.getsize(source_path) / 1e6:>6.1f} {_ms(chain):>13} {_ms(plain):>9} "
+                  f"{_ms(converted):>13} {speedup:>8}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# bench_preprocess.py
+"""
+Throughput benchmark and accuracy-parity check for the fast model preprocessing mode
+(IMAGE_PREPROCESS_FAST): reduced-resolution JPEG decode, bilinear resampling with an
+integer pre-reduction, float32 output. The reference is the exact path (full decode,
+Pillow's default resize), which is what the models were used with.
+
+For every image the fast and exact inputs of both models are compared (max / mean absolute
+difference on the [0, 1] scale). When the model files are present, predictions are compared
+too: top-class agreement and the largest change in the reported confidence.
+
+    python bench_preprocess.py                       # images in uploads/ (legacy and store layout)
+    python bench_preprocess.py --images scans/ --runs 10 --max-mean-diff 0.01
+
+Exits with status 1 if any image exceeds --max-mean-diff or a prediction changes class.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+import image_analyzer
+from image_ingest import MODEL_INPUT_SIZE, ImageContext, to_model_array
+
+MODEL_VIEWS = (("pneumonia", "L"), ("skin_disease", "RGB"))
+
+
+def find_images(folder):
+    """Originals only: flat legacy uploads and content-addressed blobs, not their derivatives."""
+    images = []
+    for root, _, names in os.walk(folder):
+        for name in sorted(names):
+            if name.count(".") == 1 and name.lower().endswith((".png", ".jpg", ".jpeg", ".gif", ".webp")):
+                images.append(os.path.join(root, name))
+    return images
+
+
+def preprocess(path, fast):
+    """Both models' float32 batches from one decode, as analyze_medical_image builds them."""
+    context = ImageContext(path, fast=fast, decode_side=2 * max(MODEL_INPUT_SIZE))
+    return {name: to_model_array(context.view(mode))[np.newaxis] for name, mode in MODEL_VIEWS}
+
+
+def throughput(paths, fast, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        for path in paths:
+            preprocess(path, fast)
+        timings.append(time.perf_counter() - started)
+    return len(paths) / statistics.median(timings)
+
+
+def load_models():
+    models = {}
+    for name, loader in (("pneumonia", image_analyzer.load_pneumonia_model),
+                         ("skin_disease", image_analyzer.load_skin_disease_model)):
+        try:
+            model = loader()
+        except Exception as e:
+            print(f"{name} model unavailable: {e}")
+            model = None
+        if model is not None:
+            models[name] = model
+    return models
+
+
+def predict(model, batch):
+    scores = np.asarray(model.predict(batch, verbose=0))[0]
+    if scores.shape[-1] == 1:  # binary sigmoid output
+        score = float(scores[0])
+        return int(score > 0.5), max(score, 1 - score)
+    return int(np.argmax(scores)), float(np.max(scores))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default=os.getenv("UPLOAD_FOLDER", "uploads"))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-mean-diff", type=float, default=0.02,
+                        help="largest acceptable mean absolute input difference per image")
+    parser.add_argument("--skip-models", action="store_true", help="compare inputs only")
+    args = parser.parse_args()
+
+    paths = find_images(args.images)
+    if not paths:
+        parser.error(f"no images found in {args.images}")
+    models = {} if args.skip_models else load_models()
+
+    failures = 0
+    print(f"{'image':<40} {'model':<13} {'max diff':>9} {'mean diff':>10} {'class':>6} {'conf delta':>11}")
+    for path in paths:
+        try:
+            exact, fast = preprocess(path, False), preprocess(path, True)
+        except Exception as e:
+            print(f"{os.path.basename(path):<40} unreadable: {e}")
+            continue
+        for name, _ in MODEL_VIEWS:
+            diff = np.abs(exact[name] - fast[name])
+            same_class, confidence_delta = "-", "-"
+            if name in models:
+                exact_class, exact_conf = predict(models[name], exact[name])
+                fast_class, fast_conf = predict(models[name], fast[name])
+                same_class = "same" if exact_class == fast_class else "DIFF"
+                confidence_delta = f"{abs(exact_conf - fast_conf) * 100:.2f}%"
+                failures += exact_class != fast_class
+            failures += float(diff.mean()) > args.max_mean_diff
+            print(f"{os.path.basename(path)[:40]:<40} {name:<13} {diff.max():>9.4f} {diff.mean():>10.4f} "
+                  f"{same_class:>6} {confidence_delta:>11}")
+
+    exact_rate = throughput(paths, False, args.runs)
+    fast_rate = throughput(paths, True, args.runs)
+    print(f"\n{len(paths)} images, {args.runs} runs: exact {exact_rate:.1f} img/s, fast {fast_rate:.1f} img/s "
+          f"({fast_rate / exact_rate:.2f}x)")
+    if failures:
+        print(f"parity check FAILED for {failures} image/model pairs")
+        sys.exit(1)
+    print("parity check passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+# bench_quantized_parity.py
+"""
+Accuracy-parity harness for the quantized TFLite runtime (MODEL_RUNTIME=tflite).
+
+Runs every image through the Keras model and its TFLite export, classifies both outputs the
+way analyze_chest_xray / analyze_skin_disease do, and reports per model and quantization:
+top-1 agreement between the backends, confidence drift (percentage points), accuracy against
+the folder labels, per-image latency (one at a time and in micro-batches) and model size.
+
+Images are expected under <images>/<model>/<label>/, with the labels named like the classes
+the analysis reports (case-insensitive):
+
+    scans/pneumonia/normal/*.jpg        scans/pneumonia/pneumonia/*.jpg
+    scans/skin_disease/Melanoma/*.jpg   scans/skin_disease/Dermatofibroma/*.jpg ...
+
+Files directly under <images>/<model>/ (or, with no model folders, under <images>/) are used
+unlabelled: agreement and drift only. int8 is calibrated on the same images unless
+--calibration points elsewhere.
+
+    python bench_quantized_parity.py --images scans/ --quantization all
+    python bench_quantized_parity.py --images uploads/ --synthetic    # generated stand-in models
+
+Exits with status 1 if any agreement is below --min-agreement.
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import image_analyzer
+from image_ingest import MODEL_INPUT_SIZE, ImageContext, to_model_array
+from model_cache import load_cached_model
+from quantized_runtime import QUANTIZATIONS, TFLiteModel, calibration_batches, export_tflite
+
+MODEL_MODES = {"pneumonia": "L", "skin_disease": "RGB"}
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp")
+
+
+def top_class(name, scores):
+    """(label, confidence) as the analysis functions derive them from the model output."""
+    scores = np.asarray(scores).reshape(-1)
+    if name == "pneumonia":
+        score = float(scores[0])
+        return ("pneumonia", score) if score > 0.5 else ("normal", 1 - score)
+    index = int(np.argmax(scores))
+    classes = image_analyzer.SKIN_DISEASE_CLASSES
+    return (classes[index] if index < len(classes) else "Unknown"), float(scores[index])
+
+
+def labelled_images(folder):
+    """[(path, label or None)] for the originals under folder; subfolder names are the labels."""
+    images = []
+    for root, _, names in os.walk(folder):
+        label = os.path.basename(root) if root != folder else None
+        for name in sorted(names):
+            if name.count(".") == 1 and name.lower().endswith(IMAGE_EXTENSIONS):
+                images.append((os.path.join(root, name), label))
+    return images
+
+
+def model_input(path, mode):
+    array = to_model_array(ImageContext(path).view(mode, MODEL_INPUT_SIZE))
+    return (array[:, :, np.newaxis] if array.ndim == 2 else array)[np.newaxis]
+
+
+def synthetic_models():
+    tf.keras.utils.set_random_seed(0)
+    pneumonia = tf.keras.Sequential([
+        tf.keras.Input(MODEL_INPUT_SIZE + (1,)),
+        tf.keras.layers.Conv2D(16, 3, strides=2, activation="relu"),
+        tf.keras.layers.Conv2D(32, 3, strides=2, activation="relu"),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(1, activation="sigmoid"),
+    ])
+    skin = tf.keras.applications.MobileNetV2(weights=None, input_shape=MODEL_INPUT_SIZE + (3,),
+                                             classes=len(image_analyzer.SKIN_DISEASE_CLASSES))
+    return {"pneumonia": pneumonia, "skin_disease": skin}
+
+
+def batched_latency(predict, inputs, batch_size):
+    """Per-image ms when the inputs run in batches of batch_size (as the micro-batcher feeds them)."""
+    chunks = [np.concatenate(inputs[i:i + batch_size]) for i in range(0, len(inputs), batch_size)]
+    predict(chunks[0])  # first call at this size: resize / trace
+    started = time.perf_counter()
+    for chunk in chunks:
+        predict(chunk)
+    return (time.perf_counter() - started) * 1000 / len(inputs)
+
+
+def evaluate(name, keras_model, tflite_model, images, batch_size):
+    keras_fn = image_analyzer.inference_fn(keras_model)
+    agree, drifts, correct, labelled = 0, [], {"keras": 0, "tflite": 0}, 0
+    latency = {"keras": [], "tflite": []}
+    inputs = []
+    for path, label in images:
+        batch = model_input(path, MODEL_MODES[name])
+        inputs.append(batch)
+        results = {}
+        for backend, predict in (("keras", keras_fn), ("tflite", tflite_model.predict)):
+            started = time.perf_counter()
+            results[backend] = top_class(name, predict(batch))
+            latency[backend].append((time.perf_counter() - started) * 1000)
+        agree += results["keras"][0] == results["tflite"][0]
+        drifts.append(abs(results["keras"][1] - results["tflite"][1]) * 100)
+        if label is not None:
+            labelled += 1
+            for backend in correct:
+                correct[backend] += results[backend][0].lower() == label.lower()
+    drifts.sort()
+    return {
+        "agreement": agree / len(images),
+        "drift_mean": statistics.mean(drifts),
+        "drift_p95": drifts[min(len(drifts) - 1, int(len(drifts) * 0.95))],
+        "drift_max": drifts[-1],
+        "accuracy": {backend: count / labelled for backend, count in correct.items()} if labelled else None,
+        "latency": {backend: statistics.median(values) for backend, values in latency.items()},
+        "batched": {"keras": batched_latency(keras_fn, inputs, batch_size),
+                    "tflite": batched_latency(tflite_model.predict, inputs, batch_size)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", required=True, help="labelled image folder (see above)")
+    parser.add_argument("--quantization", choices=QUANTIZATIONS + ("all",), default="all")
+    parser.add_argument("--calibration", help="int8 calibration images (default: the evaluated images)")
+    parser.add_argument("--min-agreement", type=float, default=0.99)
+    parser.add_argument("--batch-size", type=int, default=16, help="batch size for the batched latency columns")
+    parser.add_argument("--synthetic", action="store_true", help="use generated stand-in models")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        models = synthetic_models()
+    else:
+        models = {}
+        for name, (source_path, raw_loader) in image_analyzer.MODEL_SOURCES.items():
+            model = load_cached_model(source_path, raw_loader, image_analyzer.Config.MODEL_CACHE_DIR)
+            if model is not None:
+                models[name] = model
+        if not models:
+            parser.error("no model files found (use --synthetic)")
+
+    by_model = {name: os.path.join(args.images, name) for name in models}
+    shared = not any(os.path.isdir(folder) for folder in by_model.values())
+    quantizations = QUANTIZATIONS if args.quantization == "all" else (args.quantization,)
+    workdir = tempfile.mkdtemp()
+    failures = 0
+    try:
+        print(f"\n{'model':<13} {'quant':<8} {'images':>6} {'agree':>7} {'drift avg':>10} {'p95':>6} {'max':>6} "
+              f"{'acc keras':>10} {'acc tflite':>11} {'keras ms':>9} {'tflite ms':>10} "
+              f"{'keras b ms':>11} {'tflite b ms':>12} {'MB':>6}")
+        for name, keras_model in models.items():
+            folder = args.images if shared else by_model[name]
+            images = labelled_images(folder) if os.path.isdir(folder) else []
+            if shared:
+                images = [(path, None) for path, _ in images]
+            if not images:
+                print(f"{name:<13} no images in {folder}")
+                continue
+            for quantization in quantizations:
+                batches = None
+                if quantization == "int8":
+                    batches = calibration_batches(args.calibration or folder, MODEL_MODES[name], MODEL_INPUT_SIZE)
+                path = os.path.join(workdir, f"{name}.{quantization}.tflite")
+                size = export_tflite(keras_model, path, quantization, batches)
+                result = evaluate(name, keras_model, TFLiteModel(path), images, args.batch_size)
+                accuracy = result["accuracy"]
+                acc_keras, acc_tflite = ((f"{accuracy['keras']:.1%}", f"{accuracy['tflite']:.1%}")
+                                         if accuracy else ("-", "-"))
+                print(f"{name:<13} {quantization:<8} {len(images):>6} {result['agreement']:>7.1%} "
+                      f"{result['drift_mean']:>10.2f} {result['drift_p95']:>6.2f} {result['drift_max']:>6.2f} "
+                      f"{acc_keras:>10} {acc_tflite:>11} {result['latency']['keras']:>9.2f} "
+                      f"{result['latency']['tflite']:>10.2f} {result['batched']['keras']:>11.2f} "
+                      f"{result['batched']['tflite']:>12.2f} {size / 1e6:>6.2f}")
+                failures += result["agreement"] < args.min_agreement
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("drift: absolute change of the reported confidence, in percentage points")
+    print(f"ms: per image, one at a time; b ms: per image in batches of {args.batch_size}")
+    if failures:
+        print(f"parity check FAILED: {failures} model/quantization pairs below {args.min_agreement:.0%} agreement")
+        sys.exit(1)
+    print("parity check passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+# cache.py
+"""
+Small in-process caching primitives shared by the DB and session layers.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache with a per-entry time-to-live.
+
+    Entries expire `ttl` seconds after they were stored (or, with `sliding=True`, after
+    they were last read); when more than `max_entries` are held, the least recently used
+    entry is evicted. With `max_bytes` and a `sizeof(value)` function the cache also keeps
+    the summed size under budget. get_or_load() makes it a read-through cache: misses call
+    the loader and store its result (None is not cached). A result is also dropped when the key
+    was invalidated while it was loading, since it may predate the write that invalidated it.
+    """
+
+    def __init__(self, max_entries=1024, ttl=60.0, name="cache", max_bytes=None, sizeof=None,
+                 sliding=False, on_evict=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.name = name
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.sliding = sliding
+        self.on_evict = on_evict
+        self._data = OrderedDict()  # key -> [expires_at, value, size]
+        self._bytes = 0
+        # key -> [generation, loads in flight]; invalidation bumps the generation of a loading key
+        self._loading = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0,
+                       "stale_loads": 0}
+
+    def get(self, key, default=None):
+        """Returns the cached value (refreshing its LRU position) or `default` on a miss."""
+        value = self._lookup(key)
+        return default if value is _MISSING else value
+
+    def set(self, key, value):
+        size = self.sizeof(value) if self.sizeof else 0
+        with self._lock:
+            evicted = self._store(key, value, size)
+        self._notify(evicted)
+
+    def get_or_load(self, key, loader):
+        """Returns the cached value for `key`, calling `loader()` and caching its result on a miss."""
+        value = self._lookup(key)
+        if value is not _MISSING:
+            return value
+        with self._lock:
+            load = self._loading.get(key)
+            if load is None:
+                load = self._loading[key] = [0, 0]
+            load[1] += 1
+            generation = load[0]
+        value = _MISSING
+        try:
+            value = loader()
+        finally:
+            size = self.sizeof(value) if self.sizeof and value is not _MISSING and value is not None else 0
+            evicted = []
+            with self._lock:
+                load[1] -= 1
+                if load[1] == 0:
+                    del self._loading[key]
+                if load[0] != generation:
+                    self._stats["stale_loads"] += 1
+                elif value is not _MISSING and value is not None:
+                    evicted = self._store(key, value, size)
+            self._notify(evicted)
+        return value
+
+    def pop(self, key, default=None):
+        """Removes and returns an entry without counting it as an eviction."""
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return default
+            self._bytes -= entry[2]
+            return entry[1]
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._loading:
+                self._loading[key][0] += 1
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[2]
+                self._stats["invalidations"] += 1
+
+    def invalidate_where(self, predicate):
+        """Drops every entry whose key satisfies `predicate(key)`."""
+        with self._lock:
+            for key, load in self._loading.items():
+                if predicate(key):
+                    load[0] += 1
+            stale = [key for key in self._data if predicate(key)]
+            for key in stale:
+                self._bytes -= self._data.pop(key)[2]
+            self._stats["invalidations"] += len(stale)
+
+    def purge_expired(self):
+        """Drops every expired entry now instead of waiting for it to be looked up."""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for key in [key for key, entry in self._data.items() if entry[0] <= now]:
+                entry = self._data.pop(key)
+                self._bytes -= entry[2]
+                expired.append((key, entry[1]))
+            self._stats["expirations"] += len(expired)
+        self._notify(expired)
+        return len(expired)
+
+    def clear(self):
+        with self._lock:
+            for load in self._loading.values():
+                load[0] += 1
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Returns hit/miss/eviction counters plus the current size and hit ratio."""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["entries"] = len(self._data)
+            if self.sizeof:
+                snapshot["bytes"] = self._bytes
+        lookups = snapshot["hits"] + snapshot["misses"]
+        snapshot["hit_ratio"] = round(snapshot["hits"] / lookups, 4) if lookups else 0.0
+        return snapshot
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def _lookup(self, key):
+        expired = None
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return _MISSING
+            now = time.monotonic()
+            if entry[0] <= now:
+                del self._data[key]
+                self._bytes -= entry[2]
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                expired = (key, entry[1])
+            else:
+                self._data.move_to_end(key)
+                if self.sliding:
+                    entry[0] = now + self.ttl
+                self._stats["hits"] += 1
+                return entry[1]
+        self._notify([expired])
+        return _MISSING
+
+    def _store(self, key, value, size):
+        # Caller holds self._lock; returns the evicted (key, value) pairs for _notify
+        evicted = []
+        old = self._data.pop(key, None)
+        if old is not None:
+            self._bytes -= old[2]
+        self._data[key] = [time.monotonic() + self.ttl, value, size]
+        self._bytes += size
+        while len(self._data) > self.max_entries or (
+                self.max_bytes is not None and self._bytes > self.max_bytes and len(self._data) > 1):
+            evicted.append(self._pop_oldest())
+            self._stats["evictions"] += 1
+        return evicted
+
+    def _pop_oldest(self):
+        key, entry = self._data.popitem(last=False)
+        self._bytes -= entry[2]
+        return key, entry[1]
+
+    def _notify(self, removed):
+        if self.on_evict:
+            for key, value in removed:
+                self.on_evict(key, value)
@@ -12,7 +12,100 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "AIzaSyCtQ7kO58F0eReP3SFILO0JA4mN0j
 class Config:
     """Database configuration settings."""
 
+    # Storage engine: "mysql" (server) or "sqlite" (local file, see storage_backends.py)
+    DB_BACKEND = os.getenv("DB_BACKEND", "mysql")
+
     MYSQL_HOST = os.getenv("MYSQL_HOST", "localhost")
     MYSQL_USER = os.getenv("MYSQL_USER", "root")
     MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD", "TR@GCUH#2024!AI")
-    MYSQL_DB = os.getenv("MYSQL_DB", "chatbot")
\ No newline at end of file
+    MYSQL_DB = os.getenv("MYSQL_DB", "chatbot")
+
+    # SQLite engine settings (chatbot.db in the repo root uses an older, incompatible schema)
+    SQLITE_PATH = os.getenv("SQLITE_PATH", "healthcare_chat.db")
+    SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # NORMAL is durable across app crashes in WAL mode
+    SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # bytes
+    SQLITE_CACHE_KB = int(os.getenv("SQLITE_CACHE_KB", "65536"))  # page cache per connection
+    SQLITE_STATEMENT_CACHE = int(os.getenv("SQLITE_STATEMENT_CACHE", "256"))  # prepared statements per connection
+    SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "5.0"))  # seconds to wait on a locked database
+
+    # Connection pool settings (see db_manager.ConnectionPool)
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "2.0"))  # seconds to wait for a free connection
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds before a connection is replaced
+    DB_POOL_PING_AFTER = int(os.getenv("DB_POOL_PING_AFTER", "30"))  # idle seconds before a checkout is validated
+
+    # Write-behind persistence for chat turns (see write_behind.py)
+    WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "false").lower() in ("1", "true", "yes")
+    WRITE_BEHIND_QUEUE_SIZE = int(os.getenv("WRITE_BEHIND_QUEUE_SIZE", "1000"))
+    WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "50"))
+    WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "0.2"))  # seconds a batch may wait to fill
+    WRITE_BEHIND_ENQUEUE_TIMEOUT = float(os.getenv("WRITE_BEHIND_ENQUEUE_TIMEOUT", "0.5"))  # then write synchronously
+    # Spool files are <path>.<pid>, one per worker; empty disables the durable spool
+    WRITE_BEHIND_SPOOL_PATH = os.getenv("WRITE_BEHIND_SPOOL_PATH", "")
+    WRITE_BEHIND_SPOOL_FSYNC = os.getenv("WRITE_BEHIND_SPOOL_FSYNC", "false").lower() in ("1", "true", "yes")
+
+    # Keyset pagination page sizes for the chat view and the thread sidebar
+    HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "30"))
+    THREAD_PAGE_SIZE = int(os.getenv("THREAD_PAGE_SIZE", "30"))
+
+    # Read-through caches for users, threads and thread lists (see user_db_operations)
+    CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "4096"))
+    CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))  # seconds
+
+    # Per-user chat session store (see session_store.py)
+    SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "1000"))
+    SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(256 * 1024 * 1024)))  # estimated bytes across all sessions
+    SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "1800"))  # seconds of inactivity before a session is dropped
+
+    # Session state shared by all workers: "memory" (per process), "sqlite" (one host) or "redis" (any host)
+    SESSION_STATE_BACKEND = os.getenv("SESSION_STATE_BACKEND", "memory")
+    SESSION_STATE_PATH = os.getenv("SESSION_STATE_PATH", "session_state.db")
+    SESSION_STATE_REDIS_URL = os.getenv("SESSION_STATE_REDIS_URL", "redis://localhost:6379/0")
+    SESSION_STATE_TTL = float(os.getenv("SESSION_STATE_TTL", "86400"))  # seconds a user's active thread is remembered
+
+    # Concurrent /chat requests from the same user (see turn_guard.py): "queue", "coalesce" or "reject" (HTTP 409)
+    CHAT_CONCURRENCY_POLICY = os.getenv("CHAT_CONCURRENCY_POLICY", "queue").lower()
+    CHAT_LOCK_STRIPES = int(os.getenv("CHAT_LOCK_STRIPES", "64"))
+    CHAT_TURN_WAIT_TIMEOUT = float(os.getenv("CHAT_TURN_WAIT_TIMEOUT", "60"))  # seconds a queued turn may wait
+
+    # Gemini context window (see context_window.py): recent messages sent verbatim, older ones summarized
+    CONTEXT_MAX_MESSAGES = int(os.getenv("CONTEXT_MAX_MESSAGES", "20"))
+    CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "8000"))  # estimated tokens for the verbatim part
+    CONTEXT_SUMMARY_MAX_CHARS = int(os.getenv("CONTEXT_SUMMARY_MAX_CHARS", "4000"))
+    CONTEXT_SUMMARY_CHUNK = int(os.getenv("CONTEXT_SUMMARY_CHUNK", "200"))  # messages folded per summarization call
+
+    # Encoded image parts replayed to Gemini (see image_parts.py)
+    IMAGE_PART_CACHE_ENTRIES = int(os.getenv("IMAGE_PART_CACHE_ENTRIES", "512"))
+    IMAGE_PART_CACHE_BYTES = int(os.getenv("IMAGE_PART_CACHE_BYTES", str(64 * 1024 * 1024)))
+    IMAGE_PART_MAX_SIDE = int(os.getenv("IMAGE_PART_MAX_SIDE", "1024"))  # pixels, longest side
+    IMAGE_PART_QUALITY = int(os.getenv("IMAGE_PART_QUALITY", "85"))  # JPEG quality
+    # Byte cap per image sent to Gemini; JPEG/WebP uploads within both caps are sent unchanged
+    IMAGE_PART_MAX_BYTES = int(os.getenv("IMAGE_PART_MAX_BYTES", str(512 * 1024)))
+    # Model preprocessing: reduced-resolution JPEG decode + bilinear resampling (see image_ingest.resize_view).
+    # Off by default; bench_preprocess.py reports how far it moves the model inputs and predictions.
+    IMAGE_PREPROCESS_FAST = os.getenv("IMAGE_PREPROCESS_FAST", "false").lower() in ("1", "true", "yes")
+    # Model registry (see image_analyzer.ModelRegistry): background load + dummy inference on the first request,
+    # and exponential backoff between retries of a model that failed to load (seconds)
+    MODEL_WARMUP = os.getenv("MODEL_WARMUP", "true").lower() in ("1", "true", "yes")
+    MODEL_RETRY_BASE = float(os.getenv("MODEL_RETRY_BASE", "30"))
+    MODEL_RETRY_MAX = float(os.getenv("MODEL_RETRY_MAX", "900"))
+    # Models converted once from .h5 to native .keras, keyed by source hash (see model_cache.py); empty disables
+    MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", "model_cache")
+    # Traced fixed-signature forward pass instead of model.predict (see image_analyzer.inference_fn)
+    INFERENCE_COMPILED = os.getenv("INFERENCE_COMPILED", "true").lower() in ("1", "true", "yes")
+    # Model runtime: "keras" or "tflite" (quantized exports, see quantized_runtime.py and bench_quantized_parity.py)
+    MODEL_RUNTIME = os.getenv("MODEL_RUNTIME", "keras").lower()
+    MODEL_TFLITE_QUANTIZATION = os.getenv("MODEL_TFLITE_QUANTIZATION", "float16").lower()  # float16 / dynamic / int8
+    MODEL_TFLITE_THREADS = int(os.getenv("MODEL_TFLITE_THREADS", "0")) or None  # 0: TFLite's default
+    # Micro-batching of concurrent image analyses into one forward pass per model (see inference_batcher.py)
+    INFERENCE_BATCHING = os.getenv("INFERENCE_BATCHING", "true").lower() in ("1", "true", "yes")
+    INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", "16"))
+    INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "5"))  # longest a request waits for company
+    # /healthz/ready also waits for every model to load successfully, not just for loading to settle
+    MODEL_READY_REQUIRES_ALL = os.getenv("MODEL_READY_REQUIRES_ALL", "false").lower() in ("1", "true", "yes")
+    # Chat bubble thumbnails written at upload time (see image_ingest.py)
+    IMAGE_THUMB_SIDE = int(os.getenv("IMAGE_THUMB_SIDE", "256"))  # pixels, longest side
+    IMAGE_THUMB_QUALITY = int(os.getenv("IMAGE_THUMB_QUALITY", "75"))  # WebP quality
+
+    # Browser cache lifetime for /static/uploads/<filename> (revalidated with ETag afterwards)
+    UPLOAD_CACHE_MAX_AGE = int(os.getenv("UPLOAD_CACHE_MAX_AGE", "86400"))
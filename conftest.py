@@ -0,0 +1,58 @@
+# conftest.py
+"""Shared pytest fixtures."""
+
+import os
+
+import pytest
+
+# Tests never load the real image models in the background (read by config.Config on import)
+os.environ["MODEL_WARMUP"] = "false"
+
+
+@pytest.fixture
+def sqlite_db(monkeypatch, tmp_path_factory):
+    """Points the app at a fresh SQLite database (schema created, query caches emptied); yields its path."""
+    import db_manager
+    import user_db_operations as ops
+    from config import Config
+
+    path = str(tmp_path_factory.mktemp("sqlite") / "chat.db")
+    monkeypatch.setattr(Config, "DB_BACKEND", "sqlite")
+    monkeypatch.setattr(Config, "SQLITE_PATH", path)
+    db_manager.close_pool()
+    for cache in (ops.user_cache, ops.thread_cache, ops.thread_list_cache):
+        cache.clear()
+    db_manager.setup_database()
+    yield path
+    db_manager.close_pool()
+
+
+@pytest.fixture
+def save_h5_model():
+    """Factory: saves a small Keras classifier (16x16x1 in, 3-way softmax out) as .h5 and returns it."""
+    import tensorflow as tf
+
+    def save(path, seed=0):
+        tf.keras.utils.set_random_seed(seed)
+        model = tf.keras.Sequential([
+            tf.keras.Input((16, 16, 1)),
+            tf.keras.layers.Conv2D(4, 3, activation="relu"),
+            tf.keras.layers.GlobalAveragePooling2D(),
+            tf.keras.layers.Dense(3, activation="softmax"),
+        ])
+        model.save(path)
+        return model
+    return save
+
+
+@pytest.fixture
+def raw_loader():
+    """Factory: a model_cache raw loader for an .h5 path that appends the path to `calls` on every load."""
+    import tensorflow as tf
+
+    def make(path, calls):
+        def loader():
+            calls.append(path)
+            return tf.keras.models.load_model(path, compile=False)
+        return loader
+    return make
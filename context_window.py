@@ -0,0 +1,298 @@
+# context_window.py
+"""
+Token-budgeted context window for Gemini chat sessions.
+
+Instead of replaying a whole thread into create_chat_session, a session is primed with:
+1. the thread's stored summary (older turns folded into short case notes), then
+2. the most recent messages verbatim, as many as fit CONTEXT_MAX_MESSAGES and CONTEXT_MAX_TOKENS.
+
+Summaries live in the thread_summaries table and are produced off the request path by
+ContextSummarizer, which walks the not-yet-summarized part of a thread in chunks and asks
+Gemini to fold each chunk into the running summary (falling back to an extractive digest
+when the API is unavailable). Rehydration therefore reads one summary row plus a bounded
+window of posts, whatever the length of the thread.
+
+Transcripts are lists of [role, text, image_filename] entries; a summary is carried as a
+leading ["summary", text, None] entry.
+"""
+
+import queue
+import threading
+
+from config import Config
+from api_handler import generate_text
+from prompt_builder import build_summary_prompt
+from user_db_operations import (
+    get_history_by_user_id, get_history_between, get_thread_summary, save_thread_summary
+)
+
+SUMMARY_ROLE = "summary"
+CHARS_PER_TOKEN = 4    # rough average for English text
+IMAGE_TOKENS = 258     # Gemini counts each image part as a fixed number of tokens
+SNIPPET_CHARS = 200    # per-message length in extractive summaries
+
+
+def entry_tokens(entry):
+    """Estimated prompt tokens for one transcript entry."""
+    role, text, image_filename = entry
+    tokens = len(text or "") // CHARS_PER_TOKEN + 4
+    if image_filename and role == "user":
+        tokens += IMAGE_TOKENS
+    return tokens
+
+
+def context_tokens(transcript):
+    return sum(entry_tokens(entry) for entry in transcript)
+
+
+def split_summary(transcript):
+    """Returns (summary text or None, the remaining entries)."""
+    if transcript and transcript[0][0] == SUMMARY_ROLE:
+        return transcript[0][1], transcript[1:]
+    return None, transcript
+
+
+def split_context(entries, max_messages, max_tokens):
+    """
+    Splits entries into (older, recent), where recent is the longest suffix within both
+    budgets. The newest message is always kept, and recent opens on a user message so the
+    Gemini history still alternates after the summary preamble.
+    """
+    start = len(entries)
+    tokens = 0
+    while start > 0 and len(entries) - start < max_messages:
+        cost = entry_tokens(entries[start - 1])
+        if tokens + cost > max_tokens and start < len(entries):
+            break
+        tokens += cost
+        start -= 1
+    while start < len(entries) and entries[start][0] == "assistant":
+        start += 1
+    return entries[:start], entries[start:]
+
+
+def _snippet(text, limit):
+    text = " ".join((text or "").split())
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+
+def transcript_lines(entries, per_message_chars):
+    lines = []
+    for role, text, image_filename in entries:
+        label = "Assistant" if role == "assistant" else "Patient"
+        line = _snippet(text, per_message_chars)
+        if image_filename and role == "user":
+            line = f"(shared an image) {line}".rstrip()
+        lines.append(f"{label}: {line}")
+    return lines
+
+
+def fold_extractive(summary, entries, max_chars):
+    """
+    Appends a short digest of `entries` to `summary` within max_chars. The start of the summary
+    (how the case began) and the newest lines are kept; the middle is dropped when over budget.
+    """
+    head = summary or ""
+    if len(head) > max_chars // 2:
+        cut = head[:max_chars // 2]
+        head = cut.rsplit("\n", 1)[0] if "\n" in cut else cut
+    lines = ["- " + line for line in transcript_lines(entries, SNIPPET_CHARS)]
+    room = max_chars - len(head) - len("\n- ...\n")
+    tail = []
+    for line in reversed(lines):
+        room -= len(line) + 1
+        if room < 0:
+            break
+        tail.append(line)
+    tail.reverse()
+    parts = [head] if head else []
+    if len(tail) < len(lines) or head != (summary or ""):
+        parts.append("- ...")
+    return "\n".join(parts + tail)
+
+
+def summarize(summary, entries, max_chars):
+    """Folds entries into the summary with Gemini, or extractively if the API is unavailable."""
+    prompt = build_summary_prompt(summary, "\n".join(transcript_lines(entries, 2000)), max_chars)
+    result = generate_text(prompt)
+    if result and result.strip():
+        return result.strip()[:max_chars]
+    return fold_extractive(summary, entries, max_chars)
+
+
+def summary_contents(summary):
+    """Gemini history entries that hand the summary to the model ahead of the verbatim window."""
+    return [
+        {"role": "user", "parts": [f"Summary of our earlier conversation in this thread:\n{summary}"]},
+        {"role": "model", "parts": ["Understood. I will take this earlier context into account."]},
+    ]
+
+
+def build_transcript(summary_row, records, max_messages=None, max_tokens=None):
+    """
+    Builds a session transcript from a thread's stored summary and its most recent posts.
+    Recent posts that don't fit the budget and aren't summarized yet are folded extractively.
+
+    Args:
+        summary_row (dict or None): Row from get_thread_summary
+        records (list[HistoryRecord]): The newest posts of the thread, oldest first
+
+    Returns:
+        list: transcript entries (a leading summary entry, then verbatim messages)
+    """
+    max_messages = max_messages or Config.CONTEXT_MAX_MESSAGES
+    max_tokens = max_tokens or Config.CONTEXT_MAX_TOKENS
+    summary = summary_row["summary"] if summary_row else None
+    last_post_id = summary_row["last_post_id"] if summary_row else 0
+
+    entries = [[r.role, r.text_content, r.image_filename] for r in records if r.id > last_post_id]
+    older, recent = split_context(entries, max_messages, max_tokens)
+    if older:
+        summary = fold_extractive(summary, older, Config.CONTEXT_SUMMARY_MAX_CHARS)
+    return ([[SUMMARY_ROLE, summary, None]] if summary else []) + recent
+
+
+def compact_transcript(transcript, max_messages=None, max_tokens=None):
+    """
+    Trims a live session's transcript back to the context budget, folding the dropped
+    messages into its summary entry. Returns the new transcript, or None if it already fits.
+    """
+    max_messages = max_messages or Config.CONTEXT_MAX_MESSAGES
+    max_tokens = max_tokens or Config.CONTEXT_MAX_TOKENS
+    summary, entries = split_summary(transcript)
+    # Allow some growth past the budget so a long chat isn't re-primed on every turn
+    if len(entries) <= 2 * max_messages and context_tokens(entries) <= max_tokens:
+        return None
+    older, recent = split_context(entries, max_messages, max_tokens)
+    if not older:
+        return None
+    summary = fold_extractive(summary, older, Config.CONTEXT_SUMMARY_MAX_CHARS)
+    return [[SUMMARY_ROLE, summary, None]] + recent
+
+
+class ContextSummarizer:
+    """Background worker that folds the older part of threads into their stored summaries."""
+
+    def __init__(self, summarize_fn=summarize, keep_messages=20, chunk_size=200, max_chars=4000, max_queue=1000):
+        self.summarize_fn = summarize_fn
+        self.keep_messages = keep_messages
+        self.chunk_size = chunk_size
+        self.max_chars = max_chars
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {"requested": 0, "deduplicated": 0, "dropped": 0, "threads_folded": 0,
+                       "chunks": 0, "messages_folded": 0, "failures": 0}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="context-summarizer", daemon=True)
+            self._thread.start()
+
+    def request(self, user_id, thread_id):
+        """Schedules a thread for summarization; duplicate requests for a queued thread are ignored."""
+        key = (user_id, thread_id)
+        with self._lock:
+            self._stats["requested"] += 1
+            if key in self._pending:
+                self._stats["deduplicated"] += 1
+                return False
+            self._pending.add(key)
+        try:
+            self._queue.put_nowait(key)
+            return True
+        except queue.Full:
+            with self._lock:
+                self._pending.discard(key)
+                self._stats["dropped"] += 1
+            return False
+
+    def flush(self, timeout=None):
+        """Waits for queued summaries to finish (used by tests and shutdown)."""
+        with self._queue.all_tasks_done:
+            if timeout is None:
+                while self._queue.unfinished_tasks:
+                    self._queue.all_tasks_done.wait()
+                return True
+            return self._queue.all_tasks_done.wait_for(lambda: not self._queue.unfinished_tasks, timeout)
+
+    def fold_thread(self, user_id, thread_id):
+        """
+        Folds every message older than the last `keep_messages` of the thread into its summary.
+
+        Returns:
+            int: number of messages folded
+        """
+        recent = get_history_by_user_id(user_id, thread_id, limit=self.keep_messages)
+        if not recent:
+            return 0
+        boundary = recent[0].id
+
+        stored = get_thread_summary(user_id, thread_id)
+        summary = stored["summary"] if stored else None
+        covered = stored["covered_count"] if stored else 0
+        last_post_id = stored["last_post_id"] if stored else 0
+
+        folded = 0
+        while True:
+            chunk = get_history_between(user_id, thread_id, last_post_id, boundary, self.chunk_size)
+            if not chunk:
+                break
+            summary = self.summarize_fn(summary, [[r.role, r.text_content, r.image_filename] for r in chunk],
+                                        self.max_chars)
+            covered += len(chunk)
+            last_post_id = chunk[-1].id
+            if not save_thread_summary(user_id, thread_id, summary, covered, last_post_id):
+                raise RuntimeError(f"could not save summary for thread {thread_id}")
+            folded += len(chunk)
+            with self._lock:
+                self._stats["chunks"] += 1
+            if len(chunk) < self.chunk_size:
+                break
+
+        if folded:
+            with self._lock:
+                self._stats["threads_folded"] += 1
+                self._stats["messages_folded"] += folded
+        return folded
+
+    def _run(self):
+        while True:
+            key = self._queue.get()
+            try:
+                self.fold_thread(*key)
+            except Exception as e:
+                with self._lock:
+                    self._stats["failures"] += 1
+                print(f"Context summarizer error for thread {key[1]}: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+                self._queue.task_done()
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+        snapshot["queue_depth"] = self._queue.qsize()
+        return snapshot
+
+
+_summarizer = None
+_summarizer_lock = threading.Lock()
+
+
+def get_summarizer():
+    """Returns the started process-wide summarizer."""
+    global _summarizer
+    if _summarizer is None:
+        with _summarizer_lock:
+            if _summarizer is None:
+                summarizer = ContextSummarizer(
+                    keep_messages=Config.CONTEXT_MAX_MESSAGES,
+                    chunk_size=Config.CONTEXT_SUMMARY_CHUNK,
+                    max_chars=Config.CONTEXT_SUMMARY_MAX_CHARS,
+                )
+                summarizer.start()
+                _summarizer = summarizer
+    return _summarizer
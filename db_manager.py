@@ -1,106 +1,348 @@
 # db_manager.py
 
-import mysql.connector
-# Assuming you have a config.py file with your MySQL credentials
+# Assuming you have a config.py file with your database settings
 from config import Config 
+from storage_backends import create_backend, DB_ERRORS
 import sys
+import threading
+import time
+from collections import deque
+
+
+class PoolExhaustedError(Exception):
+    """Raised when no pooled connection becomes free within the checkout timeout."""
+
+
+class PooledConnection:
+    """
+    Thin proxy around a pooled DB connection.
+    Behaves like the underlying connection, but close() hands it back to the pool
+    instead of tearing down the socket, so existing callers need no changes.
+    """
+
+    def __init__(self, pool, conn, created_at):
+        self._pool = pool
+        self._conn = conn
+        self._created_at = created_at
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise AttributeError(f"Connection already returned to pool (accessing '{name}')")
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool._release(conn, self._created_at)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class ConnectionPool:
+    """
+    Fixed-size, thread-safe connection pool.
+
+    - Connections are opened lazily up to `size` and reused LIFO (warmest first).
+    - A connection idle for longer than `ping_after` seconds is validated before checkout;
+      one older than `recycle` seconds is closed and replaced.
+    - When all connections are busy a caller waits at most `timeout` seconds, then
+      PoolExhaustedError is raised (fail fast instead of piling up requests).
+    """
+
+    def __init__(self, connect, size=10, timeout=2.0, recycle=1800, ping_after=30):
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conn, created_at, last_used)
+        self._open = 0
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "exhausted": 0,
+            "created": 0,
+            "recycled": 0,
+            "invalidated": 0,
+            "wait_time_ms": 0.0,
+        }
+
+    def acquire(self):
+        """Checks out a connection, opening, validating or recycling one as needed."""
+        deadline = time.monotonic() + self.timeout
+        entry = None
+        waited = False
+        wait_started = None
+
+        with self._cond:
+            self._stats["checkouts"] += 1
+            while True:
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._open < self.size:
+                    self._open += 1
+                    break
+                if not waited:
+                    waited = True
+                    wait_started = time.monotonic()
+                    self._stats["waits"] += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["exhausted"] += 1
+                    self._stats["wait_time_ms"] += (time.monotonic() - wait_started) * 1000
+                    raise PoolExhaustedError(
+                        f"No database connection available within {self.timeout}s (pool size {self.size})"
+                    )
+                self._cond.wait(remaining)
+            if waited:
+                self._stats["wait_time_ms"] += (time.monotonic() - wait_started) * 1000
+
+        if entry is not None:
+            conn, created_at, last_used = entry
+            now = time.monotonic()
+            if now - created_at > self.recycle:
+                self._close_quietly(conn)
+                self._bump("recycled")
+            elif now - last_used > self.ping_after and not self._is_alive(conn):
+                self._close_quietly(conn)
+                self._bump("invalidated")
+            else:
+                return PooledConnection(self, conn, created_at)
+
+        # Slot reserved above (or freed by a stale connection): open a fresh connection
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+        self._bump("created")
+        return PooledConnection(self, conn, time.monotonic())
+
+    def _release(self, conn, created_at):
+        """Returns a connection to the pool, discarding it if it is no longer usable."""
+        healthy = True
+        try:
+            # Never hand the next caller someone else's uncommitted work
+            if getattr(conn, "in_transaction", False):
+                conn.rollback()
+        except Exception:
+            healthy = False
+
+        with self._cond:
+            if healthy:
+                self._idle.append((conn, created_at, time.monotonic()))
+            else:
+                self._open -= 1
+            self._cond.notify()
+        if not healthy:
+            self._close_quietly(conn)
+            self._bump("invalidated")
+
+    def close_all(self):
+        """Closes every idle connection (connections still checked out close on release)."""
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+            self._open -= len(idle)
+        for conn, _, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        """Returns a snapshot of pool gauges and counters."""
+        with self._cond:
+            snapshot = dict(self._stats)
+            snapshot.update({
+                "size": self.size,
+                "open": self._open,
+                "idle": len(self._idle),
+                "in_use": self._open - len(self._idle),
+            })
+        snapshot["wait_time_ms"] = round(snapshot["wait_time_ms"], 2)
+        return snapshot
+
+    def _bump(self, counter):
+        with self._cond:
+            self._stats[counter] += 1
+
+    @staticmethod
+    def _is_alive(conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_backend = None
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_backend():
+    """Returns the storage engine selected by Config.DB_BACKEND (mysql or sqlite)."""
+    global _backend
+    if _backend is None:
+        with _pool_lock:
+            if _backend is None:
+                _backend = create_backend(Config)
+    return _backend
+
+def get_pool():
+    """Returns the process-wide connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        backend = get_backend()
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    backend.connect,
+                    size=Config.DB_POOL_SIZE,
+                    timeout=Config.DB_POOL_TIMEOUT,
+                    recycle=Config.DB_POOL_RECYCLE,
+                    ping_after=Config.DB_POOL_PING_AFTER,
+                )
+    return _pool
+
+def close_pool():
+    """Closes idle pooled connections and forgets the engine, so the next use re-reads Config."""
+    global _pool, _backend
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close_all()
+        _pool = None
+        _backend = None
+
+def get_pool_stats():
+    """Returns checkout/wait/exhaustion counters and open/idle gauges for the pool."""
+    return get_pool().stats()
 
 def get_db_connection():
-    "Establishes and returns a connection to the MySQL database."
+    "Checks out a pooled connection to the configured database (close() returns it to the pool)."
     try:
-        conn = mysql.connector.connect(
-            host=Config.MYSQL_HOST,
-            user=Config.MYSQL_USER,
-            password=Config.MYSQL_PASSWORD,
-            database=Config.MYSQL_DB
-        )
-        return conn
-    except mysql.connector.Error as err:
+        return get_pool().acquire()
+    except PoolExhaustedError as err:
+        print(f"❌ Database Pool Exhausted: {err}")
+        return None
+    except DB_ERRORS as err:
+        backend = get_backend()
         print("="*50)
-        print("❌ MySQL Connection Error!")
-        print(f"1. Is your MySQL server running?")
-        print(f"2. Are the credentials in config.py correct?")
+        print(f"❌ Database Connection Error! (backend: {backend.name})")
+        for hint in backend.connection_help():
+            print(hint)
         print(f"Full Error: {err}")
         print("="*50 + "\n")
         return None
 
-def setup_database():
-    """Sets up the necessary tables (Users, Chat_Threads, and Posts)."""
+def setup_database(migrate=True):
+    """Sets up the necessary tables (Users, Chat_Threads, and Posts) and applies pending migrations."""
     conn = get_db_connection()
     if conn is None: 
         print("Connection error, database setup failed.")
         return
 
     cursor = conn.cursor()
-    
-    # 1. Users Table 
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            username VARCHAR(100) NOT NULL,
-            email VARCHAR(100) NOT NULL UNIQUE,
-            password_hash VARCHAR(255) NOT NULL
-        )
-    """)
-    
-    # 2. NEW: Chat_Threads Table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS chat_threads (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            user_id INT NOT NULL,
-            title VARCHAR(255) NOT NULL DEFAULT 'New Chat',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-        )
-    """)
-    
-    # 3. Posts Table (MUST contain thread_id)
-    try:
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS posts (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                user_id INT NOT NULL,
-                thread_id INT NOT NULL,  -- CRITICAL NEW COLUMN
-                role VARCHAR(50) NOT NULL,
-                text_content TEXT,
-                image_filename VARCHAR(255),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-                FOREIGN KEY (thread_id) REFERENCES chat_threads(id) ON DELETE CASCADE
-            )
-        """)
-    except mysql.connector.Error as err:
-        # Catch case where tables already exist
-        if 'already exists' not in str(err):
-             print(f"Post table creation warning: {err}")
-
-    # 4. NEW: Structured Responses Table for symptom-based diagnoses
     try:
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS structured_responses (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                user_id INT NOT NULL,
-                thread_id INT NOT NULL,
-                query TEXT NOT NULL,
-                disease VARCHAR(255),
-                probability VARCHAR(50),
-                severity VARCHAR(50),
-                medication TEXT,
-                other_diagnoses TEXT,
-                conclusion TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-                FOREIGN KEY (thread_id) REFERENCES chat_threads(id) ON DELETE CASCADE
-            )
-        """)
-    except mysql.connector.Error as err:
-        # Catch case where tables already exist
-        if 'already exists' not in str(err):
-             print(f"Structured responses table creation warning: {err}")
-
-    conn.commit()
-    cursor.close()
-    conn.close()
-    print("Database tables created/checked successfully.")
+        get_backend().create_tables(cursor)
+        conn.commit()
+        print("Database tables created/checked successfully.")
+    except DB_ERRORS as err:
+        print(f"Table creation warning: {err}")
+    finally:
+        cursor.close()
+        conn.close()
+
+    if migrate:
+        run_migrations()
 
 
+# --- Schema Migrations ---
+# Each migration runs exactly once, in version order, and is recorded in `schema_version`.
+# Steps must be safe against a populated database: guard against objects that already
+# exist and prefer online DDL so reads and writes continue while an index is built.
+
+def _create_index_if_missing(cursor, table, index_name, columns):
+    backend = get_backend()
+    if backend.index_exists(cursor, table, index_name):
+        print(f"Index {index_name} already present on {table}, skipping.")
+        return
+    print(f"Building index {index_name} on {table}({columns})...")
+    backend.add_index(cursor, table, index_name, columns)
+
+def _migration_history_indexes(cursor):
+    # get_history_by_user_id: WHERE user_id = ? AND thread_id = ? ORDER BY created_at
+    _create_index_if_missing(cursor, "posts", "idx_posts_user_thread_created", "user_id, thread_id, created_at, id")
+    # get_user_threads: SELECT id, title, created_at WHERE user_id = ? ORDER BY created_at DESC
+    # (title included so the sidebar query is answered from the index alone)
+    _create_index_if_missing(cursor, "chat_threads", "idx_threads_user_created", "user_id, created_at, id, title")
+    _create_index_if_missing(cursor, "structured_responses", "idx_structured_user_thread", "user_id, thread_id, created_at")
+
+def _migration_thread_summaries(cursor):
+    # Rolling summaries of older messages, so long threads rehydrate with a bounded context
+    get_backend().create_summary_table(cursor)
+
+MIGRATIONS = [
+    (1, "Composite indexes for thread history and thread list queries", _migration_history_indexes),
+    (2, "Per-thread summaries for the Gemini context window", _migration_thread_summaries),
+]
+
+MIGRATION_LOCK_NAME = "chatbot_schema_migrations"
+
+def get_schema_version(cursor):
+    """Returns the highest applied migration version (0 for a fresh schema)."""
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cursor.fetchone()[0]
+
+def run_migrations():
+    """Applies pending schema migrations in order. Returns the resulting schema version."""
+    conn = get_db_connection()
+    if conn is None:
+        print("Connection error, schema migration skipped.")
+        return None
+
+    backend = get_backend()
+    cursor = conn.cursor()
+    try:
+        backend.create_version_table(cursor)
+        if not backend.lock_migrations(cursor, MIGRATION_LOCK_NAME):
+            print("Could not acquire schema migration lock; another process may be migrating.")
+            return None
+
+        try:
+            current = get_schema_version(cursor)
+            for version, description, apply in MIGRATIONS:
+                if version <= current:
+                    continue
+                print(f"Applying schema migration {version}: {description}")
+                apply(cursor)
+                cursor.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                    (version, description)
+                )
+                conn.commit()
+                current = version
+            print(f"Database schema at version {current}.")
+            return current
+        finally:
+            backend.unlock_migrations(cursor, MIGRATION_LOCK_NAME)
+    except DB_ERRORS as err:
+        print(f"Schema migration error: {err}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
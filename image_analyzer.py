@@ -5,52 +5,57 @@ Supports chest X-ray pneumonia classification and skin disease analysis.
 """
 
 import os
+import threading
+import time
 import numpy as np
 import tensorflow as tf
 from tensorflow import keras
 from PIL import Image
 import warnings
+from image_ingest import ImageContext, MODEL_INPUT_SIZE, to_model_array
+from model_cache import load_cached_model, normalize_model_config
+from quantized_runtime import load_quantized_model
+from inference_batcher import MicroBatcher
+from config import Config
 warnings.filterwarnings("ignore")
 
 # Model paths
 PNEUMONIA_MODEL_PATH = 'pneumonia_classification_model.h5'
 SKIN_DISEASE_MODEL_PATH = 'skin_disease_final_model_2.h5'
 
-# Global model variables
-pneumonia_model = None
-skin_disease_model = None
-
-def load_pneumonia_model():
-    """Load the pneumonia classification model."""
-    global pneumonia_model
-    if pneumonia_model is None:
-        print("Loading pneumonia classification model...")
-        print("Note: If loading fails, the model may need to be retrained with current TensorFlow version.")
-
-        # Define custom objects for compatibility with older models
-        custom_objects = {
-            'DTypePolicy': 'float32',  # Handle newer dtype policy by using string fallback
-        }
+# Map class indices to disease names (this may need adjustment based on your model's training)
+SKIN_DISEASE_CLASSES = [
+    "Actinic Keratosis", "Basal Cell Carcinoma", "Benign Keratosis",
+    "Dermatofibroma", "Melanocytic Nevus", "Melanoma", "Squamous Cell Carcinoma",
+    "Vascular Lesion", "Unknown"
+]
+
+# Model registry states
+MODEL_COLD = "cold"
+MODEL_LOADING = "loading"
+MODEL_READY = "ready"
+MODEL_FAILED = "failed"
+
+def _load_pneumonia_model_file():
+    """Load the pneumonia classification model from disk (None if every loading strategy fails)."""
+    pneumonia_model = None
+    print("Loading pneumonia classification model...")
+    print("Note: If loading fails, the model may need to be retrained with current TensorFlow version.")
+
+    # Define custom objects for compatibility with older models
+    custom_objects = {
+        'DTypePolicy': 'float32',  # Handle newer dtype policy by using string fallback
+    }
 
+    try:
+        # Try loading with safe_mode for newer TensorFlow versions
+        pneumonia_model = tf.keras.models.load_model(PNEUMONIA_MODEL_PATH, compile=False, safe_mode=True)
+        print("Pneumonia classification model loaded successfully.")
+    except TypeError:
+        # safe_mode not available, try normal loading
         try:
-            # Try loading with safe_mode for newer TensorFlow versions
-            pneumonia_model = tf.keras.models.load_model(PNEUMONIA_MODEL_PATH, compile=False, safe_mode=True)
+            pneumonia_model = tf.keras.models.load_model(PNEUMONIA_MODEL_PATH, compile=False)
             print("Pneumonia classification model loaded successfully.")
-        except TypeError:
-            # safe_mode not available, try normal loading
-            try:
-                pneumonia_model = tf.keras.models.load_model(PNEUMONIA_MODEL_PATH, compile=False)
-                print("Pneumonia classification model loaded successfully.")
-            except Exception as e:
-                print(f"Error loading pneumonia model: {e}")
-                try:
-                    # Try with custom objects for compatibility
-                    pneumonia_model = tf.keras.models.load_model(PNEUMONIA_MODEL_PATH, compile=False, custom_objects=custom_objects)
-                    print("Pneumonia classification model loaded with custom objects.")
-                except Exception as e2:
-                    print(f"Error loading pneumonia model with custom objects: {e2}")
-                    # Try to fix batch_shape compatibility issue
-                    pneumonia_model = _load_model_with_batch_shape_fix(PNEUMONIA_MODEL_PATH, custom_objects)
         except Exception as e:
             print(f"Error loading pneumonia model: {e}")
             try:
@@ -61,6 +66,16 @@ def load_pneumonia_model():
                 print(f"Error loading pneumonia model with custom objects: {e2}")
                 # Try to fix batch_shape compatibility issue
                 pneumonia_model = _load_model_with_batch_shape_fix(PNEUMONIA_MODEL_PATH, custom_objects)
+    except Exception as e:
+        print(f"Error loading pneumonia model: {e}")
+        try:
+            # Try with custom objects for compatibility
+            pneumonia_model = tf.keras.models.load_model(PNEUMONIA_MODEL_PATH, compile=False, custom_objects=custom_objects)
+            print("Pneumonia classification model loaded with custom objects.")
+        except Exception as e2:
+            print(f"Error loading pneumonia model with custom objects: {e2}")
+            # Try to fix batch_shape compatibility issue
+            pneumonia_model = _load_model_with_batch_shape_fix(PNEUMONIA_MODEL_PATH, custom_objects)
     return pneumonia_model
 
 def _load_model_with_batch_shape_fix(model_path, custom_objects=None):
@@ -88,22 +103,8 @@ def _load_model_with_batch_shape_fix(model_path, custom_objects=None):
                     config_str = f.attrs['model_config']
                     config = json.loads(config_str)
 
-                    # Function to remove problematic parameters from nested config
-                    def clean_config(obj):
-                        if isinstance(obj, dict):
-                            # Remove problematic parameters
-                            obj.pop('batch_shape', None)
-                            # Handle dtype_policy variations
-                            if 'dtype_policy' in obj:
-                                if obj['dtype_policy'] == 'DTypePolicy':
-                                    obj['dtype_policy'] = None
-                            for key, value in obj.items():
-                                clean_config(value)
-                        elif isinstance(obj, list):
-                            for item in obj:
-                                clean_config(item)
-
-                    clean_config(config)
+                    # Remove problematic parameters from the nested config
+                    normalize_model_config(config)
 
                     # Save the cleaned config
                     f.attrs['model_config'] = json.dumps(config)
@@ -136,26 +137,255 @@ def _load_model_with_batch_shape_fix(model_path, custom_objects=None):
         print(f"Error in compatibility fix: {e}")
         return None
 
-def load_skin_disease_model():
-    """Load the skin disease classification model."""
-    global skin_disease_model
-    if skin_disease_model is None:
+def _load_skin_disease_model_file():
+    """Load the skin disease classification model from disk (None if every loading strategy fails)."""
+    skin_disease_model = None
+    try:
+        # Try loading with different approaches for compatibility
+        skin_disease_model = tf.keras.models.load_model(SKIN_DISEASE_MODEL_PATH, compile=False)
+        print("Skin disease classification model loaded successfully.")
+    except Exception as e:
+        print(f"Error loading skin disease model: {e}")
         try:
-            # Try loading with different approaches for compatibility
-            skin_disease_model = tf.keras.models.load_model(SKIN_DISEASE_MODEL_PATH, compile=False)
-            print("Skin disease classification model loaded successfully.")
-        except Exception as e:
-            print(f"Error loading skin disease model: {e}")
-            try:
-                # Alternative loading method for older models
-                skin_disease_model = tf.keras.models.load_model(SKIN_DISEASE_MODEL_PATH, custom_objects={})
-                print("Skin disease classification model loaded with custom objects.")
-            except Exception as e2:
-                print(f"Error loading skin disease model with custom objects: {e2}")
-                skin_disease_model = None
+            # Alternative loading method for older models
+            skin_disease_model = tf.keras.models.load_model(SKIN_DISEASE_MODEL_PATH, custom_objects={})
+            print("Skin disease classification model loaded with custom objects.")
+        except Exception as e2:
+            print(f"Error loading skin disease model with custom objects: {e2}")
+            skin_disease_model = None
     return skin_disease_model
 
-def preprocess_image_for_pneumonia(image_path, target_size=(224, 224)):
+
+class ModelEntry:
+    """Load state of one model in the registry."""
+
+    def __init__(self, name, loader, input_shape):
+        self.name = name
+        self.loader = loader
+        self.input_shape = input_shape  # fallback warm-up shape when the model doesn't report one
+        self.lock = threading.Lock()
+        self.state = MODEL_COLD
+        self.model = None
+        self.error = None
+        self.failures = 0
+        self.next_retry_at = 0.0
+        self.load_ms = None
+        self.warmup_ms = None
+
+    def describe(self, now):
+        info = {"state": self.state, "failures": self.failures, "load_ms": self.load_ms, "warmup_ms": self.warmup_ms}
+        if self.state == MODEL_FAILED:
+            info["error"] = self.error
+            info["retry_in"] = max(0.0, round(self.next_retry_at - now, 1))
+        return info
+
+
+class ModelRegistry:
+    """
+    Loads each model once, warms it up with a dummy inference, and remembers load failures.
+
+    A failed load is not retried on every request (each attempt walks the whole fallback chain
+    of a multi-megabyte .h5 file): get() returns None until the backoff has elapsed, doubling
+    from retry_base up to retry_max seconds with every consecutive failure.
+
+    Args:
+        retry_base (float): seconds before the first retry
+        retry_max (float): longest wait between retries
+        clock (callable): time source in seconds (injectable for tests)
+    """
+
+    def __init__(self, retry_base=30, retry_max=900, clock=time.monotonic):
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.clock = clock
+        self._entries = {}
+        self._warmup_thread = None
+
+    def register(self, name, loader, input_shape):
+        self._entries[name] = ModelEntry(name, loader, input_shape)
+
+    def names(self):
+        return list(self._entries)
+
+    def get(self, name):
+        """
+        Returns the loaded model, loading it on first use or once its retry backoff has elapsed.
+        Concurrent callers wait for an in-progress load instead of starting their own.
+
+        Returns:
+            The Keras model, or None if it is unavailable
+        """
+        entry = self._entries[name]
+        if entry.state == MODEL_READY:
+            return entry.model
+        with entry.lock:
+            if entry.state == MODEL_READY:
+                return entry.model
+            if entry.state == MODEL_FAILED and self.clock() < entry.next_retry_at:
+                return None
+            self._load(entry)
+            return entry.model
+
+    def _load(self, entry):
+        entry.state = MODEL_LOADING
+        started = time.perf_counter()
+        try:
+            model = entry.loader()
+            if model is None:
+                raise RuntimeError("every loading strategy failed")
+            entry.load_ms = round((time.perf_counter() - started) * 1000, 1)
+            started = time.perf_counter()
+            _warm_up_model(model, entry.input_shape)
+            entry.warmup_ms = round((time.perf_counter() - started) * 1000, 1)
+        except Exception as e:
+            entry.failures += 1
+            delay = min(self.retry_max, self.retry_base * 2 ** (entry.failures - 1))
+            entry.next_retry_at = self.clock() + delay
+            entry.error = str(e)
+            entry.model = None
+            entry.state = MODEL_FAILED
+            print(f"Model '{entry.name}' unavailable ({e}); next retry in {delay:.0f}s.")
+            return
+        entry.model = model
+        entry.error = None
+        entry.failures = 0
+        entry.state = MODEL_READY
+        print(f"Model '{entry.name}' ready (load {entry.load_ms} ms, warm-up {entry.warmup_ms} ms).")
+
+    def warm_up(self, background=True):
+        """
+        Loads and warms up every registered model, in a daemon thread unless background is False.
+
+        Returns:
+            threading.Thread or None: the warm-up thread, if one was started
+        """
+        if not background:
+            for name in self._entries:
+                self.get(name)
+            return None
+        if self._warmup_thread is None or not self._warmup_thread.is_alive():
+            self._warmup_thread = threading.Thread(target=self.warm_up, kwargs={"background": False},
+                                                   name="model-warmup", daemon=True)
+            self._warmup_thread.start()
+        return self._warmup_thread
+
+    def state(self):
+        now = self.clock()
+        return {name: entry.describe(now) for name, entry in self._entries.items()}
+
+    def ready(self, require_all=False):
+        """
+        True once no model is cold or still loading. A failed model doesn't hold readiness back
+        (requests degrade to "model not available", as before) unless require_all is set.
+        """
+        states = [entry.state for entry in self._entries.values()]
+        if require_all:
+            return all(state == MODEL_READY for state in states)
+        return all(state in (MODEL_READY, MODEL_FAILED) for state in states)
+
+
+# Traced forward pass per loaded model, keyed by id(model) (see inference_fn)
+_inference_fns = {}
+_inference_fns_lock = threading.Lock()
+
+
+def inference_fn(model):
+    """
+    A callable running the model's forward pass on a float32 numpy batch.
+
+    model.predict builds a data adapter, callbacks and a progress bar on every call, which
+    costs more than the forward pass itself for one 224x224 image. With INFERENCE_COMPILED,
+    Keras models get a tf.function with a fixed input signature instead (float32, the model's
+    static input shape, any batch size): it is traced once, on warm-up, and reused for every
+    request and batch size. Models without a fully static input shape keep using predict.
+    """
+    predict = lambda batch: model.predict(batch, verbose=0)
+    if not Config.INFERENCE_COMPILED or not isinstance(model, tf.keras.Model):
+        return predict
+    with _inference_fns_lock:
+        bound_model, fn = _inference_fns.get(id(model), (None, None))
+        if bound_model is not model:
+            shape = model.input_shape
+            if isinstance(shape, list) or any(dim is None for dim in shape[1:]):
+                fn = predict
+            else:
+                traced = tf.function(lambda x: model(x, training=False),
+                                     input_signature=[tf.TensorSpec((None,) + tuple(shape[1:]), tf.float32)])
+                fn = lambda batch: traced(tf.convert_to_tensor(batch, dtype=tf.float32)).numpy()
+            _inference_fns[id(model)] = (model, fn)
+    return fn
+
+
+def _warm_up_model(model, fallback_shape):
+    """One dummy prediction, so graph tracing and kernel setup don't land on the first real request."""
+    shape = getattr(model, "input_shape", None)
+    if isinstance(shape, list):  # multi-input models report one shape per input
+        shape = shape[0]
+    if not shape or any(dim is None for dim in shape[1:]):
+        shape = fallback_shape
+    inference_fn(model)(np.zeros((1,) + tuple(shape[1:]), dtype=np.float32))
+
+
+# Source file and raw (slow, fallback-chain) loader of each model; converted once by model_cache
+MODEL_SOURCES = {
+    "pneumonia": (PNEUMONIA_MODEL_PATH, _load_pneumonia_model_file),
+    "skin_disease": (SKIN_DISEASE_MODEL_PATH, _load_skin_disease_model_file),
+}
+
+
+def _cached_loader(name):
+    source_path, raw_loader = MODEL_SOURCES[name]
+    if Config.MODEL_RUNTIME == "tflite":
+        return lambda: load_quantized_model(source_path, raw_loader, Config.MODEL_CACHE_DIR,
+                                            Config.MODEL_TFLITE_QUANTIZATION, Config.MODEL_TFLITE_THREADS)
+    return lambda: load_cached_model(source_path, raw_loader, Config.MODEL_CACHE_DIR)
+
+
+model_registry = ModelRegistry(retry_base=Config.MODEL_RETRY_BASE, retry_max=Config.MODEL_RETRY_MAX)
+model_registry.register("pneumonia", _cached_loader("pneumonia"), (None,) + MODEL_INPUT_SIZE + (1,))
+model_registry.register("skin_disease", _cached_loader("skin_disease"), (None,) + MODEL_INPUT_SIZE + (3,))
+
+
+def load_pneumonia_model():
+    """The pneumonia classification model from the registry (None while unavailable)."""
+    return model_registry.get("pneumonia")
+
+
+def load_skin_disease_model():
+    """The skin disease classification model from the registry (None while unavailable)."""
+    return model_registry.get("skin_disease")
+
+
+# One micro-batcher per loaded model (see inference_batcher.py)
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def run_inference(name, model, batch):
+    """
+    Model output for a preprocessed batch of one. With INFERENCE_BATCHING, concurrent requests
+    for the same Keras model share a forward pass. Other runtimes (TFLite) are called directly:
+    their cost per image barely drops with batch size, so batching would only add queue wait.
+    """
+    if not Config.INFERENCE_BATCHING or not isinstance(model, tf.keras.Model):
+        return inference_fn(model)(batch)
+    with _batchers_lock:
+        bound_model, batcher = _batchers.get(name, (None, None))
+        if bound_model is not model:
+            batcher = MicroBatcher(inference_fn(model),
+                                   max_batch=Config.INFERENCE_MAX_BATCH,
+                                   max_wait=Config.INFERENCE_MAX_WAIT_MS / 1000, name=name)
+            _batchers[name] = (model, batcher)
+    return batcher.predict(batch)
+
+
+def get_inference_stats():
+    """Per-model batching metrics."""
+    with _batchers_lock:
+        batchers = dict(_batchers)
+    return {name: batcher.stats() for name, (_, batcher) in batchers.items()}
+
+def preprocess_image_for_pneumonia(image_path, target_size=(224, 224), context=None):
     """
     Preprocess image for pneumonia classification.
     Converts to grayscale as the model expects single-channel input.
@@ -163,10 +393,18 @@ def preprocess_image_for_pneumonia(image_path, target_size=(224, 224)):
     Args:
         image_path (str): Path to the image file
         target_size (tuple): Target size for the model input
+        context (ImageContext): Shared decoded views of the image for this request
 
     Returns:
         numpy.ndarray: Preprocessed image array
     """
+    if context is not None:
+        try:
+            img_array = to_model_array(context.view('L', target_size))
+            return img_array[np.newaxis, :, :, np.newaxis]
+        except Exception as e:
+            print(f"Error preprocessing image for pneumonia analysis: {e}")
+            return None
     try:
         img = Image.open(image_path)
         # Convert to grayscale (L mode) for pneumonia model
@@ -176,8 +414,8 @@ def preprocess_image_for_pneumonia(image_path, target_size=(224, 224)):
         # Resize image
         img = img.resize(target_size)
 
-        # Convert to array and normalize
-        img_array = np.array(img) / 255.0
+        # Convert to array and normalize (float32, what the model consumes)
+        img_array = to_model_array(img)
 
         # Add channel dimension for grayscale (1 channel)
         img_array = np.expand_dims(img_array, axis=-1)
@@ -190,17 +428,25 @@ def preprocess_image_for_pneumonia(image_path, target_size=(224, 224)):
         print(f"Error preprocessing image for pneumonia analysis: {e}")
         return None
 
-def preprocess_image_for_skin_disease(image_path, target_size=(224, 224)):
+def preprocess_image_for_skin_disease(image_path, target_size=(224, 224), context=None):
     """
     Preprocess image for skin disease classification.
 
     Args:
         image_path (str): Path to the image file
         target_size (tuple): Target size for the model input
+        context (ImageContext): Shared decoded views of the image for this request
 
     Returns:
         numpy.ndarray: Preprocessed image array
     """
+    if context is not None:
+        try:
+            img_array = to_model_array(context.view('RGB', target_size))
+            return img_array[np.newaxis]
+        except Exception as e:
+            print(f"Error preprocessing image for skin disease analysis: {e}")
+            return None
     try:
         img = Image.open(image_path)
         # Convert to RGB if necessary
@@ -210,8 +456,8 @@ def preprocess_image_for_skin_disease(image_path, target_size=(224, 224)):
         # Resize image
         img = img.resize(target_size)
 
-        # Convert to array and normalize
-        img_array = np.array(img) / 255.0
+        # Convert to array and normalize (float32, what the model consumes)
+        img_array = to_model_array(img)
 
         # Add batch dimension
         img_array = np.expand_dims(img_array, axis=0)
@@ -221,12 +467,13 @@ def preprocess_image_for_skin_disease(image_path, target_size=(224, 224)):
         print(f"Error preprocessing image for skin disease analysis: {e}")
         return None
 
-def analyze_chest_xray(image_path):
+def analyze_chest_xray(image_path, context=None):
     """
     Analyze a chest X-ray image for pneumonia.
 
     Args:
         image_path (str): Path to the chest X-ray image
+        context (ImageContext): Shared decoded views of the image for this request
 
     Returns:
         dict: Analysis results with classification and confidence
@@ -241,7 +488,7 @@ def analyze_chest_xray(image_path):
         }
 
     # Preprocess image
-    processed_image = preprocess_image_for_pneumonia(image_path)
+    processed_image = preprocess_image_for_pneumonia(image_path, context=context)
     if processed_image is None:
         return {
             "analysis_type": "chest_xray",
@@ -252,7 +499,7 @@ def analyze_chest_xray(image_path):
 
     try:
         # Make prediction
-        predictions = model.predict(processed_image, verbose=0)
+        predictions = run_inference("pneumonia", model, processed_image)
         confidence = float(predictions[0][0])
 
         # Assuming binary classification: 0 = Normal, 1 = Pneumonia
@@ -275,12 +522,13 @@ def analyze_chest_xray(image_path):
             "error": str(e)
         }
 
-def analyze_skin_disease(image_path):
+def analyze_skin_disease(image_path, context=None):
     """
     Analyze a skin image for disease classification.
 
     Args:
         image_path (str): Path to the skin disease image
+        context (ImageContext): Shared decoded views of the image for this request
 
     Returns:
         dict: Analysis results with classification and confidence
@@ -295,7 +543,7 @@ def analyze_skin_disease(image_path):
         }
 
     # Preprocess image
-    processed_image = preprocess_image_for_skin_disease(image_path)
+    processed_image = preprocess_image_for_skin_disease(image_path, context=context)
     if processed_image is None:
         return {
             "analysis_type": "skin_disease",
@@ -306,20 +554,14 @@ def analyze_skin_disease(image_path):
 
     try:
         # Make prediction
-        predictions = model.predict(processed_image, verbose=0)
+        predictions = run_inference("skin_disease", model, processed_image)
 
         # Get the predicted class and confidence
         predicted_class_idx = np.argmax(predictions[0])
         confidence = float(predictions[0][predicted_class_idx])
 
-        # Map class indices to disease names (this may need adjustment based on your model's training)
-        class_names = [
-            "Actinic Keratosis", "Basal Cell Carcinoma", "Benign Keratosis",
-            "Dermatofibroma", "Melanocytic Nevus", "Melanoma", "Squamous Cell Carcinoma",
-            "Vascular Lesion", "Unknown"
-        ]
-
-        classification = class_names[predicted_class_idx] if predicted_class_idx < len(class_names) else "Unknown"
+        classification = (SKIN_DISEASE_CLASSES[predicted_class_idx]
+                          if predicted_class_idx < len(SKIN_DISEASE_CLASSES) else "Unknown")
 
         return {
             "analysis_type": "skin_disease",
@@ -337,19 +579,23 @@ def analyze_skin_disease(image_path):
             "error": str(e)
         }
 
-def detect_image_type(image_path):
+def detect_image_type(image_path, context=None):
     """
     Detect the type of medical image based on characteristics.
 
     Args:
         image_path (str): Path to the image
+        context (ImageContext): Shared view of the image (its size needs no decode)
 
     Returns:
         str: Image type ('chest_xray', 'skin_disease', or 'unknown')
     """
     try:
-        img = Image.open(image_path)
-        width, height = img.size
+        if context is not None:
+            width, height = context.size
+        else:
+            with Image.open(image_path) as img:
+                width, height = img.size
 
         # Simple heuristic: chest X-rays are typically wider than tall
         # Skin disease images might be more square or varied
@@ -362,13 +608,14 @@ def detect_image_type(image_path):
         print(f"Error detecting image type: {e}")
         return "unknown"
 
-def analyze_medical_image(image_path):
+def analyze_medical_image(image_path, context=None):
     """
     Main function to analyze a medical image.
     Automatically detects image type and applies appropriate analysis.
 
     Args:
         image_path (str): Path to the medical image
+        context (ImageContext): Decoded views shared with the rest of the request, if any
 
     Returns:
         dict: Analysis results
@@ -381,18 +628,23 @@ def analyze_medical_image(image_path):
             "error": "Image file not found"
         }
 
+    # One context for detection and both preprocessors: stored inputs or a single decode
+    if context is None:
+        # Only model views are needed here, so a fast decode may shrink down to twice the input size
+        context = ImageContext(image_path, fast=Config.IMAGE_PREPROCESS_FAST, decode_side=2 * max(MODEL_INPUT_SIZE))
+
     # Detect image type
-    image_type = detect_image_type(image_path)
+    image_type = detect_image_type(image_path, context)
 
     # Analyze based on detected type
     if image_type == "chest_xray":
-        return analyze_chest_xray(image_path)
+        return analyze_chest_xray(image_path, context)
     elif image_type == "skin_disease":
-        return analyze_skin_disease(image_path)
+        return analyze_skin_disease(image_path, context)
     else:
         # Try both analyses if detection is uncertain
-        chest_result = analyze_chest_xray(image_path)
-        skin_result = analyze_skin_disease(image_path)
+        chest_result = analyze_chest_xray(image_path, context)
+        skin_result = analyze_skin_disease(image_path, context)
 
         # Return the result with higher confidence
         if chest_result.get("confidence", 0) > skin_result.get("confidence", 0):
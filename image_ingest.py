@@ -0,0 +1,489 @@
+# image_ingest.py
+"""
+Upload-time derivative pipeline.
+
+An uploaded image is decoded exactly once, in the /chat request that receives it, and
+everything later requests need is written next to the original:
+
+    <name>.thumb.webp     small WebP for the chat bubble (IMAGE_THUMB_SIDE)
+    <name>.gemini.jpg     bounded-size part sent to Gemini (IMAGE_PART_MAX_SIDE);
+                          .gemini.png when the image has transparency
+    <name>.model.npz      224x224 uint8 inputs for the local models ("gray", "rgb")
+                          plus the original "size" used by image type detection
+
+Readers (image_parts, image_analyzer, the upload route) use a derivative when it exists
+and fall back to the original otherwise, so uploads made before this pipeline keep working.
+Within a request, an ImageContext carries the decoded views through the whole pipeline
+(upload, type detection, both preprocessors, the Gemini part), so even the fallback path
+decodes the original at most once.
+Files are written to a temporary name and renamed into place, so a concurrent reader
+never sees a partial derivative.
+"""
+
+import io
+import os
+import threading
+
+import numpy as np
+from PIL import Image, ImageOps
+
+THUMB_SUFFIX = ".thumb.webp"
+GEMINI_SUFFIXES = {".gemini.jpg": "image/jpeg", ".gemini.png": "image/png", ".gemini.webp": "image/webp"}
+# Already-compressed formats that are sent to Gemini as uploaded when within the caps
+PASSTHROUGH_FORMATS = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+EXIF_ORIENTATION = 0x0112
+# Embedded metadata other than EXIF that may identify a patient or device (XMP, comments, IPTC)
+METADATA_INFO_KEYS = ("xmp", "XML:com.adobe.xmp", "comment", "photoshop", "iptc")
+FALLBACK_QUALITIES = (75, 65, 50)  # tried, in order, when a re-encoded part is over the byte cap
+SHRINK_FACTOR = 0.75
+MAX_SHRINKS = 4
+MODEL_SUFFIX = ".model.npz"
+MODEL_INPUT_SIZE = (224, 224)
+FAST_RESAMPLE = Image.BILINEAR
+FAST_REDUCING_GAP = 2.0
+
+
+def derivative_path(original_path, suffix):
+    return original_path + suffix
+
+
+def original_for_thumbnail(filename):
+    """Returns the original upload a thumbnail filename belongs to, or None for other files."""
+    if filename.endswith(THUMB_SUFFIX):
+        return filename[:-len(THUMB_SUFFIX)]
+    return None
+
+
+def _has_alpha(img):
+    return img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+
+
+def _encode(img, fmt, quality):
+    out = io.BytesIO()
+    if fmt == "PNG":
+        img.save(out, format="PNG", optimize=True)
+    elif fmt == "WEBP":
+        img.save(out, format="WEBP", quality=quality, method=4)
+    else:
+        img.convert("RGB").save(out, format="JPEG", quality=quality, optimize=True)
+    return out.getvalue()
+
+
+def encode_for_gemini(img, quality=85, max_bytes=None):
+    """
+    Encodes an already downscaled PIL image as an inline-data part: JPEG, or PNG when it
+    has transparency. Over max_bytes, lower qualities are tried (transparent images switch
+    to lossy WebP), then the image is shrunk by SHRINK_FACTOR, a bounded number of times.
+
+    Returns:
+        dict: {"mime_type", "data"}
+    """
+    fmt = "PNG" if _has_alpha(img) else "JPEG"
+    data = _encode(img, fmt, quality)
+    if max_bytes and len(data) > max_bytes:
+        if fmt == "PNG":
+            fmt = "WEBP"
+        qualities = [quality] + [q for q in FALLBACK_QUALITIES if q < quality]
+        for shrink in range(MAX_SHRINKS + 1):
+            if shrink:
+                img = img.resize((max(1, int(img.width * SHRINK_FACTOR)), max(1, int(img.height * SHRINK_FACTOR))),
+                                 Image.LANCZOS)
+            for q in qualities:
+                data = _encode(img, fmt, q)
+                if len(data) <= max_bytes:
+                    break
+            else:
+                continue
+            break
+    mime_type = {"PNG": "image/png", "WEBP": "image/webp"}.get(fmt, "image/jpeg")
+    return {"mime_type": mime_type, "data": data}
+
+
+def has_private_metadata(img):
+    """
+    True if the file carries metadata beyond an upright EXIF Orientation: any other EXIF tag
+    (GPS position, capture time, device serial, maker notes...), XMP, comments or IPTC.
+    """
+    exif = img.getexif()
+    if any(tag != EXIF_ORIENTATION for tag in exif) or exif.get(EXIF_ORIENTATION, 1) != 1:
+        return True
+    return any(key in img.info for key in METADATA_INFO_KEYS)
+
+
+def can_pass_through(img, path, original_size, max_side, max_bytes=None):
+    """
+    True if the uploaded bytes can be sent to Gemini as they are: an already-compressed
+    single-frame JPEG/WebP, upright, without identifying metadata (the re-encode drops it),
+    within max_side and max_bytes.
+    """
+    if img.format not in PASSTHROUGH_FORMATS or getattr(img, "n_frames", 1) > 1:
+        return False
+    if img.mode not in ("RGB", "L") and not (img.format == "WEBP" and img.mode == "RGBA"):
+        return False  # e.g. CMYK JPEGs
+    if max(original_size) > max_side:
+        return False
+    if max_bytes and os.path.getsize(path) > max_bytes:
+        return False
+    # Patient photos go to a third-party API: never with their GPS / device / time metadata
+    return not has_private_metadata(img)
+
+
+def gemini_part_for(img, path, passthrough, max_side=1024, quality=85, max_bytes=None, derivative=None):
+    """
+    Applies the outbound image policy to an upload: its own bytes when `passthrough` (see
+    can_pass_through), otherwise an upright copy bounded to max_side (`derivative`, if the
+    caller already has it) re-encoded within max_bytes.
+
+    Returns:
+        dict: {"mime_type", "data"}
+    """
+    if passthrough:
+        with open(path, "rb") as f:
+            return {"mime_type": PASSTHROUGH_FORMATS[img.format], "data": f.read()}
+    if derivative is None:
+        derivative = ImageOps.exif_transpose(img)  # always a copy, safe to downscale in place
+        derivative.thumbnail((max_side, max_side))
+    return encode_for_gemini(derivative, quality, max_bytes)
+
+
+def is_passthrough_part(path, part):
+    """True if a Gemini part is the upload's own bytes (the passthrough side of the policy)."""
+    data = part.get("data") if isinstance(part, dict) else None
+    if not data:
+        return False
+    try:
+        if os.path.getsize(path) != len(data):
+            return False
+        with open(path, "rb") as f:
+            return f.read() == data
+    except OSError:
+        return False
+
+
+def _gemini_suffix(mime_type):
+    return next(suffix for suffix, known in GEMINI_SUFFIXES.items() if known == mime_type)
+
+
+def _link_or_write(source_path, path, data):
+    """Passthrough parts are the original bytes: hard-link them instead of storing a copy."""
+    tmp_path = _temp_path(path)
+    try:
+        os.link(source_path, tmp_path)
+        os.replace(tmp_path, path)
+    except OSError:
+        _remove_quietly(tmp_path)
+        _write_atomic(path, data)
+
+
+def open_image(path, reduce_to=None):
+    """
+    Opens an image, optionally for a decode at reduced resolution: JPEG decoders scale by 1/2,
+    1/4 or 1/8 while decoding, as far as both sides stay >= `reduce_to`. Other formats decode
+    at full size. The caller loads (decodes) the returned image.
+
+    Returns:
+        tuple: (image, original (width, height) before any reduction)
+    """
+    img = Image.open(path)
+    original_size = img.size
+    if reduce_to:
+        img.draft(None, (reduce_to, reduce_to))
+    return img, original_size
+
+
+def resize_view(img, mode, target_size, fast=False):
+    """
+    Converts and resizes a decoded image for a model view.
+
+    The exact path matches image_analyzer's original preprocessing (convert, then resize with
+    Pillow's default filter). The fast path shrinks by an integer factor first (Image.reduce),
+    resamples bilinearly, and converts the small result instead of the full-size image.
+    """
+    target_size = tuple(target_size)
+    if not fast:
+        converted = img if img.mode == mode else img.convert(mode)
+        return converted.resize(target_size)
+    if img.mode not in ("L", "RGB"):
+        img = img.convert("RGB")
+    small = img.resize(target_size, FAST_RESAMPLE, reducing_gap=FAST_REDUCING_GAP)
+    return small if small.mode == mode else small.convert(mode)
+
+
+def model_inputs_from_image(img, target_size=MODEL_INPUT_SIZE, fast=False):
+    """
+    Builds the local models' inputs from a decoded image, stored as uint8 (see resize_view
+    for the exact and fast resampling paths).
+    """
+    return {
+        "gray": np.asarray(resize_view(img, "L", target_size, fast), dtype=np.uint8),
+        "rgb": np.asarray(resize_view(img, "RGB", target_size, fast), dtype=np.uint8),
+        "size": np.array(img.size, dtype=np.int32),
+    }
+
+
+def to_model_array(view):
+    """
+    uint8 view -> float32 in [0, 1]. Dividing in float32 gives exactly the float32 values the
+    models saw when preprocessing produced float64 (x / 255.0, cast on input), at half the memory.
+    """
+    return np.asarray(view, dtype=np.float32) / np.float32(255.0)
+
+
+def _temp_path(path):
+    """Temporary name next to path, unique per process and thread (concurrent writers of one path)."""
+    return f"{path}.tmp{os.getpid()}-{threading.get_ident()}"
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _write_atomic(path, data):
+    tmp_path = _temp_path(path)
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        _remove_quietly(tmp_path)
+        raise
+
+
+def _thumbnail_bytes(img, thumb_side, quality):
+    thumb = img.copy()
+    thumb.thumbnail((thumb_side, thumb_side))
+    if thumb.mode not in ("RGB", "RGBA"):
+        thumb = thumb.convert("RGBA" if _has_alpha(thumb) else "RGB")
+    out = io.BytesIO()
+    thumb.save(out, format="WEBP", quality=quality, method=4)
+    return out.getvalue()
+
+
+def ingest_upload(original_path, thumb_side=256, max_side=1024, quality=85, thumb_quality=75, fast=False,
+                  max_bytes=None):
+    """
+    Decodes a saved upload once and writes its thumbnail, Gemini part and model inputs.
+
+    Args:
+        original_path (str): Path of the saved upload
+        thumb_side (int): Longest side of the chat bubble thumbnail
+        max_side (int): Longest side of the image sent to Gemini
+        quality (int): JPEG quality of the Gemini part
+        thumb_quality (int): WebP quality of the thumbnail
+        fast (bool): Decode at reduced resolution (still >= max_side) and use the fast model resampling
+        max_bytes (int): Byte cap for the Gemini part (see gemini_part_for)
+
+    Returns:
+        dict: {"thumbnail", "gemini", "model_inputs"} paths, the Gemini "part", whether it is
+        the uploaded bytes ("passthrough") and an ImageContext ("context") holding the computed
+        inputs for the rest of the request
+
+    Raises:
+        OSError, ValueError: if the file is not a decodable image
+    """
+    img, original_size = open_image(original_path, reduce_to=max_side if fast else None)
+    with img:
+        passthrough = can_pass_through(img, original_path, original_size, max_side, max_bytes)
+        img.load()
+        # Model inputs follow the existing preprocessing, which never applied EXIF orientation
+        inputs = model_inputs_from_image(img, fast=fast)
+        inputs["size"] = np.array(original_size, dtype=np.int32)
+        # The policy decision travels with the stored inputs, so later turns need not re-read the upload
+        inputs["passthrough"] = np.array(passthrough)
+
+        # What people (and Gemini) look at is shown upright
+        derivative = ImageOps.exif_transpose(img)  # always a copy, safe to downscale in place
+        derivative.thumbnail((max_side, max_side))
+    part = gemini_part_for(img, original_path, passthrough, max_side, quality, max_bytes, derivative)
+
+    paths = {
+        "thumbnail": derivative_path(original_path, THUMB_SUFFIX),
+        "gemini": derivative_path(original_path, _gemini_suffix(part["mime_type"])),
+        "model_inputs": derivative_path(original_path, MODEL_SUFFIX),
+    }
+    # The thumbnail is scaled down from the derivative, not from the full-size original
+    _write_atomic(paths["thumbnail"], _thumbnail_bytes(derivative, thumb_side, thumb_quality))
+    if passthrough:
+        _link_or_write(original_path, paths["gemini"], part["data"])
+    else:
+        _write_atomic(paths["gemini"], part["data"])
+    buffer = io.BytesIO()
+    np.savez(buffer, **inputs)
+    _write_atomic(paths["model_inputs"], buffer.getvalue())
+    paths["part"] = part
+    paths["passthrough"] = passthrough
+    paths["context"] = ImageContext(original_path, model_inputs=inputs, part=part, fast=fast, decode_side=max_side)
+    return paths
+
+
+def has_derivatives(original_path):
+    """True if an upload's thumbnail, Gemini part and model inputs are all on disk."""
+    return (os.path.exists(derivative_path(original_path, THUMB_SUFFIX))
+            and os.path.exists(derivative_path(original_path, MODEL_SUFFIX))
+            and any(os.path.exists(derivative_path(original_path, suffix)) for suffix in GEMINI_SUFFIXES))
+
+
+def ensure_thumbnail(upload_folder, filename, thumb_side=256, thumb_quality=75):
+    """
+    Creates a missing thumbnail for an upload that predates the pipeline.
+
+    Returns:
+        bool: True if the thumbnail exists afterwards
+    """
+    original = original_for_thumbnail(filename)
+    # Plain names or relative store keys only; never escape the upload folder
+    if not original or os.path.isabs(original) or ".." in original.replace("\\", "/").split("/"):
+        return False
+    path = os.path.join(upload_folder, filename)
+    if os.path.exists(path):
+        return True
+    original_path = os.path.join(upload_folder, original)
+    try:
+        with Image.open(original_path) as img:
+            img.draft("RGB", (thumb_side * 2, thumb_side * 2))
+            upright = ImageOps.exif_transpose(img)
+            _write_atomic(path, _thumbnail_bytes(upright, thumb_side, thumb_quality))
+        return True
+    except (OSError, ValueError) as e:
+        print(f"Warning: Could not create thumbnail for {original}: {e}")
+        return False
+
+
+def load_gemini_part(original_path):
+    """Returns the stored Gemini part for an upload, or None if it has no derivative."""
+    for suffix, mime_type in GEMINI_SUFFIXES.items():
+        try:
+            with open(derivative_path(original_path, suffix), "rb") as f:
+                return {"mime_type": mime_type, "data": f.read()}
+        except OSError:
+            continue
+    return None
+
+
+def load_model_inputs(original_path):
+    """
+    Returns the stored model inputs ({"gray", "rgb", "size"}, plus "passthrough" for uploads
+    ingested since it was recorded) for an upload, or None.
+    """
+    try:
+        with np.load(derivative_path(original_path, MODEL_SUFFIX)) as stored:
+            inputs = {key: stored[key] for key in ("gray", "rgb", "size")}
+            if "passthrough" in stored:
+                inputs["passthrough"] = stored["passthrough"]
+            return inputs
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+class ImageContext:
+    """
+    One request's view of an uploaded image. Everything is computed lazily and at most once:
+
+    - size: the original (width, height), from stored inputs or the file header (no decode)
+    - view(mode, size): converted + resized uint8 array; the 224x224 "L"/"RGB" views come from
+      the stored model inputs when present, anything else from a single shared decode
+    - gemini_part(): the stored derivative, else encoded from the same decode
+    - passthrough: whether that part is the uploaded bytes, as decided when it was made
+
+    Args:
+        path (str): Path of the original upload
+        model_inputs (dict): Inputs already computed by ingest_upload, if any
+        part (dict): Gemini part already computed by ingest_upload, if any
+        fast (bool): Decode at reduced resolution (>= decode_side) and resample views the fast way
+        decode_side (int): Smallest side the reduced decode must keep (the Gemini part's max side)
+    """
+
+    STORED_VIEWS = {("L", MODEL_INPUT_SIZE): "gray", ("RGB", MODEL_INPUT_SIZE): "rgb"}
+
+    def __init__(self, path, model_inputs=None, part=None, fast=False, decode_side=1024):
+        self.path = path
+        self.fast = fast
+        self.decode_side = decode_side
+        self._model_inputs = model_inputs
+        self._inputs_loaded = model_inputs is not None
+        self._part = part
+        self._passthrough = None
+        self._image = None
+        self._size = None
+        self._views = {}
+        self._lock = threading.Lock()
+        self.decodes = 0
+
+    def _decoded(self):
+        if self._image is None:
+            img, original_size = open_image(self.path, reduce_to=self.decode_side if self.fast else None)
+            with img:
+                img.load()  # the decoded pixels stay usable once the file is closed
+            self._image = img
+            self._size = self._size or original_size
+            self.decodes += 1
+        return self._image
+
+    @property
+    def model_inputs(self):
+        """Stored model inputs ({"gray", "rgb", "size"}) or None for uploads without them."""
+        if not self._inputs_loaded:
+            self._model_inputs = load_model_inputs(self.path)
+            self._inputs_loaded = True
+        return self._model_inputs
+
+    @property
+    def size(self):
+        if self._size is None:
+            inputs = self.model_inputs
+            if inputs is not None:
+                self._size = tuple(int(v) for v in inputs["size"])
+            else:
+                with Image.open(self.path) as img:
+                    self._size = img.size
+        return self._size
+
+    def view(self, mode, size=MODEL_INPUT_SIZE):
+        """
+        Returns the image converted to `mode` and resized to `size` as a uint8 array (see
+        resize_view for the exact and fast paths).
+        """
+        key = (mode, tuple(size))
+        with self._lock:
+            if key not in self._views:
+                stored = self.STORED_VIEWS.get(key)
+                inputs = self.model_inputs if stored else None
+                if inputs is not None:
+                    self._views[key] = inputs[stored]
+                else:
+                    self._views[key] = np.asarray(resize_view(self._decoded(), mode, key[1], self.fast),
+                                                  dtype=np.uint8)
+            return self._views[key]
+
+    def gemini_part(self, max_side=1024, quality=85, max_bytes=None):
+        """
+        The Gemini inline-data part: the stored derivative, else the outbound policy applied to
+        the single decode (see gemini_part_for).
+        """
+        size = self.size
+        with self._lock:
+            if self._part is None:
+                self._part = load_gemini_part(self.path)
+            if self._part is None:
+                img = self._decoded()
+                self._passthrough = can_pass_through(img, self.path, size, max_side, max_bytes)
+                self._part = gemini_part_for(img, self.path, self._passthrough, max_side, quality, max_bytes)
+            return self._part
+
+    @property
+    def passthrough(self):
+        """
+        True if the Gemini part is the upload's own bytes. Read from the stored inputs; only
+        uploads ingested before the decision was stored compare the part with the file (once).
+        """
+        if self._passthrough is None:
+            inputs = self.model_inputs
+            if inputs is not None and "passthrough" in inputs:
+                self._passthrough = bool(inputs["passthrough"])
+            else:
+                part = self._part if self._part is not None else load_gemini_part(self.path)
+                self._passthrough = part is not None and is_passthrough_part(self.path, part)
+        return self._passthrough
@@ -0,0 +1,120 @@
+# image_parts.py
+"""
+Bounded cache of Gemini-ready image parts for uploaded files.
+
+Replaying a thread used to Image.open() every past upload (never closing the handles) and
+let the SDK re-encode each PIL image on every rehydration. Here each upload goes through
+the outbound image policy once (image_ingest.gemini_part_for: small JPEG/WebP files are
+sent as uploaded, anything else is downscaled to IMAGE_PART_MAX_SIDE and re-encoded within
+IMAGE_PART_MAX_BYTES), and the resulting bytes are cached as an inline-data part:
+
+    {"mime_type": "image/jpeg", "data": b"..."}
+
+which google.generativeai accepts anywhere a PIL image is accepted. Entries are keyed by
+filename plus the file's size and mtime, so a replaced file is never served stale. The
+cache is bounded by entry count and total bytes (LRU), and no file handle outlives a call.
+Uploads that went through image_ingest already have the encoded part on disk; it is read
+as-is instead of decoding the original.
+"""
+
+import os
+import threading
+import time
+
+from PIL import Image
+
+from cache import TTLCache
+from image_ingest import can_pass_through, gemini_part_for, load_gemini_part
+
+
+def encode_image_part(path, max_side=1024, quality=85, max_bytes=None):
+    """
+    Builds the Gemini part for an image file under the outbound policy: the file's own
+    bytes when it is a small enough JPEG/WebP, else a downscaled re-encode.
+
+    Returns:
+        dict: {"mime_type", "data"} inline-data part
+    """
+    with Image.open(path) as img:
+        if can_pass_through(img, path, img.size, max_side, max_bytes):
+            return gemini_part_for(img, path, True)
+        # JPEG decoders can scale by 1/2..1/8 while decoding, far cheaper than a full decode
+        img.draft("RGB", (max_side, max_side))
+        return gemini_part_for(img, path, False, max_side, quality, max_bytes)
+
+
+class ImagePartCache:
+    """
+    Args:
+        upload_folder (str): directory the filenames are relative to
+        max_entries (int): maximum number of cached parts
+        max_bytes (int): budget for the summed encoded size
+        max_side (int): longest side of the encoded image, in pixels
+        quality (int): JPEG quality
+        ttl (float): seconds an unused part stays cached
+        part_max_bytes (int): byte cap for one encoded part (see image_ingest.gemini_part_for)
+    """
+
+    def __init__(self, upload_folder, max_entries=512, max_bytes=64 * 1024 * 1024, max_side=1024, quality=85,
+                 ttl=3600.0, part_max_bytes=None):
+        self.upload_folder = upload_folder
+        self.max_side = max_side
+        self.quality = quality
+        self.part_max_bytes = part_max_bytes
+        self._cache = TTLCache(max_entries=max_entries, ttl=ttl, name="image_parts", max_bytes=max_bytes,
+                               sizeof=lambda part: len(part["data"]), sliding=True)
+        self._lock = threading.Lock()
+        self._encodes = 0
+        self._encode_ms = 0.0
+        self._errors = 0
+        self._stored_reads = 0
+
+    def get_part(self, filename):
+        """Returns the cached inline-data part for an upload, encoding it on first use; None if unreadable."""
+        if not filename:
+            return None
+        path = os.path.join(self.upload_folder, filename)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key = (filename, st.st_size, st.st_mtime_ns)
+        return self._cache.get_or_load(key, lambda: self._encode(path))
+
+    def prime(self, filename, part):
+        """Caches a part produced at upload time, so the first turn doesn't read it back."""
+        try:
+            st = os.stat(os.path.join(self.upload_folder, filename))
+        except OSError:
+            return
+        self._cache.set((filename, st.st_size, st.st_mtime_ns), part)
+
+    def _encode(self, path):
+        stored = load_gemini_part(path)
+        if stored:
+            with self._lock:
+                self._stored_reads += 1
+            return stored
+        started = time.perf_counter()
+        try:
+            part = encode_image_part(path, self.max_side, self.quality, self.part_max_bytes)
+        except (OSError, ValueError) as e:
+            with self._lock:
+                self._errors += 1
+            print(f"Warning: Failed to encode image {path} for the API: {e}")
+            return None
+        with self._lock:
+            self._encodes += 1
+            self._encode_ms += (time.perf_counter() - started) * 1000
+        return part
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        """Returns hit/miss/eviction counters, cached bytes, derivative reads and total encode time."""
+        stats = self._cache.stats()
+        with self._lock:
+            stats.update(encodes=self._encodes, stored_reads=self._stored_reads,
+                         encode_ms=round(self._encode_ms, 2), errors=self._errors)
+        return stats
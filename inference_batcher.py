@@ -0,0 +1,132 @@
+# inference_batcher.py
+"""
+Micro-batching for the image models.
+
+Each analysis used to call model.predict on a batch of one, so concurrent uploads made the
+CPU run many tiny forward passes. A MicroBatcher puts every request on a queue; one worker
+thread per model takes the first waiting request, gathers more until it has `max_batch`
+images or `max_wait` seconds have passed, runs a single forward pass over the stacked batch
+and hands each caller its own row of the output.
+
+A request that arrives alone waits at most `max_wait` before it runs. Once the worker is
+busy, requests that arrive during a forward pass are batched together for the next one.
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+WAIT_SAMPLES = 1024  # recent queue waits kept for the percentiles
+
+
+class _Request:
+    __slots__ = ("inputs", "enqueued_at", "done", "result", "error")
+
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.enqueued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Args:
+        predict_fn (callable): runs one forward pass on a stacked batch and returns an array
+            with one row per input
+        max_batch (int): largest batch per forward pass
+        max_wait (float): seconds the first request of a batch waits for others
+        name (str): worker thread name suffix
+    """
+
+    def __init__(self, predict_fn, max_batch=16, max_wait=0.005, name="model"):
+        self.predict_fn = predict_fn
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = {}
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self._stats = {"requests": 0, "batches": 0, "errors": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0,
+                       "inference_ms_total": 0.0}
+        self._started_at = None
+        self._thread = threading.Thread(target=self._run, name=f"inference-{name}", daemon=True)
+        self._thread.start()
+
+    def predict(self, inputs, timeout=None):
+        """
+        Queues a batch of one (shape (1, ...)) and blocks until its forward pass has run.
+
+        Returns:
+            numpy.ndarray: the model output for this input, shape (1, ...)
+        """
+        request = _Request(inputs)
+        self._queue.put(request)
+        if not request.done.wait(timeout):
+            raise TimeoutError("inference did not complete in time")
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            waits = [(started - request.enqueued_at) * 1000 for request in batch]
+            try:
+                outputs = np.asarray(self.predict_fn(np.concatenate([request.inputs for request in batch])))
+                for i, request in enumerate(batch):
+                    request.result = outputs[i:i + 1]
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+            finished = time.perf_counter()
+            for request in batch:
+                request.done.set()
+            self._record(len(batch), waits, (finished - started) * 1000, batch[0].error is not None)
+
+    def _record(self, size, waits, inference_ms, failed):
+        with self._stats_lock:
+            if self._started_at is None:
+                self._started_at = time.perf_counter() - inference_ms / 1000
+            stats = self._stats
+            stats["requests"] += size
+            stats["batches"] += 1
+            stats["errors"] += size if failed else 0
+            stats["wait_ms_total"] += sum(waits)
+            stats["wait_ms_max"] = max(stats["wait_ms_max"], max(waits))
+            stats["inference_ms_total"] += inference_ms
+            self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+            self._waits.extend(waits)
+
+    def stats(self):
+        """Batch-size histogram, queue wait (ms) and throughput (images per second)."""
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+            snapshot["batch_sizes"] = dict(sorted(self._batch_sizes.items()))
+            waits = sorted(self._waits)
+            elapsed = time.perf_counter() - self._started_at if self._started_at is not None else 0
+        requests, batches = snapshot["requests"], snapshot["batches"]
+        snapshot["queue_depth"] = self._queue.qsize()
+        snapshot["avg_batch_size"] = round(requests / batches, 2) if batches else 0
+        snapshot["wait_ms_avg"] = round(snapshot["wait_ms_total"] / requests, 2) if requests else 0
+        snapshot["wait_ms_p95"] = round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 2) if waits else 0
+        snapshot["images_per_sec"] = round(requests / elapsed, 1) if elapsed else 0
+        snapshot["images_per_busy_sec"] = (round(requests / (snapshot["inference_ms_total"] / 1000), 1)
+                                           if snapshot["inference_ms_total"] else 0)
+        return snapshot
@@ -0,0 +1,177 @@
+# model_cache.py
+"""
+One-time conversion of the legacy .h5 models into Keras' native .keras format.
+
+The .h5 files were saved by an older TensorFlow; loading them in a current one walks a chain
+of fallbacks, the last of which copies the whole file, rewrites its model_config JSON and
+loads the copy (see image_analyzer._load_model_with_batch_shape_fix). Instead, the first
+successful load is saved once into the cache directory, keyed by the SHA-256 of the source
+file, and every later start loads the converted artifact directly:
+
+    model_cache/pneumonia_classification_model-3fa2c9d1e0b4a7f6.keras
+
+Replacing a .h5 file changes its hash, so a stale conversion is never used. Hashing a large
+file is itself not free, so the digest is remembered in a manifest next to the artifacts
+and only recomputed when the source's size or mtime changes.
+
+Convert ahead of deployment (e.g. while building the image) so no worker pays for it:
+
+    python model_cache.py --convert
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+
+import tensorflow as tf
+
+CHUNK_SIZE = 1024 * 1024
+MANIFEST_NAME = "manifest.json"
+
+_manifest_lock = threading.Lock()
+
+
+def normalize_model_config(obj):
+    """
+    Removes the parts of a newer Keras model_config that older loaders reject, in place:
+    `batch_shape` keys and the bare "DTypePolicy" dtype_policy marker.
+    """
+    if isinstance(obj, dict):
+        obj.pop('batch_shape', None)
+        if obj.get('dtype_policy') == 'DTypePolicy':
+            obj['dtype_policy'] = None
+        for value in obj.values():
+            normalize_model_config(value)
+    elif isinstance(obj, list):
+        for item in obj:
+            normalize_model_config(item)
+    return obj
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_manifest(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def source_digest(source_path, cache_dir):
+    """SHA-256 of the source file, reusing the manifest's value while size and mtime are unchanged."""
+    stat = os.stat(source_path)
+    key = os.path.abspath(source_path)
+    with _manifest_lock:
+        manifest = _read_manifest(cache_dir)
+        entry = manifest.get(key)
+        if entry and entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+            return entry["sha256"]
+        digest = file_sha256(source_path)
+        manifest[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = os.path.join(cache_dir, f".{MANIFEST_NAME}.{os.getpid()}")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, os.path.join(cache_dir, MANIFEST_NAME))
+    return digest
+
+
+def cached_model_path(source_path, cache_dir):
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    return os.path.join(cache_dir, f"{stem}-{source_digest(source_path, cache_dir)[:16]}.keras")
+
+
+def save_converted(model, path):
+    """Writes the native artifact atomically, so a concurrent start never loads half a file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path[:-len('.keras')]}.{os.getpid()}.{threading.get_ident()}.tmp.keras"
+    try:
+        model.save(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def load_cached_model(source_path, raw_loader, cache_dir):
+    """
+    Loads a model from its converted artifact, converting it on first use.
+
+    Args:
+        source_path (str): the .h5 file the model comes from
+        raw_loader (callable): loads the source the slow way; returns a model or None
+        cache_dir (str): directory of converted artifacts; empty disables the cache
+
+    Returns:
+        The Keras model, or None if the source could not be loaded
+    """
+    if not cache_dir or not os.path.exists(source_path):
+        return raw_loader()
+    path = cached_model_path(source_path, cache_dir)
+    if os.path.exists(path):
+        try:
+            model = tf.keras.models.load_model(path, compile=False)
+            print(f"Loaded {os.path.basename(source_path)} from converted model {path}.")
+            return model
+        except Exception as e:
+            print(f"Converted model {path} is unreadable ({e}); converting again.")
+            os.remove(path)
+    model = raw_loader()
+    if model is None:
+        return None
+    try:
+        save_converted(model, path)
+        print(f"Converted {os.path.basename(source_path)} to {path}.")
+    except Exception as e:
+        # The model itself is fine: serve it and retry the conversion on the next start
+        print(f"Could not save converted model {path}: {e}")
+    return model
+
+
+def remove_stale(cache_dir, keep):
+    """Deletes converted artifacts that no current source file maps to."""
+    removed = []
+    for name in sorted(os.listdir(cache_dir)):
+        path = os.path.join(cache_dir, name)
+        if name.endswith(".keras") and os.path.abspath(path) not in keep:
+            os.remove(path)
+            removed.append(name)
+    return removed
+
+
+if __name__ == "__main__":
+    from config import Config
+    import image_analyzer
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cache-dir", default=Config.MODEL_CACHE_DIR)
+    parser.add_argument("--convert", action="store_true", help="convert every model that has no current artifact")
+    parser.add_argument("--prune", action="store_true", help="also delete artifacts of replaced source files")
+    args = parser.parse_args()
+    if not args.convert:
+        parser.error("nothing to do (pass --convert)")
+    if not args.cache_dir:
+        parser.error("MODEL_CACHE_DIR is empty: the model cache is disabled")
+    keep = set()
+    for name, (source_path, raw_loader) in image_analyzer.MODEL_SOURCES.items():
+        if not os.path.exists(source_path):
+            print(f"{name}: {source_path} not found, skipped")
+            continue
+        model = load_cached_model(source_path, raw_loader, args.cache_dir)
+        status = "ok" if model is not None else "FAILED"
+        keep.add(os.path.abspath(cached_model_path(source_path, args.cache_dir)))
+        print(f"{name}: {status}")
+    if args.prune:
+        print("removed:", remove_stale(args.cache_dir, keep) or "nothing")
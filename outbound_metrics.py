@@ -0,0 +1,89 @@
+# outbound_metrics.py
+"""
+Counts the bytes each chat turn sends to Gemini.
+
+A ChatSession re-sends its whole history with every message, so a turn's request is the
+history plus the new user parts; both are measured. Sizes are payload bytes (UTF-8 text and
+raw inline image data), not the transport encoding. Image parts the SDK has to encode
+itself (PIL images) can't be sized up front and count as 0.
+"""
+
+import threading
+
+
+def part_bytes(part):
+    """Payload bytes of one message part: str, {"mime_type", "data"} dict, or an SDK Part."""
+    if isinstance(part, str):
+        return len(part.encode("utf-8"))
+    if isinstance(part, dict):
+        return len(part.get("data") or b"")
+    inline_data = getattr(part, "inline_data", None)
+    if inline_data is not None and getattr(inline_data, "data", None):
+        return len(inline_data.data)
+    text = getattr(part, "text", None)
+    return len(text.encode("utf-8")) if text else 0
+
+
+def image_part_bytes(parts):
+    return sum(part_bytes(part) for part in parts if not isinstance(part, str) and not getattr(part, "text", None))
+
+
+def contents_bytes(contents):
+    """Payload bytes of a history: {"role", "parts"} dicts or SDK Content objects."""
+    total = 0
+    for content in contents or ():
+        parts = content.get("parts", ()) if isinstance(content, dict) else getattr(content, "parts", ())
+        total += sum(part_bytes(part) for part in parts)
+    return total
+
+
+class OutboundBytes:
+    """Thread-safe per-turn byte counters and the outbound image policy's decisions."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {"turns": 0, "image_turns": 0, "bytes_sent": 0, "history_bytes": 0, "image_bytes": 0,
+                       "max_turn_bytes": 0, "last_turn_bytes": 0, "images_passthrough": 0, "images_reencoded": 0,
+                       "failed_turns": 0, "failed_bytes": 0}
+
+    def record_turn(self, history, user_parts, delivered=True):
+        """
+        Records one request to Gemini, once its outcome is known. A request that failed is
+        counted under failed_turns / failed_bytes, not as bytes sent.
+
+        Args:
+            history: the history as it was sent (captured before send_message appends to it)
+            user_parts (list): the new message's parts
+            delivered (bool): whether Gemini answered the request
+
+        Returns:
+            int: bytes of this turn
+        """
+        history_bytes = contents_bytes(history)
+        message_bytes = sum(part_bytes(part) for part in user_parts)
+        image_bytes = image_part_bytes(user_parts)
+        turn_bytes = history_bytes + message_bytes
+        with self._lock:
+            stats = self._stats
+            if not delivered:
+                stats["failed_turns"] += 1
+                stats["failed_bytes"] += turn_bytes
+                return turn_bytes
+            stats["turns"] += 1
+            stats["image_turns"] += 1 if image_bytes else 0
+            stats["bytes_sent"] += turn_bytes
+            stats["history_bytes"] += history_bytes
+            stats["image_bytes"] += image_bytes
+            stats["max_turn_bytes"] = max(stats["max_turn_bytes"], turn_bytes)
+            stats["last_turn_bytes"] = turn_bytes
+        return turn_bytes
+
+    def record_image(self, passthrough):
+        with self._lock:
+            self._stats["images_passthrough" if passthrough else "images_reencoded"] += 1
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+        snapshot["avg_turn_bytes"] = round(snapshot["bytes_sent"] / snapshot["turns"]) if snapshot["turns"] else 0
+        return snapshot
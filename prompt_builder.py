@@ -62,4 +62,23 @@ def get_non_symptom_message():
     """
     return "I am only designed for diagnosing symptoms and predicting diseases to help doctors. I am not replacing doctors, but helping them. Please describe your symptoms if you need medical assistance, or consult with a healthcare professional for other questions."
 
+def build_summary_prompt(previous_summary, transcript_text, max_chars):
+    """
+    Builds the prompt that folds older turns of a long thread into its running summary.
+    
+    Args:
+        previous_summary (str or None): The thread's current summary, if any
+        transcript_text (str): The older turns to fold in, one "Role: text" line each
+        max_chars (int): Upper bound for the length of the new summary
+        
+    Returns:
+        str: Prompt for the summarization call
+    """
+    previous_section = f"Existing summary of the earlier conversation:\n{previous_summary}\n\n" if previous_summary else ""
+    return f"""You are maintaining the running case notes of a medical chat between a patient and an AI assistant.
+
+{previous_section}Newer messages to fold into the notes:
+{transcript_text}
+
+Write updated case notes (at most {max_chars} characters) that keep every fact a doctor would need later: reported symptoms and their duration, images the patient shared, diagnoses suggested with their probabilities and severity, medications and dosages recommended, and any open questions. Use short bullet points in plain language. Reply with the notes only."""
 
@@ -0,0 +1,190 @@
+# quantized_runtime.py
+"""
+Quantized TFLite runtime for the image models (MODEL_RUNTIME=tflite).
+
+The Keras models are exported once to TFLite with one of three quantizations and cached
+next to the converted .keras artifacts, keyed by the same source hash (see model_cache.py):
+
+    float16   weights stored as float16, compute in float32; about half the size, and
+              predictions are practically unchanged
+    dynamic   int8 weights, activations quantized on the fly; about a quarter of the size
+    int8      weights and activations int8, calibrated on real images; the smallest and
+              fastest on CPU, and the one most likely to move predictions
+
+int8 needs calibration images, so it can only be exported ahead of time:
+
+    python quantized_runtime.py --export --quantization int8 --calibration uploads/
+
+float16 and dynamic exports are also made on first load. Inputs and outputs stay float32
+in every mode, so a TFLiteModel works anywhere the Keras model was used (registry warm-up,
+inference_fn, batched predict). Run bench_quantized_parity.py before switching over.
+
+The interpreter comes from ai_edge_litert when it is installed, else from tf.lite.
+"""
+
+import argparse
+import os
+import threading
+
+import numpy as np
+import tensorflow as tf
+
+try:
+    from ai_edge_litert.interpreter import Interpreter
+except ImportError:
+    Interpreter = tf.lite.Interpreter
+
+from model_cache import cached_model_path, load_cached_model
+
+QUANTIZATIONS = ("float16", "dynamic", "int8")
+CALIBRATION_LIMIT = 200  # images used to calibrate int8 activation ranges
+
+
+class TFLiteModel:
+    """
+    A TFLite interpreter with the slice of the Keras model API the app uses: input_shape and
+    predict(batch). A batch runs as one invoke: the input tensor is resized (and the tensors
+    reallocated) only when the batch size changes. The interpreter is not thread-safe, so
+    calls are serialized (run_inference calls it directly, without the micro-batcher).
+
+    Args:
+        path (str): .tflite file
+        num_threads (int): interpreter threads (None lets TFLite decide)
+    """
+
+    def __init__(self, path, num_threads=None):
+        self.path = path
+        self._interpreter = Interpreter(model_path=path, num_threads=num_threads)
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]
+        self._output_index = self._interpreter.get_output_details()[0]["index"]
+        self.input_shape = (None,) + tuple(int(dim) for dim in self._input["shape"][1:])
+        self._batch_size = int(self._input["shape"][0])
+        self._lock = threading.Lock()
+
+    def predict(self, batch, verbose=0):
+        batch = np.asarray(batch, dtype=np.float32)
+        with self._lock:
+            if len(batch) != self._batch_size:
+                self._interpreter.resize_tensor_input(self._input["index"], [len(batch)] + list(self.input_shape[1:]))
+                self._interpreter.allocate_tensors()
+                self._batch_size = len(batch)
+            self._interpreter.set_tensor(self._input["index"], batch)
+            self._interpreter.invoke()
+            return self._interpreter.get_tensor(self._output_index).copy()
+
+
+def quantized_model_path(source_path, cache_dir, quantization):
+    return cached_model_path(source_path, cache_dir)[:-len(".keras")] + f".{quantization}.tflite"
+
+
+def export_tflite(model, path, quantization, calibration_batches=None):
+    """
+    Converts a Keras model to TFLite and writes it atomically.
+
+    Args:
+        model: Keras model
+        path (str): destination .tflite file
+        quantization (str): one of QUANTIZATIONS
+        calibration_batches (list): float32 batches of one, required for int8
+
+    Returns:
+        int: size of the exported model in bytes
+    """
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"unknown quantization {quantization!r}, expected one of {QUANTIZATIONS}")
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        if not calibration_batches:
+            raise ValueError("int8 export needs calibration images")
+        converter.representative_dataset = lambda: ([batch] for batch in calibration_batches)
+    content = converter.convert()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+    return len(content)
+
+
+def load_quantized_model(source_path, raw_loader, cache_dir, quantization, num_threads=None):
+    """
+    Loads the TFLite export of a model, exporting float16 / dynamic on first use.
+
+    When there is no usable export (no cache directory, or an int8 model that was never
+    calibrated) the Keras model is returned instead, so image analysis keeps working.
+
+    Returns:
+        TFLiteModel, a Keras model, or None if the source could not be loaded
+    """
+    if cache_dir and os.path.exists(source_path):
+        path = quantized_model_path(source_path, cache_dir, quantization)
+        if os.path.exists(path):
+            print(f"Loaded {os.path.basename(source_path)} from {quantization} TFLite model {path}.")
+            return TFLiteModel(path, num_threads)
+        if quantization != "int8":
+            model = load_cached_model(source_path, raw_loader, cache_dir)
+            if model is None:
+                return None
+            try:
+                size = export_tflite(model, path, quantization)
+                print(f"Exported {os.path.basename(source_path)} to {quantization} TFLite ({size / 1e6:.1f} MB).")
+                return TFLiteModel(path, num_threads)
+            except Exception as e:
+                print(f"TFLite export of {os.path.basename(source_path)} failed ({e}); using the Keras model.")
+                return model
+    print(f"No {quantization} TFLite model for {os.path.basename(source_path)}; using the Keras model.")
+    return load_cached_model(source_path, raw_loader, cache_dir)
+
+
+def calibration_batches(folder, mode, size, limit=CALIBRATION_LIMIT):
+    """Preprocessed float32 batches of one from the images under folder, as the analysis builds them."""
+    from image_ingest import ImageContext, to_model_array
+
+    batches = []
+    for root, _, names in os.walk(folder):
+        for name in sorted(names):
+            if len(batches) >= limit:
+                return batches
+            if name.count(".") != 1 or not name.lower().endswith((".png", ".jpg", ".jpeg", ".webp", ".bmp")):
+                continue
+            try:
+                array = to_model_array(ImageContext(os.path.join(root, name)).view(mode, size))
+            except Exception as e:
+                print(f"Skipping {name}: {e}")
+                continue
+            batches.append((array[:, :, np.newaxis] if array.ndim == 2 else array)[np.newaxis])
+    return batches
+
+
+if __name__ == "__main__":
+    from config import Config
+    import image_analyzer
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--export", action="store_true", help="export the TFLite models")
+    parser.add_argument("--quantization", choices=QUANTIZATIONS, default=Config.MODEL_TFLITE_QUANTIZATION)
+    parser.add_argument("--calibration", help="image folder for int8 calibration")
+    parser.add_argument("--cache-dir", default=Config.MODEL_CACHE_DIR)
+    args = parser.parse_args()
+    if not args.export:
+        parser.error("nothing to do (pass --export)")
+    if args.quantization == "int8" and not args.calibration:
+        parser.error("int8 needs --calibration")
+    if not args.cache_dir:
+        parser.error("MODEL_CACHE_DIR is empty: nowhere to store the export")
+    for name, (source_path, raw_loader) in image_analyzer.MODEL_SOURCES.items():
+        model = load_cached_model(source_path, raw_loader, args.cache_dir) if os.path.exists(source_path) else None
+        if model is None:
+            print(f"{name}: model unavailable, skipped")
+            continue
+        batches = None
+        if args.calibration:
+            mode = "L" if model.input_shape[-1] == 1 else "RGB"
+            batches = calibration_batches(args.calibration, mode, tuple(model.input_shape[1:3]))
+        path = quantized_model_path(source_path, args.cache_dir, args.quantization)
+        size = export_tflite(model, path, args.quantization, batches)
+        print(f"{name}: {path} ({size / 1e6:.1f} MB, from {os.path.getsize(source_path) / 1e6:.1f} MB)")
@@ -0,0 +1,282 @@
+# session_state.py
+"""
+Shared session-state backends so any worker process (or node) can serve any user.
+
+Each user's chat state (active thread, rendered history page, pagination cursor and the
+transcript the Gemini chat is primed with) is stored as a JSON document together with a
+version number that increases on every save. Workers keep live sessions in their local
+SessionStore and only re-read the document when its version no longer matches, so a
+request that lands on the worker that handled the previous one costs one small lookup.
+
+- SQLiteSessionState: a local SQLite file (WAL) shared by all workers on one host.
+- RedisSessionState: any server speaking the Redis protocol (RESP), via a minimal
+  built-in client, for multi-node deployments.
+
+Select one with SESSION_STATE_BACKEND ("memory" keeps state per process, as before).
+"""
+
+import json
+import socket
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+
+class SessionStateError(Exception):
+    """Raised when the shared session-state backend cannot be reached or returns an error."""
+
+
+# --- SQLite ---
+
+class SQLiteSessionState:
+    name = "sqlite"
+
+    def __init__(self, path, ttl=86400.0, busy_timeout=5.0):
+        self.path = path
+        self.ttl = ttl
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._last_purge = 0.0
+        conn = self._conn()
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS session_state (
+                user_id INTEGER PRIMARY KEY,
+                version INTEGER NOT NULL,
+                thread_id INTEGER,
+                payload TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )"""
+        )
+        conn.commit()
+
+    def _conn(self):
+        # One connection per thread; every worker process opens its own
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _fetchone(self, query, params):
+        try:
+            return self._conn().execute(query, params).fetchone()
+        except sqlite3.Error as e:
+            raise SessionStateError(f"Failed to read session state: {e}") from e
+
+    def get_meta(self, user_id):
+        """Returns (version, thread_id) for a live entry, or None."""
+        row = self._fetchone(
+            "SELECT version, thread_id FROM session_state WHERE user_id = ? AND expires_at > ?",
+            (user_id, time.time())
+        )
+        return (row[0], row[1]) if row else None
+
+    def load(self, user_id):
+        """Returns (version, state dict) for a live entry, or None."""
+        row = self._fetchone(
+            "SELECT version, payload FROM session_state WHERE user_id = ? AND expires_at > ?",
+            (user_id, time.time())
+        )
+        return (row[0], json.loads(row[1])) if row else None
+
+    def save(self, user_id, state):
+        """Stores the state and returns its new version."""
+        conn = self._conn()
+        now = time.time()
+        try:
+            row = conn.execute(
+                """INSERT INTO session_state (user_id, version, thread_id, payload, expires_at)
+                   VALUES (?, 1, ?, ?, ?)
+                   ON CONFLICT(user_id) DO UPDATE SET
+                       version = version + 1, thread_id = excluded.thread_id,
+                       payload = excluded.payload, expires_at = excluded.expires_at
+                   RETURNING version""",
+                (user_id, state.get("thread_id"), json.dumps(state), now + self.ttl)
+            ).fetchone()
+            if now - self._last_purge > 60:
+                self._last_purge = now
+                conn.execute("DELETE FROM session_state WHERE expires_at <= ?", (now,))
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            raise SessionStateError(f"Failed to save session state: {e}") from e
+        return row[0]
+
+    def delete(self, user_id):
+        self._write("DELETE FROM session_state WHERE user_id = ?", (user_id,))
+
+    def clear(self):
+        self._write("DELETE FROM session_state", ())
+
+    def _write(self, query, params):
+        conn = self._conn()
+        try:
+            conn.execute(query, params)
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            raise SessionStateError(f"Failed to update session state: {e}") from e
+
+
+# --- Redis protocol ---
+
+class RedisClient:
+    """
+    Minimal thread-safe RESP client (one socket, reconnects after errors).
+    Supports exactly what RedisSessionState needs: single commands and pipelines.
+    """
+
+    def __init__(self, url, timeout=2.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._sock = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def execute(self, *args):
+        return self.pipeline([args])[0]
+
+    def pipeline(self, commands):
+        """Sends all commands in one write and returns their replies in order."""
+        with self._lock:
+            try:
+                if self._sock is None:
+                    self._connect()
+                self._sock.sendall(b"".join(self._encode(command) for command in commands))
+                replies = [self._read_reply() for _ in commands]
+            except (OSError, ValueError) as e:
+                self._disconnect()
+                raise SessionStateError(f"Redis connection error: {e}") from e
+            except SessionStateError:  # AUTH/SELECT rejected while connecting
+                self._disconnect()
+                raise
+        for reply in replies:
+            if isinstance(reply, SessionStateError):
+                raise reply
+        return replies
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._reader = self._sock.makefile("rb")
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        for command in setup:
+            self._sock.sendall(self._encode(command))
+            reply = self._read_reply()
+            if isinstance(reply, SessionStateError):
+                raise reply
+
+    def _disconnect(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._reader = None
+
+    @staticmethod
+    def _encode(command):
+        out = [b"*%d\r\n" % len(command)]
+        for arg in command:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode("utf-8")
+            out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(out)
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ValueError("connection closed")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode("utf-8")
+        if kind == b"-":
+            # Returned (not raised) so the rest of a pipeline is still consumed
+            return SessionStateError(body.decode("utf-8"))
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(body)
+            if length < 0:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise ValueError(f"unexpected reply type {kind!r}")
+
+
+class RedisSessionState:
+    """Stores each user's state in one hash: version, thread_id and the JSON payload."""
+
+    name = "redis"
+
+    def __init__(self, url, ttl=86400.0, key_prefix="chat:session:", timeout=2.0):
+        self.client = RedisClient(url, timeout=timeout)
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+
+    def _key(self, user_id):
+        return f"{self.key_prefix}{user_id}"
+
+    def get_meta(self, user_id):
+        version, thread_id = self.client.execute("HMGET", self._key(user_id), "version", "thread_id")
+        if version is None:
+            return None
+        return int(version), int(thread_id) if thread_id else None
+
+    def load(self, user_id):
+        version, payload = self.client.execute("HMGET", self._key(user_id), "version", "payload")
+        if version is None or payload is None:
+            return None
+        return int(version), json.loads(payload)
+
+    def save(self, user_id, state):
+        key = self._key(user_id)
+        thread_id = state.get("thread_id")
+        # MULTI/EXEC so readers never see a new version with the old payload
+        replies = self.client.pipeline([
+            ("MULTI",),
+            ("HINCRBY", key, "version", 1),
+            ("HSET", key, "thread_id", "" if thread_id is None else thread_id, "payload", json.dumps(state)),
+            ("EXPIRE", key, int(self.ttl)),
+            ("EXEC",),
+        ])
+        return int(replies[-1][0])
+
+    def delete(self, user_id):
+        self.client.execute("DEL", self._key(user_id))
+
+    def clear(self):
+        # Only used by tests against a dedicated stand-in server
+        self.client.execute("FLUSHDB")
+
+
+def create_session_state(config):
+    """Returns the configured shared session-state backend, or None for per-process memory."""
+    name = config.SESSION_STATE_BACKEND.lower()
+    if name == "memory":
+        return None
+    if name == "sqlite":
+        return SQLiteSessionState(config.SESSION_STATE_PATH, ttl=config.SESSION_STATE_TTL)
+    if name == "redis":
+        return RedisSessionState(config.SESSION_STATE_REDIS_URL, ttl=config.SESSION_STATE_TTL)
+    raise ValueError(f"Unknown SESSION_STATE_BACKEND '{config.SESSION_STATE_BACKEND}' (expected memory, sqlite or redis)")
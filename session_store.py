@@ -0,0 +1,262 @@
+# session_store.py
+"""
+Bounded in-memory store for per-user chat sessions (active thread, Gemini chat object,
+rendered history page and pagination cursor).
+
+Sessions are held in an LRU cache with an entry limit, an estimated-bytes budget and an
+idle TTL, so memory stays flat no matter how many users have logged in since startup.
+An evicted session is rebuilt from the database on the next access: the store keeps a
+small user -> thread pointer map (ints only) so the rebuild reopens the same thread.
+
+With a shared backend from session_state (SESSION_STATE_BACKEND=sqlite|redis) every put()
+also writes a serializable snapshot of the session, and get() checks the snapshot's
+version, so a request served by another worker picks up the latest thread and Gemini
+context. The local cache then only saves rebuilding the Gemini chat object.
+"""
+
+import threading
+import time
+
+from cache import TTLCache
+from session_state import SessionStateError
+
+# Rough per-object overheads used by the size estimate (dict + str headers, list slots)
+MESSAGE_OVERHEAD = 256
+SESSION_OVERHEAD = 1024
+
+
+class UserSession:
+    """Everything api_connection keeps in memory for one logged-in user."""
+
+    __slots__ = ("thread_id", "chat_session", "history", "history_cursor", "page_stale", "transcript",
+                 "context_bytes", "version")
+
+    def __init__(self, thread_id, chat_session=None, history=None, history_cursor=None, transcript=None,
+                 context_bytes=0, page_stale=False):
+        self.thread_id = thread_id
+        self.chat_session = chat_session
+        self.history = history if history is not None else []
+        self.history_cursor = history_cursor
+        # True once turns pushed older messages out of `history`: history_cursor no longer covers
+        # them, and the page is re-read from the database before it is rendered again
+        self.page_stale = page_stale
+        # [role, text, image_filename] per message the Gemini chat was given; enough to rebuild it
+        self.transcript = transcript if transcript is not None else []
+        # Estimated size of the history held inside chat_session (text + decoded images)
+        self.context_bytes = context_bytes
+        # Version of the shared snapshot this session matches (0 = never shared)
+        self.version = 0
+
+
+def estimate_message_bytes(message):
+    """Estimated memory held by one UI history message (text plus image reference)."""
+    size = MESSAGE_OVERHEAD + len(message.get("content") or "")
+    image = message.get("image")
+    if image:
+        size += MESSAGE_OVERHEAD + sum(len(value or "") for value in image.values())
+    return size
+
+
+def estimate_session_bytes(user_session):
+    return (SESSION_OVERHEAD + user_session.context_bytes
+            + sum(estimate_message_bytes(message) for message in user_session.history)
+            + sum(MESSAGE_OVERHEAD + len(entry[1] or "") for entry in user_session.transcript))
+
+
+def session_to_state(user_session):
+    """
+    Returns a JSON-serializable snapshot of a session. Images are reduced to their filename
+    and MIME type (the uploads folder is shared), so snapshots stay small.
+    """
+    history = []
+    for message in user_session.history:
+        image = message.get("image")
+        if image:
+            message = dict(message, image={"filename": image.get("filename"), "mime_type": image.get("mime_type")})
+        history.append(message)
+    return {
+        "thread_id": user_session.thread_id,
+        "history_cursor": user_session.history_cursor,
+        "page_stale": user_session.page_stale,
+        "history": history,
+        "transcript": user_session.transcript,
+    }
+
+
+class SessionStore:
+    """
+    LRU + idle-TTL store of UserSession objects keyed by user id.
+
+    Args:
+        loader (callable): loader(user_id, thread_id) -> UserSession or None, used to rehydrate
+            an evicted session from the database
+        max_entries (int): maximum number of sessions held in memory
+        max_bytes (int): budget for the summed estimate_session_bytes() of all sessions
+        idle_ttl (float): seconds without access before a session is dropped
+        thread_ttl (float): how long the user -> thread pointer outlives its session
+        shared: optional session_state backend shared by all workers
+        restore (callable): restore(state) -> UserSession, rebuilds a session from a shared snapshot
+    """
+
+    def __init__(self, loader=None, max_entries=1000, max_bytes=256 * 1024 * 1024, idle_ttl=1800.0,
+                 thread_ttl=86400.0, shared=None, restore=None):
+        self.loader = loader
+        self.shared = shared
+        self.restore = restore
+        self._sessions = TTLCache(max_entries=max_entries, ttl=idle_ttl, name="sessions",
+                                  max_bytes=max_bytes, sizeof=estimate_session_bytes, sliding=True)
+        self._threads = TTLCache(max_entries=max_entries * 10, ttl=thread_ttl, name="session_threads")
+        self._purge_interval = min(idle_ttl, 60.0)
+        self._last_purge = time.monotonic()
+        self._lock = threading.Lock()
+        self._counters = {"rehydrations": 0, "shared_reloads": 0, "shared_errors": 0,
+                          "rebuilds": 0, "rebuilds_avoided": 0, "updates_dropped": 0}
+
+    def get(self, user_id):
+        """
+        Returns the live session for `user_id`, or None if it was never created or has been evicted.
+        With a shared backend, a session saved by another worker is restored from its snapshot.
+        """
+        user_session = self._sessions.get(user_id)
+        if self.shared is None:
+            return user_session
+
+        meta = self._shared_call(self.shared.get_meta, user_id, default=False)
+        if meta is False:
+            return user_session  # backend unreachable: serve what this worker has
+        if meta is None:
+            # Logged out or expired elsewhere
+            if user_session is not None:
+                self._sessions.pop(user_id)
+            return None
+        if user_session is not None and user_session.version == meta[0]:
+            return user_session
+
+        loaded = self._shared_call(self.shared.load, user_id)
+        if loaded is None or self.restore is None:
+            return user_session
+        version, state = loaded
+        user_session = self.restore(state)
+        user_session.version = version
+        self._bump("shared_reloads")
+        self._threads.set(user_id, user_session.thread_id)
+        self._sessions.set(user_id, user_session)
+        return user_session
+
+    def get_or_load(self, user_id):
+        """Returns the session for `user_id`, rebuilding it through the loader after an eviction."""
+        user_session = self.get(user_id)
+        if user_session is not None or self.loader is None:
+            return user_session
+        thread_id = self._threads.get(user_id)
+        if thread_id is None:
+            return None
+        user_session = self.loader(user_id, thread_id)
+        if user_session is not None:
+            self._bump("rehydrations")
+            self.put(user_id, user_session)
+        return user_session
+
+    def activate(self, user_id, thread_id, build):
+        """
+        Makes `thread_id` the user's active thread. The live session is reused when it is already
+        on that thread (a page refresh); otherwise `build(user_id, thread_id)` creates a new one.
+
+        Returns:
+            UserSession: the active session
+        """
+        user_session = self.get(user_id)
+        if user_session is not None and user_session.thread_id == thread_id and user_session.chat_session is not None:
+            self._bump("rebuilds_avoided")
+            return user_session
+        user_session = build(user_id, thread_id)
+        self._bump("rebuilds")
+        self.put(user_id, user_session)
+        return user_session
+
+    def put(self, user_id, user_session):
+        """
+        Stores (or re-stores) a session. Call again after mutating a session in place so its
+        size estimate, LRU position and shared snapshot are refreshed.
+        """
+        if self.shared is not None:
+            version = self._shared_call(self.shared.save, user_id, session_to_state(user_session))
+            if version is not None:
+                user_session.version = version
+        self._threads.set(user_id, user_session.thread_id)
+        self._sessions.set(user_id, user_session)
+        self._maybe_purge()
+
+    def update(self, user_id, user_session):
+        """
+        put() for a session changed in place by a turn that may have outlived it: a session
+        removed meanwhile (logout, deleted thread) stays removed, here and in the shared store.
+
+        Returns:
+            bool: False if the update was dropped
+        """
+        if self.last_thread(user_id) != user_session.thread_id:
+            self._bump("updates_dropped")
+            return False
+        self.put(user_id, user_session)
+        return True
+
+    def last_thread(self, user_id):
+        """Returns the user's active thread id, even if the session itself has been evicted."""
+        if self.shared is not None:
+            meta = self._shared_call(self.shared.get_meta, user_id, default=False)
+            if meta is not False:
+                return meta[1] if meta else None
+        return self._threads.get(user_id)
+
+    def remove(self, user_id):
+        """Drops the session and the thread pointer (logout, or the active thread was deleted)."""
+        if self.shared is not None:
+            self._shared_call(self.shared.delete, user_id)
+        self._sessions.pop(user_id)
+        self._threads.pop(user_id)
+
+    def clear(self):
+        self._sessions.clear()
+        self._threads.clear()
+
+    def stats(self):
+        """Returns memory gauges (entries, estimated bytes) and eviction/hit counters."""
+        cache_stats = self._sessions.stats()
+        with self._lock:
+            counters = dict(self._counters)
+        stats = {
+            "entries": cache_stats["entries"],
+            "estimated_bytes": cache_stats["bytes"],
+            "max_entries": self._sessions.max_entries,
+            "max_bytes": self._sessions.max_bytes,
+            "evictions": cache_stats["evictions"],
+            "expirations": cache_stats["expirations"],
+            "hits": cache_stats["hits"],
+            "misses": cache_stats["misses"],
+            "shared_backend": self.shared.name if self.shared is not None else "memory",
+        }
+        stats.update(counters)
+        return stats
+
+    def _shared_call(self, method, *args, default=None):
+        try:
+            return method(*args)
+        except SessionStateError as e:
+            self._bump("shared_errors")
+            print(f"Warning: shared session state unavailable ({e}); using this worker's copy.")
+            return default
+
+    def _bump(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _maybe_purge(self):
+        # Idle sessions are normally dropped lazily on lookup; sweep now and then so users who
+        # never come back don't hold memory until LRU pressure pushes them out
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_purge < self._purge_interval:
+                return
+            self._last_purge = now
+        self._sessions.purge_expired()
@@ -195,8 +195,8 @@ document.addEventListener('DOMContentLoaded', function () {
         container.innerHTML = html;
     }
 
-    // Function to dynamically append a new message to the chat history
-    function appendMessage(role, content, imageUrl) {
+    // Builds the DOM element for one chat message (used for new and paginated history messages)
+    function buildMessageElement(role, content, imageUrl, thumbUrl) {
         // --- START: Avatar and Message Structure Setup ---
         const roleClass = role === 'user' ? 'user' : 'ai';
         // AI Avatar set to the robot emoji 🤖
@@ -213,7 +213,7 @@ document.addEventListener('DOMContentLoaded', function () {
                     <div class="message-bubble">
                         ${imageUrl ? `
                             <div class="image-bubble-wrapper">
-                                <img src="${imageUrl}" class="uploaded-img-preview-bubble" alt="User uploaded image" data-full-src="${imageUrl}">
+                                <img src="${thumbUrl || imageUrl}" class="uploaded-img-preview-bubble" alt="User uploaded image" data-full-src="${imageUrl}">
                             </div>` : ''}
                         <div class="text-content">
                             ${content ? marked.parse(content) : ''}
@@ -232,7 +232,7 @@ document.addEventListener('DOMContentLoaded', function () {
                 <div class="message-content-wrapper">
                     ${imageUrl ? `
                         <div class="image-bubble-wrapper">
-                            <img src="${imageUrl}" class="uploaded-img-preview-bubble" alt="User uploaded image" data-full-src="${imageUrl}">
+                            <img src="${thumbUrl || imageUrl}" class="uploaded-img-preview-bubble" alt="User uploaded image" data-full-src="${imageUrl}">
                         </div>` : ''}
                     <div class="diagnosis-card">
                         <div class="text-content">
@@ -255,6 +255,26 @@ document.addEventListener('DOMContentLoaded', function () {
 
         // --- END: Avatar and Message Structure Setup ---
 
+        // Apply listeners to the newly built elements
+        if (role === 'ai') {
+            const copyButton = messageElement.querySelector('.copy-message-btn');
+            if (copyButton) {
+                copyButton.addEventListener('click', handleCopyButtonClick);
+            }
+        }
+
+        const imageElement = messageElement.querySelector('.uploaded-img-preview-bubble');
+        if (imageElement) {
+            setupImageEnlargement(imageElement);
+        }
+
+        return messageElement;
+    }
+
+    // Function to dynamically append a new message to the chat history
+    function appendMessage(role, content, imageUrl) {
+        const messageElement = buildMessageElement(role, content, imageUrl);
+
         // 🚨 CRITICAL FIX: Insert message *before* the typing indicator
         // If the typing indicator is visible, insert the new message before it.
         if (typingIndicator && typingIndicator.style.display !== 'none') {
@@ -268,19 +288,6 @@ document.addEventListener('DOMContentLoaded', function () {
             chatHistory.appendChild(messageElement);
         }
 
-        // Apply listeners to the newly added elements
-        if (role === 'ai') {
-            const copyButton = messageElement.querySelector('.copy-message-btn');
-            if (copyButton) {
-                copyButton.addEventListener('click', handleCopyButtonClick);
-            }
-        }
-
-        const imageElement = messageElement.querySelector('.uploaded-img-preview-bubble');
-        if (imageElement) {
-            setupImageEnlargement(imageElement);
-        }
-
         scrollToBottom();
     }
 
@@ -355,6 +362,10 @@ document.addEventListener('DOMContentLoaded', function () {
                         appendMessage('ai', "I received an empty response. Please try again.", null);
                     }
 
+                } else if (response.status === 409) {
+                    // A previous message from this user is still being answered
+                    const data = await response.json();
+                    appendMessage('ai', data.content, null);
                 } else {
                     // HTTP error (e.g., 404, 500)
                     let errorMessage = `Server responded with status ${response.status} (${response.statusText}).`;
@@ -412,7 +423,7 @@ document.addEventListener('DOMContentLoaded', function () {
     }
 
     // --- Thread Delete Buttons ---
-    document.querySelectorAll('.thread-delete-btn').forEach(btn => {
+    function setupThreadDelete(btn) {
         btn.addEventListener('click', async (event) => {
             event.preventDefault();
             event.stopPropagation();
@@ -439,7 +450,105 @@ document.addEventListener('DOMContentLoaded', function () {
                 alert('Server error deleting thread.');
             }
         });
-    });
+    }
+    document.querySelectorAll('.thread-delete-btn').forEach(setupThreadDelete);
+
+    // --- Infinite Scroll: older messages (keyset pagination) ---
+    const activeThreadId = chatHistory ? chatHistory.getAttribute('data-thread-id') : '';
+    let historyCursor = chatHistory ? chatHistory.getAttribute('data-history-cursor') : '';
+    let loadingHistory = false;
+
+    function imageUrlFromMessage(message) {
+        if (!message.image) return null;
+        return message.image.url;
+    }
+
+    function thumbUrlFromMessage(message) {
+        if (!message.image) return null;
+        return message.image.thumb_url || null;
+    }
+
+    async function loadOlderMessages() {
+        if (!historyCursor || !activeThreadId || loadingHistory) return;
+        loadingHistory = true;
+        try {
+            const params = new URLSearchParams({ before: historyCursor });
+            const response = await fetch(`/threads/${activeThreadId}/messages?${params}`);
+            if (!response.ok) return;
+            const data = await response.json();
+
+            // Prepend while keeping the currently visible message in place
+            const previousHeight = chatHistory.scrollHeight;
+            const fragment = document.createDocumentFragment();
+            data.messages.forEach(message => {
+                const role = message.role === 'user' ? 'user' : 'ai';
+                fragment.appendChild(buildMessageElement(role, message.content || '',
+                    imageUrlFromMessage(message), thumbUrlFromMessage(message)));
+            });
+            chatHistory.insertBefore(fragment, chatHistory.firstChild);
+            chatHistory.scrollTop += chatHistory.scrollHeight - previousHeight;
+
+            historyCursor = data.next_cursor || '';
+        } catch (err) {
+            console.error('Load history error:', err);
+        } finally {
+            loadingHistory = false;
+        }
+    }
+
+    if (chatHistory) {
+        chatHistory.addEventListener('scroll', () => {
+            if (chatHistory.scrollTop < 80) loadOlderMessages();
+        });
+    }
+
+    // --- Infinite Scroll: more threads in the sidebar ---
+    const threadList = document.getElementById('threadList');
+    let threadsCursor = threadList ? threadList.getAttribute('data-next-cursor') : '';
+    let loadingThreads = false;
+
+    function buildThreadRow(thread) {
+        const row = document.createElement('div');
+        row.className = 'thread-item-row';
+        row.innerHTML = `
+            <a class="thread-item-link">
+                <div class="thread-title"></div>
+                <div class="thread-date"></div>
+            </a>
+            <button class="icon-btn thread-delete-btn" title="Delete thread">
+                <svg xmlns="http://www.w3.org/2000/svg" width="14" height="14" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2" stroke-linecap="round" stroke-linejoin="round"><polyline points="3 6 5 6 21 6"></polyline><path d="M19 6l-1 14a2 2 0 0 1-2 2H8a2 2 0 0 1-2-2L5 6m5 0V4a2 2 0 0 1 2-2h0a2 2 0 0 1 2 2v2"></path><line x1="10" y1="11" x2="10" y2="17"></line><line x1="14" y1="11" x2="14" y2="17"></line></svg>
+            </button>`;
+        row.querySelector('.thread-item-link').href = `/main_activity?thread_id=${thread.id}`;
+        row.querySelector('.thread-title').textContent = thread.title;
+        row.querySelector('.thread-date').textContent = thread.date_label;
+        const deleteBtn = row.querySelector('.thread-delete-btn');
+        deleteBtn.setAttribute('data-thread-id', thread.id);
+        setupThreadDelete(deleteBtn);
+        return row;
+    }
+
+    async function loadMoreThreads() {
+        if (!threadsCursor || loadingThreads) return;
+        loadingThreads = true;
+        try {
+            const params = new URLSearchParams({ before: threadsCursor });
+            const response = await fetch(`/threads?${params}`);
+            if (!response.ok) return;
+            const data = await response.json();
+            data.threads.forEach(thread => threadList.appendChild(buildThreadRow(thread)));
+            threadsCursor = data.next_cursor || '';
+        } catch (err) {
+            console.error('Load threads error:', err);
+        } finally {
+            loadingThreads = false;
+        }
+    }
+
+    if (threadList) {
+        threadList.addEventListener('scroll', () => {
+            if (threadList.scrollTop + threadList.clientHeight >= threadList.scrollHeight - 80) loadMoreThreads();
+        });
+    }
 
     // Event listener for textarea resizing
     if (queryInput) {
@@ -0,0 +1,392 @@
+# storage_backends.py
+"""
+Storage engines behind db_manager.get_db_connection().
+
+Both engines hand out DB-API connections that accept the `%s`-style SQL and
+`cursor(dictionary=True)` calls used throughout user_db_operations, so the query code
+is shared. Only connection setup, DDL and a few schema helpers differ per engine.
+
+- MySQLBackend: mysql.connector against a MySQL server (the default).
+- SQLiteBackend: a local database file tuned for single-node throughput (WAL journal,
+  relaxed fsync, memory-mapped I/O and a per-connection prepared-statement cache).
+  Useful for small deployments and for running the app and load tests without a server.
+"""
+
+import sqlite3
+from collections import OrderedDict
+from datetime import datetime
+
+try:
+    import mysql.connector
+except ImportError:  # Only needed when DB_BACKEND=mysql
+    mysql = None
+
+
+# --- MySQL ---
+
+class MySQLBackend:
+    name = "mysql"
+
+    def __init__(self, config):
+        if mysql is None:
+            raise RuntimeError("DB_BACKEND=mysql requires mysql-connector-python (pip install mysql-connector-python)")
+        self.config = config
+
+    def connect(self):
+        return mysql.connector.connect(
+            host=self.config.MYSQL_HOST,
+            user=self.config.MYSQL_USER,
+            password=self.config.MYSQL_PASSWORD,
+            database=self.config.MYSQL_DB
+        )
+
+    def connection_help(self):
+        return [
+            "1. Is your MySQL server running?",
+            "2. Are the credentials in config.py correct?",
+        ]
+
+    def create_tables(self, cursor):
+        # 1. Users Table
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                username VARCHAR(100) NOT NULL,
+                email VARCHAR(100) NOT NULL UNIQUE,
+                password_hash VARCHAR(255) NOT NULL
+            )
+        """)
+
+        # 2. Chat_Threads Table
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS chat_threads (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                user_id INT NOT NULL,
+                title VARCHAR(255) NOT NULL DEFAULT 'New Chat',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        """)
+
+        # 3. Posts Table (MUST contain thread_id)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS posts (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                user_id INT NOT NULL,
+                thread_id INT NOT NULL,
+                role VARCHAR(50) NOT NULL,
+                text_content TEXT,
+                image_filename VARCHAR(255),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+                FOREIGN KEY (thread_id) REFERENCES chat_threads(id) ON DELETE CASCADE
+            )
+        """)
+
+        # 4. Structured Responses Table for symptom-based diagnoses
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS structured_responses (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                user_id INT NOT NULL,
+                thread_id INT NOT NULL,
+                query TEXT NOT NULL,
+                disease VARCHAR(255),
+                probability VARCHAR(50),
+                severity VARCHAR(50),
+                medication TEXT,
+                other_diagnoses TEXT,
+                conclusion TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+                FOREIGN KEY (thread_id) REFERENCES chat_threads(id) ON DELETE CASCADE
+            )
+        """)
+
+    def create_version_table(self, cursor):
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INT PRIMARY KEY,
+                description VARCHAR(255) NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+    def create_summary_table(self, cursor):
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS thread_summaries (
+                thread_id INT PRIMARY KEY,
+                user_id INT NOT NULL,
+                summary MEDIUMTEXT NOT NULL,
+                covered_count INT NOT NULL DEFAULT 0,
+                last_post_id INT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                FOREIGN KEY (thread_id) REFERENCES chat_threads(id) ON DELETE CASCADE
+            )
+        """)
+
+    def index_exists(self, cursor, table, index_name):
+        cursor.execute(
+            """
+            SELECT 1 FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+            LIMIT 1
+            """,
+            (table, index_name)
+        )
+        return cursor.fetchone() is not None
+
+    def add_index(self, cursor, table, index_name, columns):
+        # Online DDL: reads and writes continue while the index is built
+        cursor.execute(f"ALTER TABLE {table} ADD INDEX {index_name} ({columns}), ALGORITHM=INPLACE, LOCK=NONE")
+
+    def lock_migrations(self, cursor, lock_name):
+        # Serialize migrations across processes/workers starting at the same time
+        cursor.execute("SELECT GET_LOCK(%s, 60)", (lock_name,))
+        return cursor.fetchone()[0] == 1
+
+    def unlock_migrations(self, cursor, lock_name):
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (lock_name,))
+        cursor.fetchone()
+
+
+# --- SQLite ---
+
+SQLITE_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _adapt_datetime(value):
+    return value.strftime(SQLITE_TIME_FORMAT)
+
+def _convert_timestamp(raw):
+    text = raw.decode()
+    try:
+        # fromisoformat is C-implemented and much cheaper per row than strptime
+        return datetime.fromisoformat(text)
+    except ValueError:
+        return text
+
+# Store datetimes in the same text form as datetime('now'), so keyset comparisons work
+sqlite3.register_adapter(datetime, _adapt_datetime)
+sqlite3.register_converter("TIMESTAMP", _convert_timestamp)
+
+
+def _dict_row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+class SQLiteCursor:
+    """Cursor that accepts mysql.connector-style `%s` SQL and optional dictionary rows."""
+
+    def __init__(self, conn, dictionary=False):
+        self._conn = conn
+        self._cursor = conn.raw.cursor()
+        if dictionary:
+            self._cursor.row_factory = _dict_row
+
+    def execute(self, query, params=None):
+        self._cursor.execute(self._conn.translate(query), tuple(params or ()))
+        return self
+
+    def executemany(self, query, seq_of_params):
+        self._cursor.executemany(self._conn.translate(query), seq_of_params)
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    """
+    sqlite3 connection with a mysql.connector-compatible surface.
+
+    sqlite3 keeps prepared statements in an LRU keyed by SQL text (`cached_statements`);
+    the placeholder translation in front of it is memoized as well, so a repeated query
+    costs neither a re-translation nor a re-prepare.
+    """
+
+    def __init__(self, raw, translation_cache_size=256):
+        self.raw = raw
+        self._translations = OrderedDict()
+        self._translation_cache_size = translation_cache_size
+
+    def translate(self, query):
+        translated = self._translations.get(query)
+        if translated is None:
+            translated = query.replace("%s", "?")
+            self._translations[query] = translated
+            if len(self._translations) > self._translation_cache_size:
+                self._translations.popitem(last=False)
+        else:
+            self._translations.move_to_end(query)
+        return translated
+
+    def cursor(self, dictionary=False):
+        return SQLiteCursor(self, dictionary=dictionary)
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    @property
+    def in_transaction(self):
+        return self.raw.in_transaction
+
+    def ping(self, reconnect=False):
+        self.raw.execute("SELECT 1").fetchone()
+
+    def close(self):
+        self.raw.close()
+
+
+class SQLiteBackend:
+    name = "sqlite"
+
+    def __init__(self, config):
+        self.config = config
+
+    def connect(self):
+        raw = sqlite3.connect(
+            self.config.SQLITE_PATH,
+            timeout=self.config.SQLITE_BUSY_TIMEOUT,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            cached_statements=self.config.SQLITE_STATEMENT_CACHE,
+            # Pooled connections move between threads, but only one thread holds one at a time
+            check_same_thread=False,
+        )
+        raw.execute("PRAGMA journal_mode=WAL")
+        raw.execute(f"PRAGMA synchronous={self.config.SQLITE_SYNCHRONOUS}")
+        raw.execute(f"PRAGMA mmap_size={int(self.config.SQLITE_MMAP_SIZE)}")
+        raw.execute(f"PRAGMA cache_size=-{int(self.config.SQLITE_CACHE_KB)}")
+        raw.execute("PRAGMA temp_store=MEMORY")
+        raw.execute("PRAGMA foreign_keys=ON")
+        return SQLiteConnection(raw, translation_cache_size=self.config.SQLITE_STATEMENT_CACHE)
+
+    def connection_help(self):
+        return [
+            f"1. Is SQLITE_PATH ({self.config.SQLITE_PATH}) in a writable directory?",
+            "2. Is another process holding a long write lock on the database?",
+        ]
+
+    def create_tables(self, cursor):
+        # Timestamps default to local time, matching what MySQL's CURRENT_TIMESTAMP shows users
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT NOT NULL,
+                email TEXT NOT NULL UNIQUE,
+                password_hash TEXT NOT NULL
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS chat_threads (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                title TEXT NOT NULL DEFAULT 'New Chat',
+                created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS posts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                thread_id INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                text_content TEXT,
+                image_filename TEXT,
+                created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+                FOREIGN KEY (thread_id) REFERENCES chat_threads(id) ON DELETE CASCADE
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS structured_responses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                thread_id INTEGER NOT NULL,
+                query TEXT NOT NULL,
+                disease TEXT,
+                probability TEXT,
+                severity TEXT,
+                medication TEXT,
+                other_diagnoses TEXT,
+                conclusion TEXT,
+                created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+                FOREIGN KEY (thread_id) REFERENCES chat_threads(id) ON DELETE CASCADE
+            )
+        """)
+
+    def create_version_table(self, cursor):
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+            )
+        """)
+
+    def create_summary_table(self, cursor):
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS thread_summaries (
+                thread_id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                summary TEXT NOT NULL,
+                covered_count INTEGER NOT NULL DEFAULT 0,
+                last_post_id INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+                FOREIGN KEY (thread_id) REFERENCES chat_threads(id) ON DELETE CASCADE
+            )
+        """)
+
+    def index_exists(self, cursor, table, index_name):
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND name = %s",
+                       (table, index_name))
+        return cursor.fetchone() is not None
+
+    def add_index(self, cursor, table, index_name, columns):
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({columns})")
+
+    def lock_migrations(self, cursor, lock_name):
+        # A single file has a single writer; migrations are idempotent DDL
+        return True
+
+    def unlock_migrations(self, cursor, lock_name):
+        pass
+
+
+BACKENDS = {
+    "mysql": MySQLBackend,
+    "sqlite": SQLiteBackend,
+}
+
+# Error classes that user_db_operations catches, whichever engines are importable
+DB_ERRORS = (sqlite3.Error,) + ((mysql.connector.Error,) if mysql is not None else ())
+
+
+def create_backend(config):
+    """Instantiates the engine named by config.DB_BACKEND."""
+    name = config.DB_BACKEND.lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown DB_BACKEND '{config.DB_BACKEND}' (expected one of: {', '.join(BACKENDS)})")
+    return BACKENDS[name](config)
@@ -0,0 +1,100 @@
+# test_cache.py
+"""
+Tests for the TTL/LRU read-through cache and the thread cache invalidation in user_db_operations.
+"""
+
+import time
+
+import user_db_operations
+from cache import TTLCache
+
+
+def test_read_through_hits_and_misses():
+    cache = TTLCache(max_entries=10, ttl=60)
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return {"id": 1}
+
+    assert cache.get_or_load("k", loader) == {"id": 1}
+    assert cache.get_or_load("k", loader) == {"id": 1}
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1 and stats["hit_ratio"] == 0.5
+
+
+def test_none_is_not_cached():
+    cache = TTLCache()
+    assert cache.get_or_load("missing", lambda: None) is None
+    assert len(cache) == 0
+
+
+def test_load_overlapping_an_invalidation_is_not_cached():
+    cache = TTLCache()
+
+    def load_then_write():
+        # The write (and its invalidation) lands after the read but before the result is stored
+        cache.invalidate("threads")
+        return ["before the write"]
+
+    assert cache.get_or_load("threads", load_then_write) == ["before the write"]
+    assert cache.get("threads") is None
+    assert cache.get_or_load("threads", lambda: ["after the write"]) == ["after the write"]
+
+    cache.get_or_load(("user", 5), lambda: cache.invalidate_where(lambda key: key[0] == "user") or ["stale"])
+    assert len(cache) == 1 and cache.stats()["stale_loads"] == 2
+
+
+def test_lru_eviction_and_ttl_expiry():
+    cache = TTLCache(max_entries=2, ttl=0.05)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")          # "b" is now least recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1
+    assert cache.stats()["evictions"] == 1
+
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] >= 1
+
+
+def test_thread_writes_invalidate_cached_lists(monkeypatch):
+    user_db_operations.thread_list_cache.clear()
+    user_db_operations.thread_cache.clear()
+    loads = []
+
+    def fake_load(user_id, before, limit):
+        loads.append(user_id)
+        return [{"id": 10, "title": "Cough", "created_at": None}]
+
+    monkeypatch.setattr(user_db_operations, "_load_user_threads", fake_load)
+    monkeypatch.setattr(user_db_operations, "_load_thread_by_id",
+                        lambda user_id, thread_id: {"id": thread_id, "title": "Cough", "created_at": None})
+
+    user_db_operations.get_user_threads(5, limit=30)
+    user_db_operations.get_user_threads(5, limit=30)
+    user_db_operations.get_user_threads(6, limit=30)
+    assert loads == [5, 6]
+    assert user_db_operations.get_thread_by_id(5, 10)["id"] == 10
+
+    # e.g. after update_thread_title / delete_thread for user 5
+    user_db_operations._invalidate_threads(5, 10)
+    assert len(user_db_operations.thread_cache) == 0
+    user_db_operations.get_user_threads(5, limit=30)
+    user_db_operations.get_user_threads(6, limit=30)
+    assert loads == [5, 6, 5]
+
+
+def test_connection_outage_is_not_cached_as_an_empty_sidebar(sqlite_db, monkeypatch):
+    assert user_db_operations.register_user("patient", "outage@example.com", "hash")
+    user_id = user_db_operations.get_user_by_email("outage@example.com")["id"]
+    thread_id = user_db_operations.create_new_chat_thread(user_id)
+    real_connection = user_db_operations.get_db_connection
+
+    monkeypatch.setattr(user_db_operations, "get_db_connection", lambda: None)  # e.g. pool exhausted
+    assert user_db_operations.get_user_threads(user_id, limit=30) == []
+    monkeypatch.setattr(user_db_operations, "get_db_connection", real_connection)
+
+    assert [thread["id"] for thread in user_db_operations.get_user_threads(user_id, limit=30)] == [thread_id]
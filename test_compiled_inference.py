@@ -0,0 +1,55 @@
+# test_compiled_inference.py
+"""
+Tests for image_analyzer.inference_fn: the traced fixed-signature forward pass matches
+model.predict, is built once per model, and falls back to predict where it can't apply.
+"""
+
+import numpy as np
+import tensorflow as tf
+
+import image_analyzer
+from config import Config
+
+
+def _model(input_shape=(16, 16, 3)):
+    tf.keras.utils.set_random_seed(0)
+    return tf.keras.Sequential([
+        tf.keras.Input(input_shape),
+        tf.keras.layers.Conv2D(4, 3, activation="relu"),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(3, activation="softmax"),
+    ])
+
+
+def test_traced_forward_pass_matches_predict_for_any_batch_size(monkeypatch):
+    monkeypatch.setattr(Config, "INFERENCE_COMPILED", True)
+    model = _model()
+    fn = image_analyzer.inference_fn(model)
+    rng = np.random.default_rng(0)
+
+    for size in (1, 4):
+        batch = rng.random((size, 16, 16, 3), dtype=np.float32)
+        result = fn(batch)
+        assert isinstance(result, np.ndarray) and result.shape == (size, 3)
+        np.testing.assert_allclose(result, model.predict(batch, verbose=0), rtol=1e-5, atol=1e-6)
+
+    assert image_analyzer.inference_fn(model) is fn
+
+
+def test_predict_is_used_when_disabled_or_shape_is_not_static(monkeypatch):
+    calls = []
+
+    class Recording(tf.keras.Sequential):
+        def predict(self, batch, verbose=0):
+            calls.append(len(batch))
+            return super().predict(batch, verbose=verbose)
+
+    monkeypatch.setattr(Config, "INFERENCE_COMPILED", True)
+    dynamic = Recording([tf.keras.Input((None, None, 3)), tf.keras.layers.GlobalAveragePooling2D()])
+    image_analyzer.inference_fn(dynamic)(np.zeros((1, 8, 8, 3), np.float32))
+    assert calls == [1]
+
+    monkeypatch.setattr(Config, "INFERENCE_COMPILED", False)
+    static = Recording([tf.keras.Input((8, 8, 3)), tf.keras.layers.GlobalAveragePooling2D()])
+    image_analyzer.inference_fn(static)(np.zeros((2, 8, 8, 3), np.float32))
+    assert calls == [1, 2]
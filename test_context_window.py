@@ -0,0 +1,115 @@
+# test_context_window.py
+"""
+Tests for the token-budgeted context window: budget splitting, live-session compaction,
+background summarization into thread_summaries, and bounded rehydration of long threads.
+"""
+
+import pytest
+
+import api_connection
+import user_db_operations as ops
+from config import Config
+from context_window import (
+    SUMMARY_ROLE, ContextSummarizer, build_transcript, compact_transcript, split_context
+)
+
+
+def _turns(count):
+    entries = []
+    for i in range(count):
+        entries.append(["user", f"question {i}", None])
+        entries.append(["assistant", f"answer {i} " + "x" * 400, None])
+    return entries
+
+
+def test_split_context_respects_message_and_token_budgets():
+    entries = _turns(10)
+    older, recent = split_context(entries, max_messages=6, max_tokens=10000)
+    assert len(recent) == 6 and older + recent == entries
+    assert recent[0][0] == "user"
+
+    older, recent = split_context(entries, max_messages=100, max_tokens=300)
+    assert 0 < len(recent) < 6 and recent[0][0] == "user" and recent[-1] == entries[-1]
+
+
+def test_compact_transcript_folds_older_turns_into_summary():
+    transcript = [[SUMMARY_ROLE, "- Patient: earlier cough", None]] + _turns(30)
+    compacted = compact_transcript(transcript, max_messages=10, max_tokens=100000)
+    assert compacted[0][0] == SUMMARY_ROLE
+    assert compacted[0][1].startswith("- Patient: earlier cough")
+    assert "question 24" in compacted[0][1]  # newest folded turn; the middle may be elided
+    assert compacted[1:] == transcript[-10:]
+    # Within budget (allowing for growth): nothing to do
+    assert compact_transcript(_turns(5), max_messages=10, max_tokens=100000) is None
+
+
+def _long_thread(messages):
+    assert ops.register_user("patient", "long@example.com", "hash")
+    user_id = ops.get_user_by_email("long@example.com")["id"]
+    thread_id = ops.create_new_chat_thread(user_id)
+    turns = [ops.build_turn(user_id, thread_id, f"question {i}", assistant_text=f"answer {i}")
+             for i in range(messages // 2)]
+    assert ops.persist_turns(turns)
+    return user_id, thread_id
+
+
+def _concatenating_summarizer(calls):
+    def summarize(summary, entries, max_chars):
+        calls.append(len(entries))
+        return ((summary + "\n") if summary else "") + " | ".join(text for _, text, _ in entries)[:200]
+    return summarize
+
+
+def test_summarizer_folds_all_but_recent_messages(sqlite_db):
+    user_id, thread_id = _long_thread(500)
+    calls = []
+    summarizer = ContextSummarizer(_concatenating_summarizer(calls), keep_messages=20, chunk_size=200)
+
+    assert summarizer.fold_thread(user_id, thread_id) == 480
+    assert calls == [200, 200, 80]
+    row = ops.get_thread_summary(user_id, thread_id)
+    recent = ops.get_history_by_user_id(user_id, thread_id, limit=20)
+    assert row["covered_count"] == 480 and row["last_post_id"] < recent[0].id
+    # Nothing left to fold until the thread grows
+    assert summarizer.fold_thread(user_id, thread_id) == 0
+
+    assert ops.persist_turn(user_id, thread_id, "new question", assistant_text="new answer")
+    assert summarizer.fold_thread(user_id, thread_id) == 2
+    assert ops.get_thread_summary(user_id, thread_id)["covered_count"] == 482
+
+
+def test_background_requests_are_deduplicated(sqlite_db):
+    user_id, thread_id = _long_thread(60)
+    summarizer = ContextSummarizer(_concatenating_summarizer([]), keep_messages=20)
+    summarizer.request(user_id, thread_id)
+    summarizer.request(user_id, thread_id)
+    summarizer.start()
+    assert summarizer.flush(timeout=5)
+    stats = summarizer.stats()
+    assert stats["deduplicated"] == 1 and stats["messages_folded"] == 40
+    assert ops.get_thread_summary(user_id, thread_id)["covered_count"] == 40
+
+
+def test_long_thread_rehydrates_with_bounded_context(sqlite_db, monkeypatch):
+    user_id, thread_id = _long_thread(500)
+    ContextSummarizer(_concatenating_summarizer([]), keep_messages=Config.CONTEXT_MAX_MESSAGES).fold_thread(
+        user_id, thread_id)
+
+    primed = []
+    monkeypatch.setattr(api_connection, "create_chat_session", lambda history=None: primed.append(history) or object())
+    user_session = api_connection._build_session(user_id, thread_id)
+
+    history = primed[-1]
+    assert "Summary of our earlier conversation" in history[0]["parts"][0]
+    assert len(history) <= 2 + Config.CONTEXT_MAX_MESSAGES
+    assert history[-1]["parts"] == ["answer 249"]
+    assert user_session.transcript[0][0] == SUMMARY_ROLE
+    assert len(user_session.history) == Config.HISTORY_PAGE_SIZE and user_session.history_cursor
+
+
+def test_build_transcript_skips_already_summarized_posts():
+    records = [ops.HistoryRecord(i, 1, "user" if i % 2 else "assistant", f"m{i}", None, None) for i in range(1, 11)]
+    transcript = build_transcript({"summary": "notes", "covered_count": 6, "last_post_id": 6}, records,
+                                  max_messages=20, max_tokens=10000)
+    assert transcript[0] == [SUMMARY_ROLE, "notes", None]
+    assert [text for _, text, _ in transcript[1:]] == ["m7", "m8", "m9", "m10"]
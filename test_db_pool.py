@@ -0,0 +1,115 @@
+# test_db_pool.py
+"""
+Tests for the pooled connection layer in db_manager (no MySQL server required).
+"""
+
+import threading
+import time
+
+from db_manager import ConnectionPool, PoolExhaustedError
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.alive = True
+        self.in_transaction = False
+        self.rollbacks = 0
+
+    def ping(self, reconnect=False):
+        if not self.alive:
+            raise ConnectionError("gone away")
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = True
+
+
+def make_pool(**kwargs):
+    created = []
+
+    def connect():
+        conn = FakeConnection()
+        created.append(conn)
+        return conn
+
+    return ConnectionPool(connect, **kwargs), created
+
+
+def test_connections_are_reused():
+    pool, created = make_pool(size=2)
+    for _ in range(5):
+        conn = pool.acquire()
+        conn.close()
+    assert len(created) == 1
+    stats = pool.stats()
+    assert stats["checkouts"] == 5
+    assert stats["created"] == 1
+    assert stats["idle"] == 1 and stats["in_use"] == 0
+
+
+def test_exhaustion_fails_fast():
+    pool, _ = make_pool(size=1, timeout=0.05)
+    held = pool.acquire()
+    started = time.monotonic()
+    try:
+        pool.acquire()
+        assert False, "expected PoolExhaustedError"
+    except PoolExhaustedError:
+        pass
+    assert time.monotonic() - started < 1.0
+    stats = pool.stats()
+    assert stats["waits"] == 1 and stats["exhausted"] == 1
+    held.close()
+
+
+def test_waiter_gets_released_connection():
+    pool, created = make_pool(size=1, timeout=2.0)
+    held = pool.acquire()
+    threading.Timer(0.05, held.close).start()
+    conn = pool.acquire()
+    assert conn._conn is created[0]
+    assert pool.stats()["waits"] == 1
+    conn.close()
+
+
+def test_dead_and_expired_connections_are_replaced():
+    pool, created = make_pool(size=1, ping_after=0, recycle=3600)
+    conn = pool.acquire()
+    conn.close()
+    created[0].alive = False
+    time.sleep(0.01)
+    conn = pool.acquire()
+    assert conn._conn is created[1] and created[0].closed
+    conn.close()
+
+    pool.recycle = 0
+    time.sleep(0.01)
+    conn = pool.acquire()
+    assert conn._conn is created[2]
+    conn.close()
+    stats = pool.stats()
+    assert stats["invalidated"] == 1 and stats["recycled"] == 1
+    assert stats["open"] == 1
+
+
+def test_uncommitted_work_is_rolled_back_on_release():
+    pool, created = make_pool(size=1)
+    conn = pool.acquire()
+    created[0].in_transaction = True
+    conn.close()
+    assert created[0].rollbacks == 1
+    conn.close()  # double close is harmless
+    assert pool.stats()["idle"] == 1
+
+
+if __name__ == "__main__":
+    test_connections_are_reused()
+    test_exhaustion_fails_fast()
+    test_waiter_gets_released_connection()
+    test_dead_and_expired_connections_are_replaced()
+    test_uncommitted_work_is_rolled_back_on_release()
+    print("All connection pool tests: PASSED")
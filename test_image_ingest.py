@@ -0,0 +1,153 @@
+# test_image_ingest.py
+"""
+Tests for the upload-time derivative pipeline: one decode produces the chat thumbnail,
+the Gemini part and the model inputs, and later readers never decode the original again.
+"""
+
+import io
+import os
+import threading
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import image_analyzer
+from image_ingest import (
+    MODEL_SUFFIX, THUMB_SUFFIX, ImageContext, _write_atomic, ensure_thumbnail, ingest_upload, load_model_inputs
+)
+from image_parts import ImagePartCache
+
+
+def _upload(folder, name="user_1_20250101.jpg", size=(1800, 1200)):
+    gradient = np.linspace(0, 255, size[0] * size[1] * 3, dtype=np.uint8).reshape(size[1], size[0], 3)
+    path = os.path.join(folder, name)
+    Image.fromarray(gradient).save(path)
+    return path
+
+
+def test_ingest_writes_all_derivatives(tmp_path):
+    path = _upload(tmp_path)
+    result = ingest_upload(path, thumb_side=256, max_side=1024)
+
+    with Image.open(result["thumbnail"]) as thumb:
+        assert thumb.format == "WEBP" and max(thumb.size) == 256
+    assert result["gemini"] == path + ".gemini.jpg"
+    with Image.open(io.BytesIO(result["part"]["data"])) as part:
+        assert part.format == "JPEG" and part.size == (1024, 683)
+    inputs = load_model_inputs(path)
+    assert inputs["gray"].shape == (224, 224) and inputs["rgb"].shape == (224, 224, 3)
+    assert tuple(inputs["size"]) == (1800, 1200)
+    assert not [f for f in os.listdir(tmp_path) if ".tmp" in f]
+
+
+def test_model_inputs_match_decoding_the_original(tmp_path):
+    path = _upload(tmp_path)
+    ingest_upload(path)
+    context = ImageContext(path)
+
+    for preprocess in (image_analyzer.preprocess_image_for_pneumonia, image_analyzer.preprocess_image_for_skin_disease):
+        from_file = preprocess(path)
+        stored = preprocess(path, context=context)
+        assert stored.shape == from_file.shape and stored.dtype == from_file.dtype
+        assert np.array_equal(stored, from_file)
+    assert image_analyzer.detect_image_type(path, context) == image_analyzer.detect_image_type(path) == "chest_xray"
+    assert context.decodes == 0
+
+
+def test_readers_do_not_decode_the_original_again(tmp_path, monkeypatch):
+    path = _upload(tmp_path)
+    ingest_upload(path)
+
+    def no_decode(*args, **kwargs):
+        raise AssertionError("original decoded again")
+    monkeypatch.setattr(Image, "open", no_decode)
+
+    cache = ImagePartCache(str(tmp_path))
+    part = cache.get_part(os.path.basename(path))
+    assert part["mime_type"] == "image/jpeg" and cache.stats()["stored_reads"] == 1
+    context = ImageContext(path)
+    assert image_analyzer.preprocess_image_for_pneumonia(path, context=context).shape == (1, 224, 224, 1)
+    assert context.gemini_part() == part
+
+
+def test_transparent_upload_keeps_png_part(tmp_path):
+    path = os.path.join(tmp_path, "user_1_alpha.png")
+    Image.new("RGBA", (300, 200), (10, 20, 30, 0)).save(path)
+    result = ingest_upload(path)
+    assert result["part"]["mime_type"] == "image/png" and result["gemini"].endswith(".gemini.png")
+    assert os.path.exists(path + MODEL_SUFFIX)
+
+
+def test_not_an_image_raises(tmp_path):
+    path = os.path.join(tmp_path, "user_1_fake.png")
+    with open(path, "wb") as f:
+        f.write(b"not an image")
+    with pytest.raises(OSError):
+        ingest_upload(path)
+
+
+def test_thumbnail_backfill_for_older_uploads(tmp_path):
+    name = os.path.basename(_upload(tmp_path, size=(640, 480)))
+    assert ensure_thumbnail(str(tmp_path), name + THUMB_SUFFIX, thumb_side=128)
+    with Image.open(os.path.join(tmp_path, name + THUMB_SUFFIX)) as thumb:
+        assert thumb.size == (128, 96)
+    assert not ensure_thumbnail(str(tmp_path), "missing.jpg" + THUMB_SUFFIX)
+    assert not ensure_thumbnail(str(tmp_path), name)
+
+
+def test_context_decodes_legacy_upload_once_for_every_view(tmp_path):
+    path = _upload(tmp_path, size=(600, 600))
+    context = ImageContext(path)
+    assert image_analyzer.detect_image_type(path, context) == "skin_disease"
+    assert context.decodes == 0  # the size came from the file header
+
+    gray = image_analyzer.preprocess_image_for_pneumonia(path, context=context)
+    assert np.array_equal(gray, image_analyzer.preprocess_image_for_pneumonia(path))
+    assert context.view("RGB").shape == (224, 224, 3) and context.view("RGB", (64, 64)).shape == (64, 64, 3)
+    part = context.gemini_part(max_side=300)
+    with Image.open(io.BytesIO(part["data"])) as img:
+        assert img.size == (300, 300)
+    assert context.decodes == 1
+
+
+def test_fast_preprocessing_decodes_reduced_and_stays_close(tmp_path):
+    path = _upload(tmp_path, size=(2400, 1800))
+    exact = ImageContext(path)
+    fast = ImageContext(path, fast=True, decode_side=448)
+
+    for preprocess in (image_analyzer.preprocess_image_for_pneumonia, image_analyzer.preprocess_image_for_skin_disease):
+        reference, quick = preprocess(path, context=exact), preprocess(path, context=fast)
+        assert quick.dtype == reference.dtype == np.float32 and quick.shape == reference.shape
+        assert float(np.abs(quick - reference).mean()) < 0.02
+    assert fast._image.size == (600, 450)  # JPEG decoded at 1/4 scale
+    assert fast.size == exact.size == (2400, 1800)  # type detection still sees the original shape
+
+    result = ingest_upload(path, max_side=1024, fast=True)
+    assert tuple(load_model_inputs(path)["size"]) == (2400, 1800)
+    with Image.open(io.BytesIO(result["part"]["data"])) as part:
+        assert part.size == (1024, 768)
+
+
+def test_concurrent_atomic_writes_of_one_path(tmp_path):
+    path = str(tmp_path / "scan.jpg.thumb.webp")
+    errors = []
+
+    def writer(value):
+        for _ in range(200):
+            try:
+                _write_atomic(path, bytes([value]) * 64)
+            except OSError as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert os.listdir(tmp_path) == ["scan.jpg.thumb.webp"]  # no temp files left behind
+    with open(path, "rb") as f:
+        data = f.read()
+    assert len(data) == 64 and len(set(data)) == 1
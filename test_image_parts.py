@@ -0,0 +1,72 @@
+# test_image_parts.py
+"""
+Tests for the encoded image part cache used when replaying thread history to Gemini.
+"""
+
+import io
+import os
+
+from PIL import Image
+
+from image_parts import ImagePartCache
+
+
+def _save(folder, name, size=(2000, 1500), mode="RGB", color=(200, 30, 30)):
+    Image.new(mode, size, color).save(os.path.join(folder, name))
+    return name
+
+
+def _open_fds():
+    return len(os.listdir("/proc/self/fd"))
+
+
+def test_encodes_once_downscaled_and_reuses(tmp_path):
+    name = _save(tmp_path, "scan.jpg")
+    cache = ImagePartCache(str(tmp_path), max_side=512)
+
+    part = cache.get_part(name)
+    assert part["mime_type"] == "image/jpeg"
+    with Image.open(io.BytesIO(part["data"])) as img:
+        assert max(img.size) == 512
+
+    assert cache.get_part(name) is part
+    stats = cache.stats()
+    assert stats["encodes"] == 1 and stats["hits"] == 1 and stats["bytes"] == len(part["data"])
+
+
+def test_no_file_handles_are_left_open(tmp_path):
+    names = [_save(tmp_path, f"img{i}.png") for i in range(20)]
+    cache = ImagePartCache(str(tmp_path))
+    before = _open_fds()
+    for name in names:
+        assert cache.get_part(name)
+    assert _open_fds() == before
+
+
+def test_byte_budget_evicts_least_recently_used(tmp_path):
+    names = [_save(tmp_path, f"img{i}.jpg", color=(i * 10, 0, 0)) for i in range(4)]
+    cache = ImagePartCache(str(tmp_path), max_side=256)
+    one = len(cache.get_part(names[0])["data"])
+    cache.clear()
+
+    cache = ImagePartCache(str(tmp_path), max_side=256, max_bytes=int(one * 2.5))
+    for name in names:
+        cache.get_part(name)
+    stats = cache.stats()
+    assert stats["entries"] == 2 and stats["evictions"] == 2 and stats["bytes"] <= one * 2.5
+
+
+def test_replaced_file_is_re_encoded_and_transparency_kept(tmp_path):
+    name = _save(tmp_path, "photo.png", size=(64, 64))
+    cache = ImagePartCache(str(tmp_path))
+    first = cache.get_part(name)
+    assert first["mime_type"] == "image/jpeg"
+
+    Image.new("RGBA", (80, 80), (0, 0, 0, 0)).save(os.path.join(tmp_path, name))
+    os.utime(os.path.join(tmp_path, name), ns=(1, 1))
+    second = cache.get_part(name)
+    assert second is not first and second["mime_type"] == "image/png"
+
+
+def test_missing_file_returns_none(tmp_path):
+    assert ImagePartCache(str(tmp_path)).get_part("gone.jpg") is None
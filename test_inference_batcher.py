@@ -0,0 +1,112 @@
+# test_inference_batcher.py
+"""
+Tests for inference_batcher.MicroBatcher and image_analyzer.run_inference: concurrent
+requests share forward passes, each caller gets its own row, errors reach every caller of
+the failed batch, and the metrics add up.
+"""
+
+import threading
+
+import numpy as np
+import pytest
+import tensorflow as tf
+
+import image_analyzer
+from config import Config
+from inference_batcher import MicroBatcher
+
+
+class RecordingModel:
+    """Doubles its input; records the size of every forward pass."""
+
+    def __init__(self, gate=None):
+        self.batch_sizes = []
+        self.gate = gate
+
+    def predict(self, batch, verbose=0):
+        if self.gate is not None:
+            self.gate.wait(5)
+        self.batch_sizes.append(len(batch))
+        return batch.reshape(len(batch), -1)[:, :1] * 2
+
+
+def _concurrent(fn, count):
+    results = [None] * count
+    def run(i):
+        results[i] = fn(i)
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def test_concurrent_requests_are_batched_and_routed_back():
+    gate = threading.Event()
+    model = RecordingModel(gate)
+    batcher = MicroBatcher(model.predict, max_batch=8, max_wait=0.05)
+
+    # The first request holds the worker until the others have queued up behind it
+    first = threading.Thread(target=batcher.predict, args=(np.full((1, 2, 2, 1), -1, np.float32),))
+    first.start()
+    threading.Timer(0.2, gate.set).start()
+    results = _concurrent(lambda i: batcher.predict(np.full((1, 2, 2, 1), i, np.float32)), 6)
+    first.join(5)
+
+    assert [float(result[0][0]) for result in results] == [2.0 * i for i in range(6)]
+    assert all(result.shape == (1, 1) for result in results)
+    assert sum(model.batch_sizes) == 7
+    assert len(model.batch_sizes) < 7
+    stats = batcher.stats()
+    assert stats["requests"] == 7 and stats["batches"] == len(model.batch_sizes)
+    assert sum(size * count for size, count in stats["batch_sizes"].items()) == 7
+    assert stats["wait_ms_max"] >= stats["wait_ms_avg"] > 0
+
+
+def test_batches_never_exceed_max_batch():
+    gate = threading.Event()
+    model = RecordingModel(gate)
+    batcher = MicroBatcher(model.predict, max_batch=3, max_wait=0.05)
+    threading.Timer(0.2, gate.set).start()
+
+    _concurrent(lambda i: batcher.predict(np.zeros((1, 2, 2, 1), np.float32)), 10)
+
+    assert sum(model.batch_sizes) == 10
+    assert max(model.batch_sizes) <= 3
+
+
+def test_error_reaches_every_caller_of_the_batch():
+    def broken(batch):
+        raise RuntimeError("out of memory")
+    batcher = MicroBatcher(broken, max_batch=4, max_wait=0.01)
+
+    with pytest.raises(RuntimeError, match="out of memory"):
+        batcher.predict(np.zeros((1, 2, 2, 1), np.float32))
+    assert batcher.stats()["errors"] == 1
+
+
+def test_run_inference_respects_the_config(monkeypatch):
+    tf.keras.utils.set_random_seed(0)
+    model = tf.keras.Sequential([tf.keras.Input((2, 2, 1)), tf.keras.layers.Flatten(), tf.keras.layers.Dense(1)])
+    batch = np.ones((1, 2, 2, 1), np.float32)
+    expected = model.predict(batch, verbose=0)
+    monkeypatch.setattr(image_analyzer, "_batchers", {})
+
+    monkeypatch.setattr(Config, "INFERENCE_BATCHING", False)
+    np.testing.assert_allclose(image_analyzer.run_inference("test_model", model, batch), expected, rtol=1e-5)
+    assert "test_model" not in image_analyzer.get_inference_stats()
+
+    monkeypatch.setattr(Config, "INFERENCE_BATCHING", True)
+    np.testing.assert_allclose(image_analyzer.run_inference("test_model", model, batch), expected, rtol=1e-5)
+    assert image_analyzer.get_inference_stats()["test_model"]["requests"] == 1
+
+
+def test_non_keras_runtimes_are_not_micro_batched(monkeypatch):
+    monkeypatch.setattr(Config, "INFERENCE_BATCHING", True)
+    monkeypatch.setattr(image_analyzer, "_batchers", {})
+    model = RecordingModel()  # e.g. a TFLiteModel: predict(batch) without being a Keras model
+
+    assert float(image_analyzer.run_inference("tflite_model", model, np.ones((1, 2, 2, 1), np.float32))[0][0]) == 2.0
+    assert model.batch_sizes == [1]
+    assert image_analyzer.get_inference_stats() == {}
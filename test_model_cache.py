@@ -0,0 +1,79 @@
+# test_model_cache.py
+"""
+Tests for model_cache: a .h5 model is converted once to a .keras artifact keyed by its hash,
+later loads skip the raw loader, and a replaced or unreadable source/artifact is handled.
+"""
+
+import os
+
+import numpy as np
+
+from model_cache import cached_model_path, load_cached_model, normalize_model_config
+
+
+def test_first_load_converts_and_later_loads_use_the_artifact(tmp_path, save_h5_model, raw_loader):
+    source = str(tmp_path / "scan_model.h5")
+    original = save_h5_model(source, seed=1)
+    cache_dir = str(tmp_path / "cache")
+    calls = []
+
+    first = load_cached_model(source, raw_loader(source, calls), cache_dir)
+    artifact = cached_model_path(source, cache_dir)
+    second = load_cached_model(source, raw_loader(source, calls), cache_dir)
+
+    assert calls == [source]
+    assert os.path.exists(artifact) and artifact.endswith(".keras")
+    batch = np.random.default_rng(0).random((1, 16, 16, 1), dtype=np.float32)
+    expected = original.predict(batch, verbose=0)
+    np.testing.assert_allclose(first.predict(batch, verbose=0), expected, rtol=1e-6)
+    np.testing.assert_allclose(second.predict(batch, verbose=0), expected, rtol=1e-6)
+
+
+def test_replaced_source_gets_a_new_artifact(tmp_path, save_h5_model, raw_loader):
+    source = str(tmp_path / "scan_model.h5")
+    cache_dir = str(tmp_path / "cache")
+    save_h5_model(source, seed=1)
+    old_artifact = cached_model_path(source, cache_dir)
+    load_cached_model(source, raw_loader(source, []), cache_dir)
+
+    os.remove(source)
+    save_h5_model(source, seed=2)
+    calls = []
+    load_cached_model(source, raw_loader(source, calls), cache_dir)
+
+    assert calls == [source]
+    assert cached_model_path(source, cache_dir) != old_artifact
+
+
+def test_unreadable_artifact_is_rebuilt(tmp_path, save_h5_model, raw_loader):
+    source = str(tmp_path / "scan_model.h5")
+    cache_dir = str(tmp_path / "cache")
+    save_h5_model(source, seed=1)
+    artifact = cached_model_path(source, cache_dir)
+    with open(artifact, "wb") as f:
+        f.write(b"truncated")
+
+    calls = []
+    model = load_cached_model(source, raw_loader(source, calls), cache_dir)
+
+    assert model is not None and calls == [source]
+    assert os.path.getsize(artifact) > len(b"truncated")
+
+
+def test_missing_source_or_failed_load_is_not_cached(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    assert load_cached_model(str(tmp_path / "absent.h5"), lambda: None, cache_dir) is None
+
+    source = tmp_path / "broken.h5"
+    source.write_bytes(b"not a model")
+    assert load_cached_model(str(source), lambda: None, cache_dir) is None
+    assert not any(name.endswith(".keras") for name in os.listdir(cache_dir))
+
+
+def test_normalize_model_config_strips_legacy_keys():
+    config = {"layers": [{"config": {"batch_shape": [None, 224, 224, 1], "dtype_policy": "DTypePolicy"}},
+                         {"config": {"dtype_policy": "float32"}}]}
+
+    normalize_model_config(config)
+
+    assert config == {"layers": [{"config": {"dtype_policy": None}}, {"config": {"dtype_policy": "float32"}}]}
@@ -0,0 +1,176 @@
+# test_model_registry.py
+"""
+Tests for image_analyzer.ModelRegistry: warm-up inference, negative caching of load failures
+with exponential backoff, a single load under concurrency, the /healthz/ready endpoint, and the
+warm-up starting on the first request rather than on import.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+import app as app_module
+from image_analyzer import ModelRegistry
+
+
+class FakeModel:
+    input_shape = (None, 224, 224, 1)
+
+    def __init__(self):
+        self.predictions = []
+
+    def predict(self, batch, verbose=0):
+        self.predictions.append(batch.shape)
+        return np.zeros((batch.shape[0], 1), dtype=np.float32)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_model_is_warmed_up_once_and_cached():
+    model = FakeModel()
+    calls = []
+    registry = ModelRegistry()
+    registry.register("pneumonia", lambda: calls.append(1) or model, (None, 224, 224, 1))
+
+    assert registry.ready() is False
+    registry.warm_up(background=False)
+
+    assert registry.get("pneumonia") is model
+    assert len(calls) == 1
+    assert model.predictions == [(1, 224, 224, 1)]
+    assert registry.ready() is True
+    state = registry.state()["pneumonia"]
+    assert state["state"] == "ready" and state["warmup_ms"] is not None
+
+
+def test_warm_up_uses_fallback_shape_when_model_reports_none():
+    model = FakeModel()
+    model.input_shape = (None, None, None, 3)
+    registry = ModelRegistry()
+    registry.register("skin_disease", lambda: model, (None, 224, 224, 3))
+
+    registry.get("skin_disease")
+
+    assert model.predictions == [(1, 224, 224, 3)]
+
+
+def test_failed_load_is_not_retried_until_backoff_elapses():
+    clock = Clock()
+    attempts = []
+
+    def broken_loader():
+        attempts.append(clock.now)
+        return None
+
+    registry = ModelRegistry(retry_base=10, retry_max=25, clock=clock)
+    registry.register("pneumonia", broken_loader, (None, 224, 224, 1))
+
+    assert registry.get("pneumonia") is None
+    assert registry.get("pneumonia") is None
+    assert len(attempts) == 1
+    state = registry.state()["pneumonia"]
+    assert state["state"] == "failed" and state["retry_in"] == 10
+    # A failed model has settled: readiness is only held back when every model is required
+    assert registry.ready() is True
+    assert registry.ready(require_all=True) is False
+
+    clock.now += 10
+    registry.get("pneumonia")
+    assert len(attempts) == 2
+    assert registry.state()["pneumonia"]["retry_in"] == 20  # doubled
+
+    clock.now += 20
+    registry.get("pneumonia")
+    assert registry.state()["pneumonia"]["retry_in"] == 25  # capped at retry_max
+
+
+def test_recovery_after_failure_resets_backoff():
+    clock = Clock()
+    model = FakeModel()
+    results = [RuntimeError("h5 truncated"), model]
+
+    def flaky_loader():
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    registry = ModelRegistry(retry_base=5, clock=clock)
+    registry.register("pneumonia", flaky_loader, (None, 224, 224, 1))
+
+    assert registry.get("pneumonia") is None
+    assert registry.state()["pneumonia"]["error"] == "h5 truncated"
+    clock.now += 5
+    assert registry.get("pneumonia") is model
+    assert registry.state()["pneumonia"]["failures"] == 0
+
+
+def test_concurrent_callers_share_one_load():
+    model = FakeModel()
+    calls = []
+    release = threading.Event()
+
+    def slow_loader():
+        calls.append(1)
+        release.wait(5)
+        return model
+
+    registry = ModelRegistry()
+    registry.register("pneumonia", slow_loader, (None, 224, 224, 1))
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get("pneumonia"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    assert registry.state()["pneumonia"]["state"] == "loading"
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert results == [model] * 4
+
+
+def test_readiness_endpoint(monkeypatch):
+    release = threading.Event()
+    registry = ModelRegistry()
+    registry.register("pneumonia", lambda: release.wait(5) and FakeModel(), (None, 224, 224, 1))
+    monkeypatch.setattr(app_module, "model_registry", registry)
+    client = app_module.app.test_client()
+
+    response = client.get("/healthz/ready")
+    assert response.status_code == 503
+    assert response.get_json()["models"]["pneumonia"]["state"] == "cold"
+
+    warmup = registry.warm_up(background=True)
+    release.set()
+    warmup.join(5)
+
+    response = client.get("/healthz/ready")
+    assert response.status_code == 200
+    assert response.get_json() == {"ready": True, "models": registry.state()}
+
+
+def test_warm_up_starts_on_first_request_not_on_import(monkeypatch):
+    registry = ModelRegistry()
+    registry.register("pneumonia", FakeModel, (None, 224, 224, 1))
+    monkeypatch.setattr(app_module, "model_registry", registry)
+    monkeypatch.setattr(app_module, "_warmup_started", False)
+    monkeypatch.setattr(app_module.Config, "MODEL_WARMUP", True)
+    client = app_module.app.test_client()
+    assert registry._warmup_thread is None
+
+    client.get("/healthz/ready")
+    warmup = registry._warmup_thread
+    warmup.join(5)
+    client.get("/healthz/ready")
+
+    assert registry._warmup_thread is warmup
+    assert registry.state()["pneumonia"]["state"] == "ready"
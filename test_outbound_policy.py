@@ -0,0 +1,166 @@
+# test_outbound_policy.py
+"""
+Tests for the outbound Gemini image policy (passthrough of small JPEG/WebP uploads,
+bounded re-encoding otherwise) and the per-turn byte counters.
+"""
+
+import io
+import os
+
+import numpy as np
+from PIL import Image
+
+import api_connection
+import image_ingest
+from image_ingest import ImageContext, ingest_upload
+from image_parts import encode_image_part
+from outbound_metrics import OutboundBytes
+from session_store import SessionStore
+from turn_guard import UserTurnGuard
+from upload_store import UploadStore
+
+
+def _noise(size, mode="RGB"):
+    rng = np.random.default_rng(1)
+    channels = {"RGB": 3, "RGBA": 4}[mode]
+    return Image.fromarray(rng.integers(0, 256, (size[1], size[0], channels), dtype=np.uint8), mode)
+
+
+def _decoded_size(part):
+    with Image.open(io.BytesIO(part["data"])) as img:
+        return img.size
+
+
+def test_small_jpeg_and_webp_pass_through_unchanged(tmp_path):
+    for name, fmt, mime_type in (("photo.jpg", "JPEG", "image/jpeg"), ("photo.webp", "WEBP", "image/webp")):
+        path = str(tmp_path / name)
+        _noise((800, 600)).save(path, format=fmt, quality=80)
+        with open(path, "rb") as f:
+            original = f.read()
+
+        result = ingest_upload(path, max_side=1024, max_bytes=len(original) + 1)
+        assert result["passthrough"] and result["part"] == {"mime_type": mime_type, "data": original}
+        assert os.stat(result["gemini"]).st_ino == os.stat(path).st_ino  # hard link, not a copy
+        assert encode_image_part(path, max_side=1024, max_bytes=len(original) + 1)["data"] == original
+
+
+def test_oversized_or_rotated_uploads_are_re_encoded(tmp_path):
+    large = str(tmp_path / "large.jpg")
+    _noise((2000, 1000)).save(large, quality=80)
+    result = ingest_upload(large, max_side=1024)
+    assert not result["passthrough"] and _decoded_size(result["part"]) == (1024, 512)
+
+    rotated = str(tmp_path / "rotated.jpg")
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotate 90 degrees on display
+    _noise((400, 300)).save(rotated, quality=80, exif=exif)
+    result = ingest_upload(rotated, max_side=1024)
+    assert not result["passthrough"] and _decoded_size(result["part"]) == (300, 400)
+
+    png = str(tmp_path / "scan.png")
+    _noise((400, 300)).save(png)
+    assert not ingest_upload(png, max_side=1024)["passthrough"]
+
+
+def test_upload_with_gps_exif_is_not_sent_unchanged(tmp_path):
+    path = str(tmp_path / "phone.jpg")
+    exif = Image.Exif()
+    exif[0x0112] = 1  # upright
+    exif[0x0110] = "Pixel 8"  # camera model
+    exif.get_ifd(0x8825).update({1: "N", 2: (52.0, 31.0, 12.0)})  # GPS latitude
+    _noise((400, 300)).save(path, quality=80, exif=exif)
+    with open(path, "rb") as f:
+        original = f.read()
+
+    result = ingest_upload(path, max_side=1024, max_bytes=len(original) * 2)
+
+    assert not result["passthrough"] and result["part"]["data"] != original
+    with Image.open(io.BytesIO(result["part"]["data"])) as sent:
+        assert not sent.getexif() and "xmp" not in sent.info
+    assert encode_image_part(path, max_side=1024, max_bytes=len(original) * 2)["data"] != original
+
+    xmp = str(tmp_path / "edited.jpg")
+    _noise((400, 300)).save(xmp, quality=80, xmp=b"<x:xmpmeta><rdf:Description/></x:xmpmeta>")
+    assert not ingest_upload(xmp, max_side=1024)["passthrough"]
+
+
+def test_byte_cap_lowers_quality_then_size(tmp_path):
+    path = str(tmp_path / "noisy.png")
+    _noise((1600, 1200)).save(path)
+    part = ImageContext(path).gemini_part(max_side=1024, quality=85, max_bytes=60 * 1024)
+    assert part["mime_type"] == "image/jpeg" and len(part["data"]) <= 60 * 1024
+    assert max(_decoded_size(part)) < 1024
+
+    transparent = str(tmp_path / "overlay.png")
+    _noise((900, 900), "RGBA").save(transparent)
+    part = ImageContext(transparent).gemini_part(max_side=1024, max_bytes=100 * 1024)
+    assert part["mime_type"] == "image/webp" and len(part["data"]) <= 100 * 1024
+
+
+def test_outbound_bytes_per_turn():
+    outbound = OutboundBytes()
+    history = [{"role": "user", "parts": ["hello", {"mime_type": "image/jpeg", "data": b"x" * 1000}]},
+               {"role": "model", "parts": ["héllo"]}]
+    assert outbound.record_turn(history, ["next question", {"mime_type": "image/webp", "data": b"y" * 500}]) == 1524
+    assert outbound.record_turn(None, ["text only"]) == 9
+    outbound.record_image(passthrough=True)
+
+    stats = outbound.stats()
+    assert stats["turns"] == 2 and stats["image_turns"] == 1 and stats["image_bytes"] == 500
+    assert stats["history_bytes"] == 1011 and stats["bytes_sent"] == 1533 and stats["max_turn_bytes"] == 1524
+    assert stats["avg_turn_bytes"] == 766 and stats["images_passthrough"] == 1
+
+
+def test_failed_send_is_not_counted_as_sent():
+    outbound = OutboundBytes()
+    outbound.record_turn(None, ["hello"], delivered=False)
+    outbound.record_turn(None, ["hello again"])
+
+    stats = outbound.stats()
+    assert stats["turns"] == 1 and stats["bytes_sent"] == 11
+    assert stats["failed_turns"] == 1 and stats["failed_bytes"] == 5
+
+
+def test_policy_decision_is_recorded_for_deduplicated_uploads(tmp_path, monkeypatch):
+    outcomes = iter([{"content": "ok", "status": "complete"}, {"content": "ok", "status": "complete"},
+                     {"content": "An internal API error occurred.", "status": "error", "delivered": False}])
+    monkeypatch.setattr(api_connection, "outbound", OutboundBytes())
+    monkeypatch.setattr(api_connection, "sessions", SessionStore())
+    monkeypatch.setattr(api_connection, "turn_guard", UserTurnGuard(policy="queue"))
+    monkeypatch.setattr(api_connection, "create_new_chat_thread", lambda user_id: 7)
+    monkeypatch.setattr(api_connection, "create_chat_session", lambda history=None: object())
+    monkeypatch.setattr(api_connection, "analyze_medical_image", lambda path, context=None: {"error": "no model"})
+    monkeypatch.setattr(api_connection, "save_turn", lambda turn: True)
+    monkeypatch.setattr(api_connection, "send_message", lambda chat_session, parts: next(outcomes))
+    # The decision made at ingest is reused: no turn reads the upload back to compare bytes
+    monkeypatch.setattr(image_ingest, "is_passthrough_part", lambda path, part: 1 / 0)
+
+    store = UploadStore(str(tmp_path))
+    buffer = io.BytesIO()
+    _noise((400, 300)).save(buffer, format="JPEG", quality=80)
+    for i in range(3):  # the second and third uploads are deduplicated: no ingest, stored derivatives
+        key, duplicate = store.save_stream(io.BytesIO(buffer.getvalue()), "photo.jpg")
+        assert duplicate == (i > 0)
+        context = api_connection.prepare_uploaded_image(store.path_for(key), key)
+        api_connection.get_gemini_response(1, "what is this rash?", image_filename=key, image_context=context)
+
+    stats = api_connection.outbound.stats()
+    assert stats["images_passthrough"] == 3 and stats["images_reencoded"] == 0
+    assert stats["turns"] == 2 and stats["failed_turns"] == 1
+
+
+def test_passthrough_of_uploads_ingested_before_it_was_stored(tmp_path):
+    path = str(tmp_path / "photo.jpg")
+    _noise((400, 300)).save(path, format="JPEG", quality=80)
+    ingest_upload(path, max_side=1024)
+    model_path = path + image_ingest.MODEL_SUFFIX
+    with np.load(model_path) as stored:
+        legacy = {key: stored[key] for key in ("gray", "rgb", "size")}
+    with open(model_path, "wb") as f:
+        np.savez(f, **legacy)
+
+    assert ImageContext(path).passthrough is True
+    png = str(tmp_path / "scan.png")
+    _noise((300, 200)).save(png)
+    ingest_upload(png, max_side=1024)
+    assert ImageContext(png).passthrough is False
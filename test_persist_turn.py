@@ -0,0 +1,90 @@
+# test_persist_turn.py
+"""
+Tests that a chat turn is written with one transaction and rolled back as a whole on failure.
+"""
+
+import mysql.connector
+
+import user_db_operations
+
+
+class RecordingCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, query, params=None):
+        if self.conn.fail_on and self.conn.fail_on in query:
+            raise mysql.connector.Error("simulated failure")
+        self.conn.statements.append((" ".join(query.split()), list(params or [])))
+
+    def close(self):
+        pass
+
+
+class RecordingConnection:
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.statements = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self, dictionary=False):
+        return RecordingCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        pass
+
+
+def _use_connection(monkeypatch, conn):
+    monkeypatch.setattr(user_db_operations, "get_db_connection", lambda: conn)
+
+
+def test_turn_is_one_transaction(monkeypatch):
+    conn = RecordingConnection()
+    _use_connection(monkeypatch, conn)
+
+    structured = {"disease": "Common Cold", "probability": "85%", "severity": "Mild",
+                  "medication": "Paracetamol", "other_diagnoses": "None", "conclusion": "See a doctor."}
+    ok = user_db_operations.persist_turn(1, 7, "I have a cough", "img.jpg",
+                                         assistant_text="Diagnosis...", structured=structured, title="I have a cough")
+    assert ok
+    assert conn.commits == 1 and conn.rollbacks == 0
+
+    posts_sql, posts_params = conn.statements[0]
+    assert posts_sql.startswith("INSERT INTO posts") and posts_sql.count("(%s, %s, %s, %s, %s)") == 2
+    assert posts_params == [1, 7, "user", "I have a cough", "img.jpg", 1, 7, "assistant", "Diagnosis...", None]
+
+    structured_sql, structured_params = conn.statements[1]
+    assert structured_sql.startswith("INSERT INTO structured_responses")
+    assert structured_params[3:] == ["Common Cold", "85%", "Mild", "Paracetamol", "None", "See a doctor."]
+
+    assert conn.statements[2][0].startswith("UPDATE chat_threads SET title")
+    assert len(conn.statements) == 3
+
+
+def test_failed_turn_is_rolled_back(monkeypatch):
+    conn = RecordingConnection(fail_on="structured_responses")
+    _use_connection(monkeypatch, conn)
+
+    ok = user_db_operations.persist_turn(1, 7, "I have a cough", assistant_text="Diagnosis...",
+                                         structured={"disease": "Flu"})
+    assert not ok
+    assert conn.commits == 0 and conn.rollbacks == 1
+
+
+def test_batch_of_turns_uses_multi_row_insert(monkeypatch):
+    conn = RecordingConnection()
+    _use_connection(monkeypatch, conn)
+
+    turns = [user_db_operations.build_turn(1, 7, f"message {i}", assistant_text=f"reply {i}") for i in range(3)]
+    assert user_db_operations.persist_turns(turns)
+    assert conn.commits == 1
+    assert len(conn.statements) == 1
+    assert conn.statements[0][0].count("(%s, %s, %s, %s, %s)") == 6
+
@@ -0,0 +1,72 @@
+# test_quantized_runtime.py
+"""
+Tests for quantized_runtime: TFLite exports behave like the Keras model they come from, are
+cached by source hash, and int8 without calibration falls back to the Keras model.
+"""
+
+import os
+
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from quantized_runtime import TFLiteModel, export_tflite, load_quantized_model, quantized_model_path
+
+
+@pytest.mark.parametrize("quantization", ["float16", "dynamic", "int8"])
+def test_export_matches_keras_model(tmp_path, quantization, save_h5_model):
+    model = save_h5_model(str(tmp_path / "scan_model.h5"))
+    rng = np.random.default_rng(0)
+    calibration = [rng.random((1, 16, 16, 1), dtype=np.float32) for _ in range(8)]
+    path = str(tmp_path / f"scan_model.{quantization}.tflite")
+
+    export_tflite(model, path, quantization, calibration)
+    tflite_model = TFLiteModel(path)
+
+    batch = rng.random((3, 16, 16, 1), dtype=np.float32)
+    assert tflite_model.input_shape == (None, 16, 16, 1)
+    result = tflite_model.predict(batch)
+    assert result.shape == (3, 3) and result.dtype == np.float32
+    np.testing.assert_allclose(result, model.predict(batch, verbose=0), atol=0.05)
+
+
+def test_batches_run_as_one_invoke_of_the_right_size(tmp_path, save_h5_model):
+    model = save_h5_model(str(tmp_path / "scan_model.h5"))
+    path = str(tmp_path / "scan_model.float16.tflite")
+    export_tflite(model, path, "float16")
+    tflite_model = TFLiteModel(path)
+    rng = np.random.default_rng(1)
+
+    for size in (4, 1, 4):
+        batch = rng.random((size, 16, 16, 1), dtype=np.float32)
+        assert tflite_model.predict(batch).shape == (size, 3)
+        assert tuple(tflite_model._interpreter.get_input_details()[0]["shape"]) == (size, 16, 16, 1)
+
+
+def test_int8_export_requires_calibration(tmp_path, save_h5_model):
+    model = save_h5_model(str(tmp_path / "scan_model.h5"))
+    with pytest.raises(ValueError, match="calibration"):
+        export_tflite(model, str(tmp_path / "m.tflite"), "int8")
+
+
+def test_float16_is_exported_on_first_load_and_reused(tmp_path, save_h5_model, raw_loader):
+    source = str(tmp_path / "scan_model.h5")
+    save_h5_model(source)
+    cache_dir = str(tmp_path / "cache")
+    calls = []
+
+    first = load_quantized_model(source, raw_loader(source, calls), cache_dir, "float16")
+    second = load_quantized_model(source, raw_loader(source, calls), cache_dir, "float16")
+
+    assert isinstance(first, TFLiteModel) and isinstance(second, TFLiteModel)
+    assert calls == [source]
+    assert os.path.exists(quantized_model_path(source, cache_dir, "float16"))
+
+
+def test_uncalibrated_int8_falls_back_to_keras(tmp_path, save_h5_model, raw_loader):
+    source = str(tmp_path / "scan_model.h5")
+    save_h5_model(source)
+
+    model = load_quantized_model(source, raw_loader(source, []), str(tmp_path / "cache"), "int8")
+
+    assert isinstance(model, tf.keras.Model)
@@ -0,0 +1,193 @@
+# test_session_state.py
+"""
+Tests for the shared session-state backends: two SessionStores sharing one backend act
+like two worker processes, and the Redis backend is exercised against a small in-process
+stand-in server that speaks the subset of RESP it uses.
+"""
+
+import socketserver
+import threading
+
+import pytest
+
+from session_state import RedisSessionState, SQLiteSessionState
+from session_store import SessionStore, UserSession, session_to_state
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        queued = None
+        while True:
+            command = self._read_command()
+            if command is None:
+                return
+            name = command[0].upper()
+            if name == "MULTI":
+                queued = []
+                self._reply("+OK")
+            elif name == "EXEC":
+                results = [self.server.run(c) for c in queued]
+                queued = None
+                self.wfile.write(b"*%d\r\n" % len(results) + b"".join(self._encode(r) for r in results))
+            elif queued is not None:
+                queued.append(command)
+                self._reply("+QUEUED")
+            else:
+                self.wfile.write(self._encode(self.server.run(command)))
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2].decode("utf-8"))
+        return args
+
+    def _reply(self, line):
+        self.wfile.write(line.encode("utf-8") + b"\r\n")
+
+    @staticmethod
+    def _encode(value):
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, list):
+            return b"*%d\r\n" % len(value) + b"".join(FakeRedisHandler._encode(v) for v in value)
+        data = str(value).encode("utf-8")
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeRedisHandler)
+        self.hashes = {}
+        self.lock = threading.Lock()
+
+    def run(self, command):
+        name, args = command[0].upper(), command[1:]
+        with self.lock:
+            if name == "HINCRBY":
+                entry = self.hashes.setdefault(args[0], {})
+                entry[args[1]] = str(int(entry.get(args[1], 0)) + int(args[2]))
+                return int(entry[args[1]])
+            if name == "HSET":
+                entry = self.hashes.setdefault(args[0], {})
+                pairs = list(zip(args[1::2], args[2::2]))
+                entry.update(pairs)
+                return len(pairs)
+            if name == "HMGET":
+                entry = self.hashes.get(args[0], {})
+                return [entry.get(field) for field in args[1:]]
+            if name == "DEL":
+                return 1 if self.hashes.pop(args[0], None) is not None else 0
+            if name == "EXPIRE":
+                return 1
+            if name == "FLUSHDB":
+                self.hashes.clear()
+                return "OK"
+        return None
+
+
+@pytest.fixture
+def redis_state():
+    server = FakeRedisServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address
+    state = RedisSessionState(f"redis://{host}:{port}/0")
+    yield state
+    state.client.close()
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def sqlite_state(tmp_path):
+    return SQLiteSessionState(str(tmp_path / "session_state.db"))
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def shared(request):
+    return request.getfixturevalue(f"{request.param}_state")
+
+
+def _restore(state):
+    return UserSession(state["thread_id"], chat_session="restored", history=state["history"],
+                       history_cursor=state["history_cursor"], transcript=state["transcript"])
+
+
+def _worker(shared):
+    return SessionStore(shared=shared, restore=_restore)
+
+
+def test_save_load_and_versions(shared):
+    user_session = UserSession(7, history=[{"role": "user", "content": "hi", "image": None}],
+                               transcript=[["user", "hi", None]])
+    assert shared.save(1, session_to_state(user_session)) == 1
+    assert shared.save(1, session_to_state(user_session)) == 2
+    assert shared.get_meta(1) == (2, 7)
+    version, state = shared.load(1)
+    assert version == 2 and state["transcript"] == [["user", "hi", None]]
+    shared.delete(1)
+    assert shared.get_meta(1) is None and shared.load(1) is None
+
+
+def test_any_worker_serves_any_request(shared):
+    worker_a, worker_b = _worker(shared), _worker(shared)
+
+    user_session = UserSession(42, chat_session="live", transcript=[["user", "cough", "a.jpg"]])
+    worker_a.put(5, user_session)
+
+    # The next request lands on another worker: same thread and Gemini context
+    assert worker_b.last_thread(5) == 42
+    restored = worker_b.get(5)
+    assert restored.thread_id == 42 and restored.transcript == [["user", "cough", "a.jpg"]]
+    assert restored.chat_session == "restored"
+
+    # Worker A keeps its live chat object while nothing changed...
+    assert worker_a.get(5) is user_session
+    # ...and picks up the newer state once worker B has handled a turn
+    restored.transcript.append(["assistant", "rest", None])
+    worker_b.put(5, restored)
+    assert worker_a.get(5).transcript[-1] == ["assistant", "rest", None]
+    assert worker_a.stats()["shared_reloads"] == 1
+
+
+def test_logout_on_one_worker_ends_session_everywhere(shared):
+    worker_a, worker_b = _worker(shared), _worker(shared)
+    worker_a.put(3, UserSession(9))
+    assert worker_b.get(3) is not None
+    worker_b.remove(3)
+    assert worker_a.get(3) is None and worker_a.last_thread(3) is None
+
+
+def test_turn_finishing_after_logout_does_not_resave_the_session(shared):
+    worker_a, worker_b = _worker(shared), _worker(shared)
+    running = UserSession(9, transcript=[["user", "hi", None]])
+    worker_a.put(3, running)
+    worker_b.remove(3)  # logout served by another worker while worker A's turn runs
+
+    running.transcript.append(["assistant", "hello", None])
+    assert worker_a.update(3, running) is False
+    assert shared.get_meta(3) is None and worker_b.get(3) is None
+
+
+def test_snapshot_drops_inline_image_data():
+    user_session = UserSession(1, history=[{"role": "user", "content": "look", "image": {
+        "base64_data": "A" * 5000, "mime_type": "image/png", "filename": "x.png"}}])
+    state = session_to_state(user_session)
+    assert state["history"][0]["image"] == {"filename": "x.png", "mime_type": "image/png"}
+    assert user_session.history[0]["image"]["base64_data"]  # live session untouched
+
+
+def test_unreachable_backend_falls_back_to_local_copy():
+    store = SessionStore(shared=RedisSessionState("redis://127.0.0.1:1/0", timeout=0.2), restore=_restore)
+    store.put(1, UserSession(5))
+    assert store.get(1).thread_id == 5
+    assert store.stats()["shared_errors"] >= 2
@@ -0,0 +1,153 @@
+# test_session_store.py
+"""
+Tests for the bounded per-user session store: entry/byte budgets, idle expiry and
+rehydration of evicted sessions through the loader, and a bounded history page for live sessions.
+"""
+
+import time
+
+import api_connection
+import user_db_operations as ops
+from config import Config
+from session_store import SessionStore, UserSession, estimate_session_bytes, session_to_state
+from turn_guard import UserTurnGuard
+
+
+def _session(thread_id, text_bytes=0):
+    history = [{"role": "user", "content": "x" * text_bytes, "image": None}] if text_bytes else []
+    return UserSession(thread_id, chat_session=object(), history=history)
+
+
+def test_entry_limit_evicts_least_recently_used():
+    store = SessionStore(max_entries=2)
+    store.put(1, _session(10))
+    store.put(2, _session(20))
+    store.get(1)
+    store.put(3, _session(30))
+
+    assert store.get(2) is None
+    assert store.get(1).thread_id == 10 and store.get(3).thread_id == 30
+    stats = store.stats()
+    assert stats["entries"] == 2 and stats["evictions"] == 1
+
+
+def test_byte_budget_and_gauges():
+    one = _session(1, text_bytes=10000)
+    store = SessionStore(max_entries=100, max_bytes=int(estimate_session_bytes(one) * 2.5))
+    for user_id in range(1, 5):
+        store.put(user_id, _session(user_id, text_bytes=10000))
+
+    stats = store.stats()
+    assert stats["entries"] == 2
+    assert stats["evictions"] == 2
+    assert stats["estimated_bytes"] == 2 * estimate_session_bytes(one)
+
+
+def test_growing_session_is_remeasured_on_put():
+    store = SessionStore()
+    user_session = _session(5)
+    store.put(1, user_session)
+    before = store.stats()["estimated_bytes"]
+
+    user_session.history.append({"role": "assistant", "content": "y" * 5000, "image": None})
+    store.put(1, user_session)
+    assert store.stats()["estimated_bytes"] >= before + 5000
+
+
+def test_idle_session_expires_but_thread_pointer_survives():
+    store = SessionStore(idle_ttl=0.05)
+    store.put(1, _session(42))
+    time.sleep(0.08)
+    assert store.get(1) is None
+    assert store.last_thread(1) == 42
+
+
+def test_evicted_session_is_rehydrated_from_loader():
+    loads = []
+
+    def loader(user_id, thread_id):
+        loads.append((user_id, thread_id))
+        return _session(thread_id)
+
+    store = SessionStore(loader=loader, max_entries=1)
+    store.put(1, _session(11))
+    store.put(2, _session(22))  # evicts user 1
+
+    restored = store.get_or_load(1)
+    assert restored.thread_id == 11
+    assert loads == [(1, 11)]
+    assert store.get_or_load(1) is restored
+    assert store.stats()["rehydrations"] == 1
+
+
+def test_remove_forgets_session_and_thread():
+    store = SessionStore(loader=lambda user_id, thread_id: _session(thread_id))
+    store.put(1, _session(7))
+    store.remove(1)
+    assert store.get_or_load(1) is None
+    assert store.last_thread(1) is None
+
+
+def test_activate_reuses_session_on_same_thread():
+    builds = []
+
+    def build(user_id, thread_id):
+        builds.append(thread_id)
+        return UserSession(thread_id, chat_session=object())
+
+    store = SessionStore()
+    first = store.activate(1, 10, build)
+    assert store.activate(1, 10, build) is first   # page refresh
+    store.activate(1, 20, build)                    # thread switch
+    store.activate(1, 20, build)
+
+    assert builds == [10, 20]
+    stats = store.stats()
+    assert stats["rebuilds"] == 2 and stats["rebuilds_avoided"] == 2
+
+
+def test_refresh_does_not_requery_history(monkeypatch):
+    queries = []
+    monkeypatch.setattr(api_connection, "sessions", SessionStore())
+    monkeypatch.setattr(api_connection, "create_chat_session", lambda history=None: object())
+    monkeypatch.setattr(api_connection, "get_history_by_user_id",
+                        lambda user_id, thread_id, limit=None: queries.append(thread_id) or [])
+    monkeypatch.setattr(api_connection, "get_thread_summary", lambda user_id, thread_id: None)
+
+    for _ in range(3):
+        api_connection.initialize_chat_history(1, "alice", thread_id_to_load=5)
+    api_connection.initialize_chat_history(1, "alice")  # no explicit thread: stays on 5
+    assert queries == [5]
+    assert api_connection.get_session_stats()["rebuilds_avoided"] == 3
+
+
+def test_live_session_keeps_one_page_and_a_cursor_for_the_rest(sqlite_db, monkeypatch):
+    monkeypatch.setattr(Config, "HISTORY_PAGE_SIZE", 6)
+    monkeypatch.setattr(api_connection, "sessions", SessionStore(loader=api_connection._build_session))
+    monkeypatch.setattr(api_connection, "turn_guard", UserTurnGuard())
+    monkeypatch.setattr(api_connection, "create_chat_session", lambda history=None: object())
+    monkeypatch.setattr(api_connection, "is_symptom_query", lambda text: True)
+    monkeypatch.setattr(api_connection, "build_symptom_prompt", lambda text, analysis=None: text)
+    monkeypatch.setattr(api_connection, "send_message",
+                        lambda chat_session, parts: {"content": f"reply to {parts[0]}", "status": "complete"})
+    assert ops.register_user("patient", "pages@example.com", "hash")
+    user_id = ops.get_user_by_email("pages@example.com")["id"]
+
+    for i in range(10):
+        api_connection.get_gemini_response(user_id, f"question {i}")
+        user_session = api_connection.sessions.get(user_id)
+        assert len(user_session.history) <= 6 and len(session_to_state(user_session)["history"]) <= 6
+
+    # Page refresh: the live session is reused, with only the newest page and a cursor for the rest
+    thread_id = user_session.thread_id
+    api_connection.initialize_chat_history(user_id, "patient", thread_id_to_load=thread_id)
+    history = api_connection.get_history(user_id)
+    assert [m["content"] for m in history[-2:]] == ["question 9", "reply to question 9"]
+    assert len(history) == 6 and api_connection.sessions.get(user_id) is user_session
+
+    contents, cursor = [m["content"] for m in history], api_connection.get_history_cursor(user_id)
+    while cursor:
+        page = ops.get_history_by_user_id(user_id, thread_id, before=cursor, limit=6)
+        contents = [record.text_content for record in page] + contents
+        cursor = ops.next_page_cursor(page, 6, oldest_first=True)
+    assert contents == [text for i in range(10) for text in (f"question {i}", f"reply to question {i}")]
@@ -0,0 +1,89 @@
+# test_sqlite_backend.py
+"""
+Runs the user_db_operations query layer end-to-end against the SQLite storage engine.
+"""
+
+import pytest
+
+import app as app_module
+import db_manager
+import user_db_operations as ops
+
+
+def _new_user(email="patient@example.com"):
+    assert ops.register_user("patient", email, "hash")
+    return ops.get_user_by_email(email)["id"]
+
+
+def test_schema_is_created_in_wal_mode(sqlite_db):
+    conn = db_manager.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA journal_mode")
+    assert cursor.fetchone()[0] == "wal"
+    assert db_manager.get_backend().index_exists(cursor, "posts", "idx_posts_user_thread_created")
+    assert db_manager.get_schema_version(cursor) == db_manager.MIGRATIONS[-1][0]
+    cursor.close()
+    conn.close()
+
+
+def test_turns_history_and_pagination(sqlite_db):
+    user_id = _new_user()
+    thread_id = ops.create_new_chat_thread(user_id)
+    for i in range(5):
+        assert ops.persist_turn(user_id, thread_id, f"question {i}", assistant_text=f"answer {i}",
+                                structured={"disease": "Flu"}, title="question 0" if i == 0 else None)
+
+    history = ops.get_history_by_user_id(user_id, thread_id)
+    assert [r.text_content for r in history[:4]] == ["question 0", "answer 0", "question 1", "answer 1"]
+
+    # Walk the thread backwards three posts at a time
+    texts = []
+    cursor = None
+    while True:
+        page = ops.get_history_by_user_id(user_id, thread_id, before=cursor, limit=3)
+        texts = [r.text_content for r in page] + texts
+        cursor = ops.next_page_cursor(page, 3, oldest_first=True)
+        if not cursor:
+            break
+    assert texts == [r.text_content for r in history]
+
+    assert ops.get_thread_by_id(user_id, thread_id)["title"] == "question 0"
+
+
+def test_thread_list_pages_and_cascade_delete(sqlite_db):
+    user_id = _new_user()
+    thread_ids = [ops.create_new_chat_thread(user_id, title=f"t{i}") for i in range(5)]
+
+    first = ops.get_user_threads(user_id, limit=2)
+    second = ops.get_user_threads(user_id, before=ops.next_page_cursor(first, 2), limit=2)
+    third = ops.get_user_threads(user_id, before=ops.next_page_cursor(second, 2), limit=2)
+    assert [t["id"] for t in first + second + third] == sorted(thread_ids, reverse=True)
+
+    ops.persist_turn(user_id, thread_ids[0], "hello", assistant_text="hi")
+    assert ops.delete_thread(user_id, thread_ids[0])
+    assert ops.get_thread_by_id(user_id, thread_ids[0]) is None
+    assert ops.get_history_by_user_id(user_id, thread_ids[0]) == []
+
+
+@pytest.mark.parametrize("before", ["garbage", "2025-01-01T10:00:00_x", "2025-13-01T10:00:00_5"])
+def test_malformed_cursor_is_rejected_not_treated_as_first_page(sqlite_db, before):
+    user_id = _new_user()
+    thread_id = ops.create_new_chat_thread(user_id)
+    ops.persist_turn(user_id, thread_id, "hello", assistant_text="hi")
+    with pytest.raises(ValueError):
+        ops.get_user_threads(user_id, before=before, limit=2)
+
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_id"] = user_id
+        sess["username"] = "patient"
+    assert client.get("/threads", query_string={"before": before}).status_code == 400
+    assert client.get(f"/threads/{thread_id}/messages", query_string={"before": before}).status_code == 400
+
+    response = client.get(f"/threads/{thread_id}/messages", query_string={"before": ""})
+    assert response.status_code == 200 and len(response.get_json()["messages"]) == 2
+
+
+def test_duplicate_email_is_rejected(sqlite_db):
+    _new_user()
+    assert ops.register_user("other", "patient@example.com", "hash") is False
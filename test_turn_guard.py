@@ -0,0 +1,212 @@
+# test_turn_guard.py
+"""
+Stress tests for per-user turn serialization: concurrent turns for one user never overlap
+and keep history in order, while turns for different users run in parallel. Session changes
+outside a turn (logout, new chat) never fail with a 500 while a turn is in flight.
+"""
+
+import threading
+import time
+
+import pytest
+
+import api_connection
+import app as app_module
+from session_store import SessionStore, UserSession
+from turn_guard import TurnRejectedError, UserTurnGuard
+
+
+class OverlapProbe:
+    """Records how many turns are inside the critical section at once, per user and overall."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = {}
+        self.max_per_user = 0
+        self.max_total = 0
+        self.calls = 0
+
+    def turn(self, user_id, duration, result=None):
+        with self.lock:
+            self.calls += 1
+            self.running[user_id] = self.running.get(user_id, 0) + 1
+            self.max_per_user = max(self.max_per_user, self.running[user_id])
+            self.max_total = max(self.max_total, sum(self.running.values()))
+        time.sleep(duration)
+        with self.lock:
+            self.running[user_id] -= 1
+        return result
+
+
+def _fire(count, target):
+    barrier = threading.Barrier(count)
+    results, errors = [None] * count, []
+
+    def worker(i):
+        barrier.wait()
+        try:
+            results[i] = target(i)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, errors
+
+
+def test_same_user_turns_never_overlap():
+    guard, probe = UserTurnGuard(policy="queue"), OverlapProbe()
+    _, errors = _fire(16, lambda i: guard.run(1, lambda: probe.turn(1, 0.005)))
+    assert not errors
+    assert probe.calls == 16 and probe.max_per_user == 1
+    stats = guard.stats()
+    assert stats["turns"] == 16 and stats["queued"] > 0 and stats["active_users"] == 0
+
+
+def test_different_users_do_not_contend_even_on_one_stripe():
+    # A single stripe puts every user in the same registry segment: turns must still run in parallel
+    guard, probe = UserTurnGuard(stripes=1, policy="queue"), OverlapProbe()
+    started = time.perf_counter()
+    _, errors = _fire(8, lambda i: guard.run(i, lambda: probe.turn(i, 0.2)))
+    elapsed = time.perf_counter() - started
+    assert not errors
+    assert probe.max_total == 8
+    assert elapsed < 0.2 * 8 / 2
+    assert guard.stats()["queued"] == 0
+
+
+def test_reject_policy_refuses_concurrent_turn():
+    guard, probe = UserTurnGuard(policy="reject"), OverlapProbe()
+    results, errors = _fire(4, lambda i: guard.run(1, lambda: probe.turn(1, 0.2, result=i)))
+    assert len(errors) == 3 and all(isinstance(e, TurnRejectedError) for e in errors)
+    assert probe.calls == 1 and guard.stats()["rejected"] == 3
+    # Other users are unaffected while user 1 is busy
+    assert guard.run(2, lambda: "ok") == "ok"
+
+
+def test_coalesce_policy_shares_result_of_identical_request():
+    guard, probe = UserTurnGuard(policy="coalesce"), OverlapProbe()
+    results, errors = _fire(5, lambda i: guard.run(1, lambda: probe.turn(1, 0.2, result="answer"),
+                                                   fingerprint=("same text", None)))
+    assert not errors
+    assert results == ["answer"] * 5
+    assert probe.calls == 1 and guard.stats()["coalesced"] == 4
+
+
+def test_coalesce_policy_queues_different_requests():
+    guard, probe = UserTurnGuard(policy="coalesce"), OverlapProbe()
+    results, errors = _fire(3, lambda i: guard.run(1, lambda: probe.turn(1, 0.02, result=i), fingerprint=(i,)))
+    assert not errors and sorted(results) == [0, 1, 2]
+    assert probe.calls == 3 and probe.max_per_user == 1
+
+
+def test_queue_timeout_raises():
+    guard = UserTurnGuard(policy="queue", wait_timeout=0.05)
+    probe = OverlapProbe()
+    _, errors = _fire(2, lambda i: guard.run(1, lambda: probe.turn(1, 0.3)))
+    assert len(errors) == 1 and isinstance(errors[0], TurnRejectedError)
+    assert guard.stats()["timeouts"] == 1
+
+
+def test_hold_waits_under_reject_policy_and_force_runs_after_timeout():
+    guard = UserTurnGuard(policy="reject", wait_timeout=0.05)
+    release = threading.Event()
+    turn = threading.Thread(target=guard.run, args=(1, lambda: release.wait(5)))
+    turn.start()
+    time.sleep(0.02)
+
+    with pytest.raises(TurnRejectedError):
+        with guard.hold(1):
+            pass
+    ran = []
+    with guard.hold(1, force=True):
+        ran.append(True)
+    release.set()
+    turn.join(5)
+
+    assert ran == [True]
+    with guard.hold(1):  # the forced hold left the lock to the turn that owned it
+        pass
+    assert guard.stats()["active_users"] == 0
+
+
+def test_logout_and_new_chat_while_a_turn_is_stuck(monkeypatch):
+    guard = UserTurnGuard(policy="queue", wait_timeout=0.05)
+    sessions = SessionStore()
+    sessions.put(1, UserSession(7, chat_session=object()))
+    release = threading.Event()
+    monkeypatch.setattr(api_connection, "turn_guard", guard)
+    monkeypatch.setattr(api_connection, "sessions", sessions)
+    monkeypatch.setattr(api_connection, "create_new_chat_thread", lambda user_id: 8)
+    monkeypatch.setattr(api_connection, "is_symptom_query", lambda text: True)
+    monkeypatch.setattr(api_connection, "build_symptom_prompt", lambda text, analysis=None: text)
+    monkeypatch.setattr(api_connection, "save_turn", lambda turn: True)
+    monkeypatch.setattr(api_connection, "send_message",
+                        lambda chat_session, parts: release.wait(5) and {"content": "late reply", "status": "complete"})
+    turn = threading.Thread(target=api_connection.get_gemini_response, args=(1, "still thinking?"))
+    turn.start()
+    time.sleep(0.02)
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_id"] = 1
+        sess["username"] = "patient"
+
+    try:
+        response = client.post("/new_chat")
+        assert response.status_code == 409
+        assert sessions.get(1).thread_id == 7
+
+        response = client.get("/logout")
+        assert response.status_code == 302
+        assert sessions.get(1) is None
+        with client.session_transaction() as sess:
+            assert "user_id" not in sess
+    finally:
+        release.set()
+        turn.join(5)
+
+    # The stuck turn finished after the logout: it must not bring the session back
+    assert sessions.get(1) is None and sessions.last_thread(1) is None
+    assert sessions.stats()["updates_dropped"] == 1
+
+
+@pytest.fixture
+def fake_chat(monkeypatch):
+    """Runs get_gemini_response end to end with Gemini and the DB replaced by fast fakes."""
+    thread_ids = iter(range(100, 10000))
+    monkeypatch.setattr(api_connection, "sessions", SessionStore())
+    monkeypatch.setattr(api_connection, "turn_guard", UserTurnGuard(policy="queue"))
+    monkeypatch.setattr(api_connection, "create_new_chat_thread", lambda user_id: next(thread_ids))
+    monkeypatch.setattr(api_connection, "create_chat_session", lambda history=None: object())
+    monkeypatch.setattr(api_connection, "is_symptom_query", lambda text: True)
+    monkeypatch.setattr(api_connection, "build_symptom_prompt", lambda text, analysis=None: text)
+    monkeypatch.setattr(api_connection, "save_turn", lambda turn: True)
+
+    def send_message(chat_session, parts):
+        time.sleep(0.01)
+        return {"content": f"reply to {parts[0]}", "status": "complete"}
+
+    monkeypatch.setattr(api_connection, "send_message", send_message)
+
+
+def test_concurrent_chat_turns_keep_history_in_order(fake_chat):
+    users, per_user = 4, 6
+
+    def turn(i):
+        user_id = i % users
+        return api_connection.get_gemini_response(user_id, f"u{user_id} message {i}")
+
+    results, errors = _fire(users * per_user, turn)
+    assert not errors
+
+    for user_id in range(users):
+        history = api_connection.get_history(user_id)
+        assert len(history) == per_user * 2
+        # Every user message is immediately followed by the reply to that same message
+        for question, answer in zip(history[::2], history[1::2]):
+            assert question["role"] == "user" and answer["role"] == "assistant"
+            assert answer["content"] == f"reply to {question['content']}"
+        assert len({message["thread_id"] for message in history}) == 1
@@ -0,0 +1,143 @@
+# test_upload_route.py
+"""
+Tests that history references uploads by URL and that the upload route supports HTTP
+caching: ETag / 304 revalidation, Cache-Control and Range requests.
+"""
+
+import io
+import os
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+import app as app_module
+import api_connection
+from api_connection import format_db_record_for_session
+from upload_store import UploadStore
+from user_db_operations import HistoryRecord
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, "UPLOAD_FOLDER", str(tmp_path))
+    monkeypatch.setattr(app_module, "upload_store", UploadStore(str(tmp_path)))
+    (tmp_path / "user_1_scan.png").write_bytes(bytes(range(256)) * 40)
+    app_module.app.config["TESTING"] = True
+    with app_module.app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess["user_id"] = 1
+            sess["username"] = "patient"
+        yield client
+
+
+def test_history_record_references_image_by_url():
+    record = HistoryRecord(7, 3, "user", "see photo", "user_1_scan.png", "2025-01-01 10:00:00")
+    image = format_db_record_for_session(record)["image"]
+    assert image == {"url": "/static/uploads/user_1_scan.png", "thumb_url": "/static/uploads/user_1_scan.png.thumb.webp",
+                     "mime_type": "image/png", "filename": "user_1_scan.png"}
+
+
+def test_etag_cache_control_and_304(client):
+    response = client.get("/static/uploads/user_1_scan.png")
+    assert response.status_code == 200 and len(response.data) == 10240
+    etag = response.headers["ETag"]
+    assert etag and not etag.startswith("W/")
+    assert "private" in response.headers["Cache-Control"] and "max-age=" in response.headers["Cache-Control"]
+    assert "public" not in response.headers["Cache-Control"]
+
+    revalidated = client.get("/static/uploads/user_1_scan.png", headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304 and revalidated.data == b""
+
+
+def test_range_request(client):
+    response = client.get("/static/uploads/user_1_scan.png", headers={"Range": "bytes=256-511"})
+    assert response.status_code == 206
+    assert response.data == bytes(range(256))
+    assert response.headers["Content-Range"] == "bytes 256-511/10240"
+
+
+def test_requires_login(client):
+    with client.session_transaction() as sess:
+        sess.clear()
+    assert client.get("/static/uploads/user_1_scan.png").status_code == 401
+
+
+def test_thumbnail_is_created_on_first_request(client, tmp_path):
+    Image.new("RGB", (900, 600), (40, 90, 160)).save(tmp_path / "user_1_old.jpg")
+    response = client.get("/static/uploads/user_1_old.jpg.thumb.webp")
+    assert response.status_code == 200 and response.mimetype == "image/webp"
+    assert (tmp_path / "user_1_old.jpg.thumb.webp").exists()
+
+
+def test_upload_that_is_not_an_image_is_rejected(client, tmp_path):
+    response = client.post("/chat", data={"query": "", "image": (io.BytesIO(b"not an image"), "scan.png")},
+                           content_type="multipart/form-data")
+    assert response.status_code == 400
+    # The blob stays (another request may reference it); no derivatives were written for it
+    stored = [f for _, _, files in os.walk(tmp_path) for f in files if f != "user_1_scan.png"]
+    assert len(stored) == 1 and stored[0].endswith(".png")
+
+
+def _png_bytes(color):
+    buffer = io.BytesIO()
+    Image.new("RGB", (320, 240), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_identical_uploads_are_stored_once_and_served_immutable(client, tmp_path, monkeypatch):
+    seen = []
+    monkeypatch.setattr(app_module, "get_gemini_response",
+                        lambda user_id, query, image_filename=None, image_context=None:
+                        seen.append(image_filename) or {"content": "ok"})
+    ingests = []
+    real_ingest = api_connection.ingest_upload
+    monkeypatch.setattr(api_connection, "ingest_upload", lambda path, **kw: ingests.append(path) or real_ingest(path, **kw))
+
+    data = _png_bytes((10, 120, 200))
+    for name in ("first.png", "again.PNG"):
+        response = client.post("/chat", data={"query": "what is this?", "image": (io.BytesIO(data), name)},
+                               content_type="multipart/form-data")
+        assert response.status_code == 200
+    assert seen[0] == seen[1] and seen[0].count("/") == 2 and seen[0].endswith(".png")
+    assert len(ingests) == 1  # the duplicate reused the stored derivatives
+    assert app_module.upload_store.stats()["deduplicated"] == 1
+
+    blob = client.get("/static/uploads/" + seen[0])
+    assert blob.data == data
+    assert "immutable" in blob.headers["Cache-Control"] and "max-age=31536000" in blob.headers["Cache-Control"]
+    thumb = client.get("/static/uploads/" + seen[0] + ".thumb.webp")
+    assert thumb.status_code == 200 and "immutable" in thumb.headers["Cache-Control"]
+    # Legacy flat names still revalidate
+    assert "immutable" not in client.get("/static/uploads/user_1_scan.png").headers["Cache-Control"]
+
+
+def test_concurrent_identical_uploads_ingest_once(client, tmp_path, monkeypatch):
+    ingests = []
+    real_ingest = api_connection.ingest_upload
+
+    def slow_ingest(path, **kw):
+        ingests.append(path)
+        time.sleep(0.2)  # hold the first ingest open while the others arrive
+        return real_ingest(path, **kw)
+
+    monkeypatch.setattr(api_connection, "ingest_upload", slow_ingest)
+    key, _ = app_module.upload_store.save_stream(io.BytesIO(_png_bytes((200, 30, 30))), "double.png")
+    path = app_module.upload_store.path_for(key)
+    contexts = []
+    threads = [threading.Thread(target=lambda: contexts.append(api_connection.prepare_uploaded_image(path, key)))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(ingests) == 1
+    assert len(contexts) == 4 and all(context is not None for context in contexts)
+    assert os.path.exists(path)
+
+
+def test_upload_paths_cannot_escape_the_folder(client):
+    assert client.get("/static/uploads/../app.py").status_code == 404
+    assert client.get("/static/uploads/%2e%2e/app.py.thumb.webp").status_code == 404
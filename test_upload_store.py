@@ -0,0 +1,69 @@
+# test_upload_store.py
+"""
+Tests for the content-addressed upload store: streaming hash, sharded layout, deduplication,
+and the migration of legacy flat uploads.
+"""
+
+import hashlib
+import io
+import os
+
+import pytest
+
+import user_db_operations as ops
+from upload_store import UploadStore, is_blob_key, is_content_addressed, migrate_legacy_uploads
+
+
+class _TrickleStream(io.BytesIO):
+    """Returns at most 1000 bytes per read, like a network stream."""
+
+    def read(self, size=-1):
+        return super().read(min(size, 1000) if size and size > 0 else 1000)
+
+
+def test_identical_content_is_stored_once(tmp_path):
+    store = UploadStore(str(tmp_path))
+    data = os.urandom(150000)
+    digest = hashlib.sha256(data).hexdigest()
+
+    key, duplicate = store.save_stream(_TrickleStream(data), "scan.JPEG")
+    assert key == f"{digest[:2]}/{digest[2:4]}/{digest}.jpg" and not duplicate and is_blob_key(key)
+    with open(store.path_for(key), "rb") as f:
+        assert f.read() == data
+
+    again, duplicate = store.save_stream(io.BytesIO(data), "copy.jpg")
+    assert again == key and duplicate
+    other, duplicate = store.save_stream(io.BytesIO(data[:-1]), "scan.jpg")
+    assert other != key and not duplicate
+
+    files = [f for _, _, names in os.walk(tmp_path) for f in names]
+    assert len(files) == 2  # no temporary files left behind
+    assert store.stats() == {"stored": 2, "deduplicated": 1, "bytes_stored": 2 * len(data) - 1, "bytes_saved": len(data)}
+
+
+def test_content_addressed_names():
+    key = "ab/cd/" + "ab" * 32 + ".png"
+    assert is_blob_key(key) and is_content_addressed(key + ".thumb.webp")
+    assert not is_blob_key(key + ".thumb.webp")
+    assert not is_content_addressed("user_6_20260131150219.jpg")
+    assert not is_blob_key("../cd/" + "ab" * 32 + ".png")
+
+
+def test_migration_moves_legacy_uploads_and_repoints_posts(sqlite_db, tmp_path):
+    assert ops.register_user("patient", "migrate@example.com", "hash")
+    user_id = ops.get_user_by_email("migrate@example.com")["id"]
+    thread_id = ops.create_new_chat_thread(user_id)
+
+    data = b"\x89PNG same bytes uploaded twice"
+    for name in ("user_1_20250101000000.png", "user_1_20250102000000.png"):
+        (tmp_path / name).write_bytes(data)
+        assert ops.persist_turn(user_id, thread_id, "look", image_filename=name, assistant_text="ok")
+    (tmp_path / "user_1_20250101000000.png.thumb.webp").write_bytes(b"old thumbnail")
+
+    store = UploadStore(str(tmp_path))
+    assert migrate_legacy_uploads(store) == {"files": 2, "duplicates": 1, "posts": 2}
+
+    keys = {r.image_filename for r in ops.get_history_by_user_id(user_id, thread_id) if r.image_filename}
+    assert len(keys) == 1 and is_blob_key(keys.pop())
+    files = [f for _, _, names in os.walk(tmp_path) for f in names]
+    assert len(files) == 1 and files[0].endswith(".png")
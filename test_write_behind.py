@@ -0,0 +1,146 @@
+# test_write_behind.py
+"""
+Tests for the write-behind turn queue: batching, backpressure and spool replay.
+"""
+
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+
+from write_behind import WriteBehindWriter
+
+
+def make_turn(i):
+    return {"user_id": 1, "thread_id": 1, "user_text": f"message {i}", "image_filename": None,
+            "assistant_text": f"reply {i}", "structured": None, "title": None}
+
+
+def test_turns_are_written_in_batches():
+    batches = []
+    writer = WriteBehindWriter(lambda turns: batches.append(list(turns)) or True,
+                               batch_size=10, flush_interval=0.2)
+    writer.start()
+    for i in range(25):
+        assert writer.submit(make_turn(i))
+    assert writer.flush(timeout=5)
+    writer.shutdown()
+
+    written = [turn["user_text"] for batch in batches for turn in batch]
+    assert written == [f"message {i}" for i in range(25)]
+    assert len(batches) < 25
+    stats = writer.stats()
+    assert stats["written"] == 25 and stats["queue_depth"] == 0
+
+
+def test_full_queue_falls_back_to_synchronous_write():
+    release = threading.Event()
+    written = []
+
+    def slow_write(turns):
+        if threading.current_thread().name == "write-behind":
+            release.wait(5)
+        written.extend(turns)
+        return True
+
+    writer = WriteBehindWriter(slow_write, max_queue=1, batch_size=1, flush_interval=0, enqueue_timeout=0.05)
+    writer.start()
+    writer.submit(make_turn(0))  # picked up by the (blocked) writer thread
+    while writer.stats()["queue_depth"]:
+        time.sleep(0.01)
+    writer.submit(make_turn(1))  # fills the queue
+    queued = writer.submit(make_turn(2))  # queue full -> written on this thread
+    assert queued is False
+    assert [t["user_text"] for t in written] == ["message 2"]
+    release.set()
+    writer.shutdown()
+    assert writer.stats()["sync_fallbacks"] == 1
+    assert len(written) == 3
+
+
+def test_uncommitted_turns_are_replayed_from_spool():
+    spool = os.path.join(tempfile.mkdtemp(), "turns.jsonl")
+
+    # First process: the database is down, so nothing gets committed
+    down = WriteBehindWriter(lambda turns: False, spool_path=spool, max_retries=0, flush_interval=0)
+    down.start()
+    for i in range(3):
+        down.submit(make_turn(i))
+    down.shutdown()
+
+    # Next start: spooled turns are replayed into the (now healthy) database
+    written = []
+    writer = WriteBehindWriter(lambda turns: written.extend(turns) or True, spool_path=spool, flush_interval=0)
+    writer.start()
+    assert writer.flush(timeout=5)
+    writer.shutdown()
+    assert [t["user_text"] for t in written] == ["message 0", "message 1", "message 2"]
+    assert writer.stats()["replayed"] == 3
+    # Everything committed: this process's spool is compacted to nothing, the old one is gone
+    assert os.path.getsize(writer.spool_file_path) == 0
+    assert sorted(os.listdir(os.path.dirname(spool))) == sorted(["turns.jsonl.lock", os.path.basename(writer.spool_file_path)])
+
+
+def _spool_lines(path, pid, turns, committed=()):
+    with open(path, "w", encoding="utf-8") as f:
+        for seq, turn in enumerate(turns, 1):
+            f.write(json.dumps({"pid": pid, "seq": seq, "turn": turn}) + "\n")
+        if committed:
+            f.write(json.dumps({"committed": [[pid, seq] for seq in committed]}) + "\n")
+
+
+def test_starting_worker_replays_only_spools_of_exited_workers():
+    spool = os.path.join(tempfile.mkdtemp(), "turns.jsonl")
+    # A worker that exited with turn 1 committed and turn 2 not
+    _spool_lines(f"{spool}.101", 101, [make_turn(1), make_turn(2)], committed=[1])
+    # A worker that is still running: its spool is locked and must not be touched
+    _spool_lines(f"{spool}.202", 202, [make_turn(3)])
+    running = open(f"{spool}.202", "a")
+    fcntl.flock(running.fileno(), fcntl.LOCK_EX)
+    try:
+        written = []
+        writer = WriteBehindWriter(lambda turns: written.extend(turns) or True, spool_path=spool, flush_interval=0)
+        writer.start()
+        assert writer.flush(timeout=5)
+        writer.shutdown()
+    finally:
+        running.close()
+
+    assert [t["user_text"] for t in written] == ["message 2"]
+    assert not os.path.exists(f"{spool}.101")
+    with open(f"{spool}.202") as f:
+        assert len(f.readlines()) == 1
+
+
+def test_one_bad_turn_does_not_sink_its_batch():
+    written = []
+
+    def write(turns):
+        if any(turn["thread_id"] == 99 for turn in turns):  # e.g. the thread was deleted meanwhile
+            raise RuntimeError("FOREIGN KEY constraint failed")
+        written.extend(turns)
+        return True
+
+    writer = WriteBehindWriter(write, batch_size=10, flush_interval=0.2, max_retries=1)
+    writer.start()
+    for i in range(6):
+        turn = make_turn(i)
+        turn["thread_id"] = 99 if i == 3 else 1
+        writer.submit(turn)
+    assert writer.flush(timeout=10)
+    writer.shutdown()
+
+    assert [t["user_text"] for t in written] == [f"message {i}" for i in range(6) if i != 3]
+    stats = writer.stats()
+    assert stats["written"] == 5 and stats["failed"] == 1 and stats["rejected"] == 1
+
+
+if __name__ == "__main__":
+    test_turns_are_written_in_batches()
+    test_full_queue_falls_back_to_synchronous_write()
+    test_uncommitted_turns_are_replayed_from_spool()
+    test_one_bad_turn_does_not_sink_its_batch()
+    test_starting_worker_replays_only_spools_of_exited_workers()
+    print("All write-behind tests: PASSED")
@@ -0,0 +1,185 @@
+# turn_guard.py
+"""
+Per-user serialization of chat turns.
+
+A Gemini ChatSession is not safe for concurrent send_message calls, and a turn mutates the
+user's in-memory history, so two requests from the same user (double-submit, two tabs)
+must not run at the same time. Different users must never wait on each other.
+
+UserTurnGuard keeps one lock per *active* user. The user -> lock registry is split into
+lock stripes so registering a user only briefly locks 1/N of the registry, and entries
+are dropped as soon as nobody holds or waits on them, so memory tracks in-flight users only.
+
+Policies for a turn that arrives while another is running for the same user:
+- "queue": wait for it (up to `wait_timeout`), then run.
+- "coalesce": if it is the same request (same fingerprint), wait and return its result
+  instead of calling Gemini twice; a different request queues.
+- "reject": fail immediately with TurnRejectedError (the /chat route answers 409).
+
+Session changes outside a turn (thread switch, new chat, logout) use hold(), which always
+queues; logout and thread deletion pass force=True so they never fail on a stuck turn.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+POLICIES = ("queue", "coalesce", "reject")
+
+
+class TurnRejectedError(Exception):
+    """Raised when a user's turn cannot run because another one is still in progress."""
+
+
+class _InFlight:
+    __slots__ = ("fingerprint", "done", "result", "failed")
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+        self.result = None
+        self.failed = False
+
+
+class _UserSlot:
+    __slots__ = ("lock", "users", "inflight")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = 0  # holders + waiters; the slot is dropped when this reaches 0
+        self.inflight = None
+
+
+class UserTurnGuard:
+    """
+    Args:
+        stripes (int): number of registry stripes
+        policy (str): "queue", "coalesce" or "reject"
+        wait_timeout (float): seconds a queued turn waits before TurnRejectedError
+    """
+
+    def __init__(self, stripes=64, policy="queue", wait_timeout=60.0):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown turn policy '{policy}' (expected one of {', '.join(POLICIES)})")
+        self.policy = policy
+        self.wait_timeout = wait_timeout
+        self._stripes = [(threading.Lock(), {}) for _ in range(max(1, stripes))]
+        self._stats_lock = threading.Lock()
+        self._stats = {"turns": 0, "queued": 0, "coalesced": 0, "rejected": 0, "timeouts": 0, "wait_time_ms": 0.0}
+
+    def run(self, user_id, fn, fingerprint=None):
+        """
+        Runs `fn()` as a turn for `user_id` under the configured policy.
+
+        Args:
+            fingerprint: hashable identity of the request, used by the "coalesce" policy
+
+        Returns:
+            Whatever `fn()` returns (or, when coalesced, what the identical in-flight turn returned)
+        """
+        slot = self._checkout(user_id)
+        try:
+            if self.policy == "coalesce" and fingerprint is not None:
+                inflight = slot.inflight
+                if inflight is not None and inflight.fingerprint == fingerprint:
+                    if inflight.done.wait(self.wait_timeout) and not inflight.failed:
+                        self._bump("coalesced")
+                        return inflight.result
+                    # The original failed or is stuck: run this one normally
+
+            self._acquire(slot, blocking=self.policy != "reject")
+            inflight = _InFlight(fingerprint)
+            slot.inflight = inflight
+            try:
+                inflight.result = fn()
+                return inflight.result
+            except BaseException:
+                inflight.failed = True
+                raise
+            finally:
+                slot.inflight = None
+                inflight.done.set()
+                slot.lock.release()
+        finally:
+            self._checkin(user_id, slot)
+
+    @contextmanager
+    def hold(self, user_id, force=False):
+        """
+        Serializes a non-turn session change (thread switch, new chat) with the user's turns.
+
+        Waits whatever the policy, up to `wait_timeout`; then raises TurnRejectedError, or with
+        force=True runs the change without the lock (logout, a deleted thread: changes that must
+        happen even while a turn is stuck).
+        """
+        slot = self._checkout(user_id)
+        try:
+            try:
+                self._acquire(slot, blocking=True)
+                acquired = True
+            except TurnRejectedError:
+                if not force:
+                    raise
+                acquired = False
+            try:
+                yield
+            finally:
+                if acquired:
+                    slot.lock.release()
+        finally:
+            self._checkin(user_id, slot)
+
+    def stats(self):
+        """Returns turn counters plus the number of users with a turn running or waiting."""
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        snapshot["wait_time_ms"] = round(snapshot["wait_time_ms"], 2)
+        active = 0
+        for stripe_lock, slots in self._stripes:
+            with stripe_lock:
+                active += len(slots)
+        snapshot["active_users"] = active
+        return snapshot
+
+    def _acquire(self, slot, blocking):
+        if slot.lock.acquire(blocking=False):
+            self._bump("turns")
+            return
+        if not blocking:
+            self._bump("rejected")
+            raise TurnRejectedError("Another request for this user is still in progress.")
+        started = time.perf_counter()
+        acquired = slot.lock.acquire(timeout=self.wait_timeout)
+        waited_ms = (time.perf_counter() - started) * 1000
+        with self._stats_lock:
+            self._stats["wait_time_ms"] += waited_ms
+            if acquired:
+                self._stats["turns"] += 1
+                self._stats["queued"] += 1
+            else:
+                self._stats["timeouts"] += 1
+        if not acquired:
+            raise TurnRejectedError(f"Timed out after {self.wait_timeout:.0f}s waiting for the previous request.")
+
+    def _stripe(self, user_id):
+        return self._stripes[hash(user_id) % len(self._stripes)]
+
+    def _checkout(self, user_id):
+        stripe_lock, slots = self._stripe(user_id)
+        with stripe_lock:
+            slot = slots.get(user_id)
+            if slot is None:
+                slot = slots[user_id] = _UserSlot()
+            slot.users += 1
+            return slot
+
+    def _checkin(self, user_id, slot):
+        stripe_lock, slots = self._stripe(user_id)
+        with stripe_lock:
+            slot.users -= 1
+            if slot.users == 0:
+                del slots[user_id]
+
+    def _bump(self, counter):
+        with self._stats_lock:
+            self._stats[counter] += 1
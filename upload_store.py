@@ -0,0 +1,164 @@
+# upload_store.py
+"""
+Content-addressed store for uploaded images.
+
+Each upload is hashed (SHA-256) while it streams to a temporary file and then stored once,
+under a sharded path derived from its digest:
+
+    uploads/3f/a2/3fa2c9...e1.jpg
+
+The relative path ("3f/a2/3fa2c9...e1.jpg") is the blob key. It is what posts.image_filename
+references, what the /static/uploads/ route serves, and what image_ingest derives its
+thumbnail / Gemini part / model inputs from, so byte-identical uploads share one file and
+one set of derivatives. Two levels of 256 shards keep directories small at any scale.
+
+Blobs are never modified in place (new content means a new key), which is why the upload
+route can mark them immutable. Nothing on the request path deletes them, not even an upload
+that turns out not to be an image: a blob may be referenced by posts of several users, and a
+concurrent upload of the same bytes may already point at it. Deleting a thread only removes
+its posts; unreferenced blobs are left for an offline cleanup.
+
+Run `python upload_store.py --migrate` (with the app stopped, since live sessions still hold
+the old names) to move legacy `user_<id>_<timestamp><ext>` uploads into the store and
+repoint their posts.
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import threading
+
+from image_ingest import GEMINI_SUFFIXES, MODEL_SUFFIX, THUMB_SUFFIX
+from user_db_operations import rename_image_references
+
+CHUNK_SIZE = 64 * 1024
+BLOB_KEY_RE = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.[a-z0-9]+$")
+BLOB_PATH_RE = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.")  # a blob or one of its derivatives
+EXTENSION_ALIASES = {".jpeg": ".jpg"}
+
+
+def is_blob_key(filename):
+    return bool(filename) and bool(BLOB_KEY_RE.match(filename))
+
+
+def is_content_addressed(filename):
+    """True for a blob key or a derivative of one (both only ever change by changing name)."""
+    return bool(filename) and bool(BLOB_PATH_RE.match(filename))
+
+
+def normalize_extension(filename):
+    ext = os.path.splitext(filename)[1].lower()
+    return EXTENSION_ALIASES.get(ext, ext)
+
+
+class UploadStore:
+    """
+    Args:
+        root (str): upload folder the blob keys are relative to
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._stats = {"stored": 0, "deduplicated": 0, "bytes_stored": 0, "bytes_saved": 0}
+
+    def path_for(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def save_stream(self, stream, original_filename):
+        """
+        Hashes a file-like object while copying it to disk and stores it under its digest.
+
+        Args:
+            stream: readable binary file object (e.g. werkzeug FileStorage.stream)
+            original_filename (str): client filename, only used for the extension
+
+        Returns:
+            tuple: (blob key, True if the content was already stored)
+        """
+        ext = normalize_extension(original_filename)
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = os.path.join(self.root, f".incoming-{os.getpid()}-{threading.get_ident()}")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, "wb") as out:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            return self._commit(tmp_path, digest.hexdigest(), ext, size)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def save_file(self, path):
+        """Stores an existing file (used by the migration); the source is left in place."""
+        with open(path, "rb") as f:
+            return self.save_stream(f, path)
+
+    def _commit(self, tmp_path, hexdigest, ext, size):
+        key = f"{hexdigest[:2]}/{hexdigest[2:4]}/{hexdigest}{ext}"
+        final_path = self.path_for(key)
+        with self._lock:
+            if os.path.exists(final_path):
+                self._stats["deduplicated"] += 1
+                self._stats["bytes_saved"] += size
+                return key, True
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            # Atomic: a concurrent identical upload either sees the complete blob or replaces it with equal bytes
+            os.replace(tmp_path, final_path)
+            self._stats["stored"] += 1
+            self._stats["bytes_stored"] += size
+        return key, False
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+def migrate_legacy_uploads(store, dry_run=False):
+    """
+    Moves flat legacy uploads into the store and repoints posts.image_filename to their blob keys.
+    Derivatives of legacy files (thumbnails etc.) are dropped; they are rebuilt for the blob.
+
+    Returns:
+        dict: counts of files moved, duplicates found and posts updated
+    """
+    result = {"files": 0, "duplicates": 0, "posts": 0}
+    for name in sorted(os.listdir(store.root)):
+        path = os.path.join(store.root, name)
+        if not os.path.isfile(path) or name.startswith(".") or name.count(".") != 1:
+            continue
+        if dry_run:
+            result["files"] += 1
+            continue
+        key, duplicate = store.save_file(path)
+        updated = rename_image_references(name, key)
+        if updated is None:
+            print(f"Could not repoint posts for {name}; leaving the file in place.")
+            continue
+        result["files"] += 1
+        result["duplicates"] += int(duplicate)
+        result["posts"] += updated
+        for suffix in ("", THUMB_SUFFIX, MODEL_SUFFIX, *GEMINI_SUFFIXES):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--root", default=os.getenv("UPLOAD_FOLDER", "uploads"))
+    parser.add_argument("--migrate", action="store_true", help="move legacy uploads into the store")
+    parser.add_argument("--dry-run", action="store_true", help="only count the legacy uploads")
+    args = parser.parse_args()
+    if not args.migrate:
+        parser.error("nothing to do (pass --migrate)")
+    upload_store = UploadStore(args.root)
+    print(migrate_legacy_uploads(upload_store, dry_run=args.dry_run))
+    print(upload_store.stats())
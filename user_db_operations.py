@@ -2,8 +2,64 @@
 # user_db_operations.py
 
 from db_manager import get_db_connection
-import mysql.connector
+from storage_backends import DB_ERRORS
 from datetime import datetime
+from collections import namedtuple
+from cache import TTLCache
+from config import Config
+
+CURSOR_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+# --- Keyset Pagination Cursors ---
+def encode_cursor(created_at, row_id):
+    """Builds an opaque page cursor from a row's (created_at, id) sort key."""
+    if isinstance(created_at, datetime):
+        created_at = created_at.strftime(CURSOR_TIME_FORMAT)
+    else:
+        created_at = str(created_at).replace(' ', 'T')
+    return f"{created_at}_{row_id}"
+
+def decode_cursor(cursor):
+    """
+    Parses a cursor from encode_cursor into (created_at, id); None if missing.
+
+    Raises:
+        ValueError: if the cursor is malformed (a first page in its place would repeat rows
+            the client already has)
+    """
+    if not cursor:
+        return None
+    try:
+        created_at, row_id = cursor.rsplit('_', 1)
+        return datetime.strptime(created_at, CURSOR_TIME_FORMAT), int(row_id)
+    except ValueError:
+        raise ValueError(f"Invalid page cursor: {cursor!r}")
+
+def next_page_cursor(records, limit, oldest_first=False):
+    """Returns the cursor for the page after `records`, or None when this was the last page."""
+    if not limit or len(records) < limit:
+        return None
+    last = records[0] if oldest_first else records[-1]
+    if isinstance(last, HistoryRecord):
+        return encode_cursor(last.created_at, last.id)
+    return encode_cursor(last['created_at'], last['id'])
+
+# --- Read-Through Caches ---
+# Per-process; writers below invalidate explicitly and the TTL bounds staleness
+# when another worker changed the row.
+user_cache = TTLCache(Config.CACHE_MAX_ENTRIES, Config.CACHE_TTL, name="users")
+thread_cache = TTLCache(Config.CACHE_MAX_ENTRIES, Config.CACHE_TTL, name="threads")
+thread_list_cache = TTLCache(Config.CACHE_MAX_ENTRIES, Config.CACHE_TTL, name="thread_lists")
+
+def _invalidate_threads(user_id, thread_id=None):
+    """Drops a user's cached thread lists (and one thread's ownership entry)."""
+    if thread_id is not None:
+        thread_cache.invalidate((user_id, thread_id))
+    thread_list_cache.invalidate_where(lambda key: key[0] == user_id)
+
+def get_cache_stats():
+    """Returns hit/miss statistics for each read-through cache."""
+    return {cache.name: cache.stats() for cache in (user_cache, thread_cache, thread_list_cache)}
 
 # --- User Management Functions ---
 def register_user(username, email, password_hash):
@@ -14,8 +70,9 @@ def register_user(username, email, password_hash):
     try:
         cursor.execute(query, (username, email, password_hash))
         conn.commit()
+        user_cache.invalidate(("email", email))
         return True
-    except mysql.connector.Error as err:
+    except DB_ERRORS as err:
         print(f"Registration Error: {err}")
         return False
     finally:
@@ -23,6 +80,9 @@ def register_user(username, email, password_hash):
         conn.close()
 
 def get_user_by_email(email):
+    return user_cache.get_or_load(("email", email), lambda: _load_user_by_email(email))
+
+def _load_user_by_email(email):
     conn = get_db_connection()
     if conn is None: return None
     cursor = conn.cursor(dictionary=True) 
@@ -35,6 +95,9 @@ def get_user_by_email(email):
         conn.close()
         
 def get_user_by_id(user_id):
+    return user_cache.get_or_load(("id", user_id), lambda: _load_user_by_id(user_id))
+
+def _load_user_by_id(user_id):
     conn = get_db_connection()
     if conn is None: return None
     cursor = conn.cursor(dictionary=True) 
@@ -60,23 +123,48 @@ def create_new_chat_thread(user_id, title=None):
     try:
         cursor.execute(query, (user_id, title))
         conn.commit()
+        _invalidate_threads(user_id)
         # Return the ID of the newly inserted row
         return cursor.lastrowid
-    except mysql.connector.Error as err:
+    except DB_ERRORS as err:
         print(f"Create Thread Error: {err}")
         return None
     finally:
         cursor.close()
         conn.close()
         
-def get_user_threads(user_id):
-    """Retrieves all chat threads for a given user."""
+def get_user_threads(user_id, before=None, limit=None):
+    """
+    Retrieves a user's chat threads, newest first.
+
+    Args:
+        before (str, optional): Cursor from encode_cursor; only threads older than it are returned
+        limit (int, optional): Page size; all threads when omitted
+    """
+    if before is None:
+        # The first page is what every sidebar render asks for
+        threads = thread_list_cache.get_or_load((user_id, limit), lambda: _load_user_threads(user_id, None, limit))
+    else:
+        threads = _load_user_threads(user_id, before, limit)
+    return threads if threads is not None else []
+
+def _load_user_threads(user_id, before, limit):
+    # None (not []) without a connection, so the cache never stores an outage as an empty sidebar
     conn = get_db_connection()
-    if conn is None: return []
+    if conn is None: return None
     cursor = conn.cursor(dictionary=True) 
-    query = "SELECT id, title, created_at FROM chat_threads WHERE user_id = %s ORDER BY created_at DESC"
+    query = "SELECT id, title, created_at FROM chat_threads WHERE user_id = %s"
+    params = [user_id]
+    keyset = decode_cursor(before)
+    if keyset:
+        query += " AND (created_at < %s OR (created_at = %s AND id < %s))"
+        params += [keyset[0], keyset[0], keyset[1]]
+    query += " ORDER BY created_at DESC, id DESC"
+    if limit:
+        query += " LIMIT %s"
+        params.append(int(limit))
     try:
-        cursor.execute(query, (user_id,))
+        cursor.execute(query, params)
         return cursor.fetchall()
     finally:
         cursor.close()
@@ -84,6 +172,9 @@ def get_user_threads(user_id):
 
 def get_thread_by_id(user_id, thread_id):
     """Fetch a single thread ensuring ownership."""
+    return thread_cache.get_or_load((user_id, thread_id), lambda: _load_thread_by_id(user_id, thread_id))
+
+def _load_thread_by_id(user_id, thread_id):
     conn = get_db_connection()
     if conn is None: return None
     cursor = conn.cursor(dictionary=True)
@@ -104,8 +195,9 @@ def delete_thread(user_id, thread_id):
     try:
         cursor.execute(query, (thread_id, user_id))
         conn.commit()
+        _invalidate_threads(user_id, thread_id)
         return cursor.rowcount > 0
-    except mysql.connector.Error as err:
+    except DB_ERRORS as err:
         print(f"Delete Thread Error: {err}")
         return False
     finally:
@@ -121,8 +213,9 @@ def update_thread_title(thread_id, user_id, new_title):
     try:
         cursor.execute(query, (new_title, thread_id, user_id))
         conn.commit()
+        _invalidate_threads(user_id, thread_id)
         return cursor.rowcount > 0
-    except mysql.connector.Error as err:
+    except DB_ERRORS as err:
         print(f"Update Thread Title Error: {err}")
         return False
     finally:
@@ -131,6 +224,11 @@ def update_thread_title(thread_id, user_id, new_title):
 
 
 # --- Post/History Management ---
+# One chat message as loaded for display and Gemini replay. A tuple per row instead of
+# a dict keeps long threads cheap to materialize; only the columns below are selected.
+HistoryRecord = namedtuple('HistoryRecord', ['id', 'thread_id', 'role', 'text_content', 'image_filename', 'created_at'])
+HISTORY_COLUMNS = ", ".join(HistoryRecord._fields)
+
 def save_post(user_id, thread_id, text_content, image_filename=None, role='user'):
     """Saves a single post (user or assistant) to the 'posts' table with the thread ID."""
     conn = get_db_connection()
@@ -146,43 +244,173 @@ def save_post(user_id, thread_id, text_content, image_filename=None, role='user'
         cursor.execute(query, (user_id, thread_id, role, text_content, image_filename))
         conn.commit()
         return True
-    except mysql.connector.Error as err:
+    except DB_ERRORS as err:
         print(f"Save Post Error: {err}")
         return False
     finally:
         cursor.close()
         conn.close()
         
+def rename_image_references(old_filename, new_filename):
+    """
+    Repoints every post that references an uploaded image to a new filename.
+
+    Returns:
+        int or None: number of posts updated, None on a database error
+    """
+    conn = get_db_connection()
+    if conn is None: return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("UPDATE posts SET image_filename = %s WHERE image_filename = %s", (new_filename, old_filename))
+        conn.commit()
+        return cursor.rowcount
+    except DB_ERRORS as err:
+        print(f"Rename Image Reference Error: {err}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
 def save_assistant_post(user_id, thread_id, text_content, role='assistant'):
     """Saves an assistant's text response to the 'posts' table with the thread ID."""
     return save_post(user_id, thread_id, text_content, image_filename=None, role=role)
 
-def get_history_by_user_id(user_id, thread_id):
-    """Retrieves chat history for a given thread."""
+def get_history_by_user_id(user_id, thread_id, before=None, limit=None):
+    """
+    Retrieves chat history for a given thread in chronological order.
+
+    Returns:
+        list[HistoryRecord]: One record per post
+
+    Args:
+        before (str, optional): Cursor from encode_cursor; only posts older than it are returned
+        limit (int, optional): Return only the most recent `limit` posts (before the cursor)
+    """
     conn = get_db_connection()
     if conn is None: return []
 
-    cursor = conn.cursor(dictionary=True) 
+    cursor = conn.cursor()
     
-    query = """
-        SELECT * FROM posts 
+    query = f"""
+        SELECT {HISTORY_COLUMNS} FROM posts 
         WHERE user_id = %s AND thread_id = %s 
-        ORDER BY created_at ASC
     """
     params = [user_id, thread_id]
+    keyset = decode_cursor(before)
+    if keyset:
+        query += " AND (created_at < %s OR (created_at = %s AND id < %s))"
+        params += [keyset[0], keyset[0], keyset[1]]
+
+    if limit:
+        # Walk the index backwards from the cursor, then restore chronological order below
+        query += " ORDER BY created_at DESC, id DESC LIMIT %s"
+        params.append(int(limit))
+    else:
+        query += " ORDER BY created_at ASC, id ASC"
         
     history_records = []
     try:
         cursor.execute(query, params)
-        history_records = cursor.fetchall()
-    except mysql.connector.Error as err:
+        history_records = list(map(HistoryRecord._make, cursor.fetchall()))
+    except DB_ERRORS as err:
         print(f"Get History Error: {err}")
     finally:
         cursor.close()
         conn.close()
-        
+
+    if limit:
+        history_records.reverse()
+    return history_records
+
+def get_history_between(user_id, thread_id, after_id, before_id, limit):
+    """
+    Retrieves up to `limit` posts of a thread with after_id < id < before_id, oldest first.
+    Used by the context summarizer to walk the part of a thread that is not yet summarized.
+
+    Returns:
+        list[HistoryRecord]
+    """
+    conn = get_db_connection()
+    if conn is None: return []
+
+    cursor = conn.cursor()
+    history_records = []
+    try:
+        cursor.execute(
+            f"""
+            SELECT {HISTORY_COLUMNS} FROM posts
+            WHERE user_id = %s AND thread_id = %s AND id > %s AND id < %s
+            ORDER BY created_at ASC, id ASC LIMIT %s
+            """,
+            (user_id, thread_id, after_id, before_id, int(limit))
+        )
+        history_records = list(map(HistoryRecord._make, cursor.fetchall()))
+    except DB_ERRORS as err:
+        print(f"Get History Range Error: {err}")
+    finally:
+        cursor.close()
+        conn.close()
     return history_records
 
+# --- Thread Summaries (older turns folded out of the Gemini context) ---
+def get_thread_summary(user_id, thread_id):
+    """
+    Returns the stored summary of a thread's older messages.
+
+    Returns:
+        dict or None: {"summary", "covered_count", "last_post_id"}; last_post_id is the newest post folded in
+    """
+    conn = get_db_connection()
+    if conn is None: return None
+
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(
+            "SELECT summary, covered_count, last_post_id FROM thread_summaries WHERE user_id = %s AND thread_id = %s",
+            (user_id, thread_id)
+        )
+        return cursor.fetchone()
+    except DB_ERRORS as err:
+        print(f"Get Thread Summary Error: {err}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def save_thread_summary(user_id, thread_id, summary, covered_count, last_post_id):
+    """Creates or replaces a thread's summary. Returns True on success."""
+    conn = get_db_connection()
+    if conn is None: return False
+
+    cursor = conn.cursor()
+    try:
+        # UPDATE-then-INSERT instead of an upsert so the SQL is the same on MySQL and SQLite
+        cursor.execute(
+            """
+            UPDATE thread_summaries SET summary = %s, covered_count = %s, last_post_id = %s
+            WHERE user_id = %s AND thread_id = %s
+            """,
+            (summary, covered_count, last_post_id, user_id, thread_id)
+        )
+        if cursor.rowcount == 0:
+            cursor.execute(
+                """
+                INSERT INTO thread_summaries (thread_id, user_id, summary, covered_count, last_post_id)
+                VALUES (%s, %s, %s, %s, %s)
+                """,
+                (thread_id, user_id, summary, covered_count, last_post_id)
+            )
+        conn.commit()
+        return True
+    except DB_ERRORS as err:
+        print(f"Save Thread Summary Error: {err}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
 # --- Structured Response Management ---
 def save_structured_response(user_id, thread_id, query, disease=None, probability=None, severity=None, medication=None, other_diagnoses=None, conclusion=None):
     """Saves a structured response to the 'structured_responses' table."""
@@ -199,9 +427,97 @@ def save_structured_response(user_id, thread_id, query, disease=None, probabilit
         cursor.execute(query_sql, (user_id, thread_id, query, disease, probability, severity, medication, other_diagnoses, conclusion))
         conn.commit()
         return True
-    except mysql.connector.Error as err:
+    except DB_ERRORS as err:
         print(f"Save Structured Response Error: {err}")
         return False
     finally:
         cursor.close()
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+# --- Turn Persistence ---
+STRUCTURED_FIELDS = ('disease', 'probability', 'severity', 'medication', 'other_diagnoses', 'conclusion')
+
+def build_turn(user_id, thread_id, user_text, image_filename=None, assistant_text=None, structured=None, title=None):
+    """
+    Describes everything one chat turn writes to the database.
+
+    Args:
+        structured (dict, optional): Keys from STRUCTURED_FIELDS; saved with user_text as the query
+        title (str, optional): New thread title (set on the first message of a thread)
+
+    Returns:
+        dict: Turn record accepted by persist_turns
+    """
+    return {
+        "user_id": user_id,
+        "thread_id": thread_id,
+        "user_text": user_text,
+        "image_filename": image_filename,
+        "assistant_text": assistant_text,
+        "structured": structured,
+        "title": title,
+    }
+
+def persist_turns(turns):
+    """
+    Writes one or more chat turns in a single transaction.
+    Posts and structured responses for all turns go out as one multi-row INSERT each,
+    followed by any title updates and a single commit. On any error the whole batch is
+    rolled back, so a turn is never left half-written.
+
+    Returns:
+        bool: True if every row was committed
+    """
+    if not turns:
+        return True
+
+    post_rows = []
+    structured_rows = []
+    title_updates = []
+    for turn in turns:
+        user_id, thread_id = turn["user_id"], turn["thread_id"]
+        post_rows.append((user_id, thread_id, 'user', turn["user_text"], turn["image_filename"]))
+        if turn.get("assistant_text") is not None:
+            post_rows.append((user_id, thread_id, 'assistant', turn["assistant_text"], None))
+        if turn.get("structured"):
+            fields = turn["structured"]
+            structured_rows.append((user_id, thread_id, turn["user_text"]) + tuple(fields.get(name) for name in STRUCTURED_FIELDS))
+        if turn.get("title"):
+            title_updates.append((turn["title"], thread_id, user_id))
+
+    conn = get_db_connection()
+    if conn is None: return False
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute(
+            "INSERT INTO posts (user_id, thread_id, role, text_content, image_filename) VALUES "
+            + ", ".join(["(%s, %s, %s, %s, %s)"] * len(post_rows)),
+            [value for row in post_rows for value in row]
+        )
+        if structured_rows:
+            cursor.execute(
+                "INSERT INTO structured_responses (user_id, thread_id, query, disease, probability, severity, medication, other_diagnoses, conclusion) VALUES "
+                + ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(structured_rows)),
+                [value for row in structured_rows for value in row]
+            )
+        for params in title_updates:
+            cursor.execute("UPDATE chat_threads SET title = %s WHERE id = %s AND user_id = %s", params)
+        conn.commit()
+        for _, thread_id, user_id in title_updates:
+            _invalidate_threads(user_id, thread_id)
+        return True
+    except DB_ERRORS as err:
+        print(f"Persist Turn Error: {err}")
+        try:
+            conn.rollback()
+        except DB_ERRORS:
+            pass
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+def persist_turn(user_id, thread_id, user_text, image_filename=None, assistant_text=None, structured=None, title=None):
+    """Atomically saves a user post, the assistant reply, its structured response and the thread title."""
+    return persist_turns([build_turn(user_id, thread_id, user_text, image_filename, assistant_text, structured, title)])
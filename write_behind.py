@@ -0,0 +1,368 @@
+# write_behind.py
+"""
+Optional write-behind persistence for chat turns.
+
+When enabled, get_gemini_response hands each finished turn to a bounded in-process
+queue and returns immediately; a background writer thread drains the queue in batches
+through user_db_operations.persist_turns (one transaction per batch).
+
+- Durability: with a spool path configured, every turn is appended to a local JSON-lines
+  file (one per process, `<spool path>.<pid>`) before it is queued, and commit markers are
+  appended once it is in the database. Turns without a marker are replayed by the next
+  process that starts, once the process that wrote them has exited.
+- Failures: a batch that fails is retried one turn at a time. Turns that still fail while
+  others in their batch were written are dropped (counted as "rejected"); if none of them
+  can be written the database is treated as down and they stay in the spool for replay.
+- Backpressure: when the queue is full, submit() waits up to `enqueue_timeout` seconds and
+  then writes the turn synchronously on the caller's thread, so nothing is dropped.
+- Shutdown: shutdown() (registered with atexit) drains the queue before the process exits.
+"""
+
+import atexit
+import glob
+import json
+import os
+import queue
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, so run a single process per spool path
+    fcntl = None
+
+from config import Config
+from user_db_operations import persist_turns
+
+
+class WriteBehindWriter:
+    """Bounded queue + background thread that writes chat turns in batches."""
+
+    def __init__(self, write_batch, max_queue=1000, batch_size=50, flush_interval=0.2,
+                 spool_path=None, enqueue_timeout=0.5, max_retries=3, spool_fsync=False):
+        self._write_batch = write_batch
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.max_retries = max_retries
+
+        self.spool_path = spool_path
+        self._pid = os.getpid()
+        self.spool_file_path = f"{spool_path}.{self._pid}" if spool_path else None
+        self.spool_fsync = spool_fsync
+        self._spool_lock = threading.Lock()
+        self._spool_file = None
+        self._next_seq = 0
+        self._outstanding = 0  # spooled turns not yet committed
+
+        self._thread = None
+        self._stopping = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "submitted": 0,
+            "written": 0,
+            "batches": 0,
+            "retries": 0,
+            "failed": 0,
+            "rejected": 0,
+            "sync_fallbacks": 0,
+            "replayed": 0,
+        }
+
+    # --- Lifecycle ---
+
+    def start(self):
+        """Opens the spool, replays uncommitted turns and starts the writer thread."""
+        if self._thread is not None:
+            return
+        pending = self._open_spool() if self.spool_path else []
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        for turn in pending:
+            self.submit(turn)
+        self._bump("replayed", len(pending))
+        if pending:
+            print(f"Write-behind: replaying {len(pending)} uncommitted turn(s) from {self.spool_path}")
+
+    def flush(self, timeout=None):
+        """Blocks until every queued turn has been processed. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def shutdown(self, timeout=10.0):
+        """Drains the queue and stops the writer thread."""
+        if self._thread is None:
+            return
+        drained = self.flush(timeout)
+        self._stopping.set()
+        self._thread.join(timeout=max(self.flush_interval * 2, 1.0))
+        self._thread = None
+        with self._spool_lock:
+            if self._spool_file:
+                self._spool_file.close()
+                self._spool_file = None
+        if not drained:
+            print("Write-behind: shutdown timed out with turns still queued (they remain in the spool).")
+
+    # --- Producer side ---
+
+    def submit(self, turn):
+        """
+        Queues a turn for background persistence.
+
+        Returns:
+            bool: True if queued; False if the queue stayed full and the turn was written synchronously
+        """
+        seq = self._spool_append(turn)
+        self._bump("submitted")
+        try:
+            self._queue.put((seq, turn), timeout=self.enqueue_timeout)
+            return True
+        except queue.Full:
+            # Backpressure: the writer can't keep up, so this caller pays the DB write itself
+            self._bump("sync_fallbacks")
+            self._write_with_retries([(seq, turn)])
+            return False
+
+    # --- Writer thread ---
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                first = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                self._write_with_retries(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_with_retries(self, batch):
+        """
+        Writes a batch in one transaction. If that fails, its turns are retried one at a time, so
+        one bad turn (e.g. its thread was deleted meanwhile) can't sink the other turns in the batch.
+
+        Returns:
+            bool: True if every turn was written
+        """
+        if len(batch) > 1:
+            if self._attempt(batch):
+                return True
+            results = [self._write_one(entry) for entry in batch]
+            written = sum(results)
+            if written == 0:
+                # Not a bad turn but the database itself: keep every turn for replay (see _write_one)
+                self._report_failed(batch)
+                return False
+            rejected = [entry for entry, ok in zip(batch, results) if not ok]
+            if rejected:
+                self._drop(rejected)
+            return not rejected
+        if self._write_one(batch[0]):
+            return True
+        self._report_failed(batch)
+        return False
+
+    def _write_one(self, entry):
+        for attempt in range(self.max_retries + 1):
+            if self._attempt([entry]):
+                return True
+            if attempt < self.max_retries:
+                self._bump("retries")
+                time.sleep(min(0.1 * (2 ** attempt), 2.0))
+        return False
+
+    def _attempt(self, batch):
+        turns = [turn for _, turn in batch]
+        try:
+            ok = self._write_batch(turns)
+        except Exception as e:
+            print(f"Write-behind batch error: {e}")
+            ok = False
+        if ok:
+            self._bump("batches")
+            self._bump("written", len(turns))
+            self._spool_commit([seq for seq, _ in batch])
+        return ok
+
+    def _report_failed(self, batch):
+        self._bump("failed", len(batch))
+        where = "kept in spool for replay" if self.spool_path else "dropped"
+        print(f"Write-behind: failed to persist {len(batch)} turn(s) after {self.max_retries} retries ({where}).")
+
+    def _drop(self, batch):
+        """Turns that failed while the rest of their batch was written: replaying them would fail again."""
+        self._bump("failed", len(batch))
+        self._bump("rejected", len(batch))
+        self._spool_commit([seq for seq, _ in batch])
+        for _, turn in batch:
+            print(f"Write-behind: dropped a turn for user {turn.get('user_id')} / thread {turn.get('thread_id')} "
+                  f"that failed on its own after {self.max_retries} retries.")
+
+    # --- Spool file ---
+
+    def _open_spool(self):
+        """
+        Collects uncommitted turns from spools whose process has exited and starts this process's own.
+
+        Every process spools to `<spool_path>.<pid>` and holds an exclusive flock on it while it
+        runs, so several workers can share WRITE_BEHIND_SPOOL_PATH: a starting worker replays (and
+        removes) only spool files nobody holds, never a running worker's. Startups are serialized
+        by `<spool_path>.lock`.
+        """
+        spool_dir = os.path.dirname(self.spool_path)
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+        pending = []
+        with open(self.spool_path + ".lock", "a") as startup_lock:
+            _flock(startup_lock, blocking=True)
+            # The bare path is the single-file spool of earlier versions
+            candidates = [self.spool_path] + sorted(glob.glob(glob.escape(self.spool_path) + ".*"))
+            for path in candidates:
+                if path.endswith(".lock") or not os.path.isfile(path):
+                    continue
+                with open(path, "r+", encoding="utf-8") as f:
+                    if not _flock(f, blocking=False):
+                        continue  # a running worker's spool
+                    pending.extend(_read_spool(f))
+                os.remove(path)
+            # Replayed turns are re-spooled into this file by submit()
+            self._spool_file = open(self.spool_file_path, "a", encoding="utf-8")
+            _flock(self._spool_file, blocking=True)
+            self._spool_file.truncate(0)
+        return pending
+
+    def _spool_append(self, turn):
+        with self._spool_lock:
+            self._next_seq += 1
+            seq = self._next_seq
+            if self._spool_file:
+                self._spool_write({"pid": self._pid, "seq": seq, "turn": turn})
+                self._outstanding += 1
+            return seq
+
+    def _spool_commit(self, seqs):
+        with self._spool_lock:
+            if not self._spool_file:
+                return
+            self._outstanding -= len(seqs)
+            if self._outstanding == 0:
+                # Everything spooled so far is in the database: start the file over
+                self._spool_file.seek(0)
+                self._spool_file.truncate()
+            else:
+                self._spool_write({"committed": [[self._pid, seq] for seq in seqs]})
+
+    def _spool_write(self, entry):
+        self._spool_file.write(json.dumps(entry) + "\n")
+        self._spool_file.flush()
+        if self.spool_fsync:
+            os.fsync(self._spool_file.fileno())
+
+    # --- Metrics ---
+
+    def _bump(self, counter, amount=1):
+        with self._stats_lock:
+            self._stats[counter] += amount
+
+    def stats(self):
+        """Returns write-behind counters and the current queue depth."""
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        snapshot["queue_depth"] = self._queue.qsize()
+        with self._spool_lock:
+            snapshot["spooled_pending"] = self._outstanding
+        return snapshot
+
+
+def _flock(f, blocking):
+    """Exclusive advisory lock on an open file. Returns False if another process holds it."""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        return True
+    except BlockingIOError:
+        return False
+
+
+def _read_spool(f):
+    """Uncommitted turns of one spool file, in submission order. Entries are keyed by (pid, seq)."""
+    records = {}
+    committed = set()
+    for line in f:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue  # torn final line from a crash mid-write
+        if "committed" in entry:
+            # Entries written before per-process spools carry bare seqs
+            committed.update(tuple(key) if isinstance(key, list) else (None, key) for key in entry["committed"])
+        else:
+            records[(entry.get("pid"), entry["seq"])] = entry["turn"]
+    return [turn for key, turn in sorted(records.items(), key=lambda item: item[0][1]) if key not in committed]
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Returns the started process-wide writer, or None when write-behind is disabled."""
+    global _writer
+    if not Config.WRITE_BEHIND_ENABLED:
+        return None
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                writer = WriteBehindWriter(
+                    persist_turns,
+                    max_queue=Config.WRITE_BEHIND_QUEUE_SIZE,
+                    batch_size=Config.WRITE_BEHIND_BATCH_SIZE,
+                    flush_interval=Config.WRITE_BEHIND_FLUSH_INTERVAL,
+                    spool_path=Config.WRITE_BEHIND_SPOOL_PATH or None,
+                    enqueue_timeout=Config.WRITE_BEHIND_ENQUEUE_TIMEOUT,
+                    spool_fsync=Config.WRITE_BEHIND_SPOOL_FSYNC,
+                )
+                writer.start()
+                atexit.register(writer.shutdown)
+                _writer = writer
+    return _writer
+
+def save_turn(turn):
+    """
+    Persists a turn built with user_db_operations.build_turn.
+    Goes through the write-behind queue when enabled, otherwise writes synchronously.
+
+    Returns:
+        bool: True if the turn was queued or written
+    """
+    writer = get_writer()
+    if writer is None:
+        return persist_turns([turn])
+    writer.submit(turn)
+    return True
+
+def flush_pending_turns(timeout=2.0):
+    """Waits for queued turns to reach the database (used before reading history back)."""
+    if _writer is not None:
+        return _writer.flush(timeout)
+    return True